@@ -5,7 +5,9 @@ Demonstrates intelligent customer service routing with escalation capabilities
 """
 
 import json
+import os
 import random
+import sys
 import requests
 from typing import Dict, Any
 from dataclasses import dataclass
@@ -19,6 +21,14 @@ except ImportError:
     print("Note: This demo requires 'pip install crewai langchain-openai pydantic'")
     print("For demonstration purposes, we'll show the structure without actual execution")
 
+# Optionally (INPUT_GOVERNOR_ENABLED=1) trim long messages before they reach the emotion API
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modal-mcp"))
+try:
+    import input_governor
+    INPUT_GOVERNOR = input_governor.from_env()
+except ImportError:
+    INPUT_GOVERNOR = None
+
 # Configuration
 class CustomerSentiment(Enum):
     HAPPY = "happy"
@@ -75,6 +85,11 @@ class SentimentAnalysisTool(BaseTool):
     
     def _run(self, message: str) -> Dict[str, Any]:
         """Analyze sentiment of customer message using the emotion API"""
+        trimmed_tokens = 0
+        if INPUT_GOVERNOR is not None:
+            governed = INPUT_GOVERNOR.govern(message)
+            trimmed_tokens = governed.trimmed_tokens
+            message = governed.text
         try:
             # Call the emotion API
             response = requests.post(
@@ -112,7 +127,8 @@ class SentimentAnalysisTool(BaseTool):
                     "confidence": confidence,
                     "emotion_api_result": emotion,
                     "anger_indicators": anger_indicators,
-                    "frustration_indicators": frustration_indicators
+                    "frustration_indicators": frustration_indicators,
+                    "input_trimmed_tokens": trimmed_tokens
                 }
             else:
                 print(f"⚠️ Emotion API returned status {response.status_code}, falling back to keyword analysis")
@@ -0,0 +1,253 @@
+"""
+Admission control for upstream-bound work.
+
+At most ``max_inflight`` requests run at once; up to ``max_queue`` more wait
+for a slot (for at most ``queue_timeout`` seconds). Anything beyond that is
+rejected immediately with ``Overloaded``, carrying a Retry-After hint, so a
+burst cannot make every caller's latency grow without bound.
+
+Waiters are served shortest job first: each request carries an estimated
+cost (e.g. characters of text to classify) and the cheapest waiter gets the
+next free slot. To stop large jobs starving, every second spent waiting
+takes ``aging_rate`` off a waiter's cost. Since every waiter ages at the same
+rate, the order only depends on ``cost + aging_rate * enqueue_time``, which
+is fixed at enqueue time, so the queue is a plain heap.
+
+Requests can be split into priority lanes (e.g. interactive, default, bulk).
+A lane may hold ``reserved`` slots that no other lane can use, and the rest
+of the slots are shared. When a slot frees up, the lanes that have waiters
+and are allowed to run take turns in proportion to their ``weight`` (stride
+scheduling), so a flood of bulk work cannot push interactive calls out.
+Each lane has its own queue of up to ``max_queue`` waiters.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(RuntimeError):
+    """Raised when a request cannot be admitted. ``retry_after`` is in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "cancelled", "enqueued")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+        self.enqueued = time.monotonic()
+
+
+class Lane:
+    """A priority class: share of the slots by weight, plus slots reserved for it alone."""
+
+    def __init__(self, name, weight=1.0, reserved=0):
+        if weight <= 0 or reserved < 0:
+            raise ValueError("lane weight must be > 0 and reserved >= 0")
+        self.name = name
+        self.weight = float(weight)
+        self.reserved = int(reserved)
+        self.heap = []  # (priority, seq, waiter); timed-out waiters are dropped lazily
+        self.queued = 0
+        self.inflight = 0
+        self.pass_value = 0.0
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+
+    def stats(self):
+        return {
+            "weight": self.weight,
+            "reserved": self.reserved,
+            "inflight": self.inflight,
+            "queue_depth": self.queued,
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "mean_queue_wait_ms": (self.wait_total / self.queued_total * 1000.0) if self.queued_total else 0.0,
+        }
+
+
+def parse_lanes(spec):
+    """Parse "name:weight:reserved,..." (weight and reserved optional) into Lanes."""
+    lanes = []
+    for entry in spec.split(","):
+        parts = [p.strip() for p in entry.split(":")]
+        if not parts[0]:
+            continue
+        weight = float(parts[1]) if len(parts) > 1 and parts[1] else 1.0
+        reserved = int(parts[2]) if len(parts) > 2 and parts[2] else 0
+        lanes.append(Lane(parts[0], weight, reserved))
+    return lanes
+
+
+class AdmissionController:
+    """Bound concurrent work with bounded, per-lane wait queues.
+
+    policy is "sjf" (cheapest waiter first, with aging) or "fifo" and applies
+    within each lane. Without lanes everything goes through one "default" lane.
+    """
+
+    POLICIES = ("sjf", "fifo")
+
+    def __init__(self, max_inflight=32, max_queue=64, queue_timeout=10.0, min_retry_after=1.0,
+                 policy="sjf", aging_rate=1000.0, lanes=None, default_lane=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}; expected one of {', '.join(self.POLICIES)}")
+        lanes = list(lanes) if lanes else [Lane("default")]
+        reserved = sum(lane.reserved for lane in lanes)
+        if reserved > max_inflight:
+            raise ValueError(f"Lanes reserve {reserved} slots but max_inflight is {max_inflight}")
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.min_retry_after = min_retry_after
+        self.policy = policy
+        self.aging_rate = aging_rate
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.default_lane = self.lanes[default_lane] if default_lane in self.lanes else lanes[0]
+        self._shared_capacity = max_inflight - reserved
+
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._shared_used = 0
+        self._inflight = 0
+        self._virtual_time = 0.0
+        self._service_ewma = None
+
+    def lane(self, name):
+        """The lane called name, or the default lane."""
+        return self.lanes.get(name, self.default_lane)
+
+    def _retry_after(self, lane):
+        """Rough time until a new request could start: queued work / concurrency."""
+        service = self._service_ewma or 1.0
+        estimate = (lane.queued + 1) * service / max(1, lane.reserved + self._shared_capacity)
+        return max(self.min_retry_after, round(estimate, 1))
+
+    def _can_run(self, lane):
+        return lane.inflight < lane.reserved or self._shared_used < self._shared_capacity
+
+    def _start(self, lane):
+        if lane.inflight >= lane.reserved:
+            self._shared_used += 1
+        lane.inflight += 1
+        self._inflight += 1
+        lane.admitted += 1
+        self._virtual_time = lane.pass_value
+        lane.pass_value += 1.0 / lane.weight
+
+    def _dispatch(self):
+        """Hand free slots to waiting lanes, lowest pass value (most owed) first."""
+        while True:
+            ready = [lane for lane in self.lanes.values() if lane.queued and self._can_run(lane)]
+            if not ready:
+                return
+            lane = min(ready, key=lambda l: (l.pass_value, -l.weight))
+            while True:
+                _, _, waiter = heapq.heappop(lane.heap)
+                if not waiter.cancelled:
+                    break
+            lane.queued -= 1
+            self._start(lane)
+            waiter.granted = True
+            waiter.event.set()
+
+    def saturated(self, lane_name=None):
+        """True if a new request in the lane would be rejected right now."""
+        lane = self.lane(lane_name)
+        with self._lock:
+            return not self._can_run(lane) and lane.queued >= self.max_queue
+
+    def acquire(self, cost=1.0, lane_name=None, max_wait=None):
+        """Take an in-flight slot in a lane, waiting in its queue if needed. Raises Overloaded.
+
+        cost is the request's estimated size; it only matters under the sjf
+        policy. max_wait, if given, shortens queue_timeout (e.g. to the
+        caller's remaining deadline). Returns the Lane, which must be passed
+        back to release().
+        """
+        lane = self.lane(lane_name)
+        with self._lock:
+            if not lane.queued and self._can_run(lane):
+                self._start(lane)
+                return lane
+            if lane.queued >= self.max_queue:
+                lane.rejected += 1
+                raise Overloaded(f"Server overloaded: {lane.name} queue full", self._retry_after(lane))
+            if not lane.queued:
+                # A lane that was idle does not get credit for the time it had no work
+                lane.pass_value = max(lane.pass_value, self._virtual_time)
+            waiter = _Waiter()
+            seq = next(self._seq)
+            priority = cost + self.aging_rate * waiter.enqueued if self.policy == "sjf" else seq
+            heapq.heappush(lane.heap, (priority, seq, waiter))
+            lane.queued += 1
+            lane.queued_total += 1
+
+        waiter.event.wait(self.queue_timeout if max_wait is None else max(0.0, min(self.queue_timeout, max_wait)))
+        with self._lock:
+            lane.wait_total += time.monotonic() - waiter.enqueued
+            if waiter.granted:
+                return lane
+            waiter.cancelled = True
+            lane.queued -= 1
+            lane.timed_out += 1
+            if len(lane.heap) > 2 * self.max_queue:
+                lane.heap = [entry for entry in lane.heap if not entry[2].cancelled]
+                heapq.heapify(lane.heap)
+            raise Overloaded("Server overloaded: timed out waiting for a slot", self._retry_after(lane))
+
+    def release(self, lane, service_seconds=None):
+        """Give back a lane's slot and hand free slots to waiters."""
+        with self._lock:
+            if service_seconds is not None:
+                self._service_ewma = service_seconds if self._service_ewma is None else (
+                    0.2 * service_seconds + 0.8 * self._service_ewma)
+            lane.inflight -= 1
+            self._inflight -= 1
+            if lane.inflight >= lane.reserved:
+                self._shared_used -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, cost=1.0, lane_name=None, max_wait=None):
+        """Context manager running its body inside an admitted slot."""
+        lane = self.acquire(cost, lane_name, max_wait)
+        start = time.monotonic()
+        try:
+            yield lane
+        finally:
+            self.release(lane, time.monotonic() - start)
+
+    def stats(self):
+        with self._lock:
+            lanes = {name: lane.stats() for name, lane in self.lanes.items()}
+            queued_total = sum(l.queued_total for l in self.lanes.values())
+            return {
+                "max_inflight": self.max_inflight,
+                "max_queue": self.max_queue,
+                "policy": self.policy,
+                "inflight": self._inflight,
+                "shared_inflight": self._shared_used,
+                "queue_depth": sum(l.queued for l in self.lanes.values()),
+                "admitted": sum(l.admitted for l in self.lanes.values()),
+                "queued_total": queued_total,
+                "rejected": sum(l.rejected for l in self.lanes.values()),
+                "timed_out": sum(l.timed_out for l in self.lanes.values()),
+                "mean_queue_wait_ms": (sum(l.wait_total for l in self.lanes.values()) / queued_total * 1000.0)
+                if queued_total else 0.0,
+                "retry_after_seconds": self._retry_after(self.default_lane),
+                "lanes": lanes,
+            }
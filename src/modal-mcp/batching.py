@@ -0,0 +1,131 @@
+"""
+Micro-batching dispatcher for upstream emotion API calls.
+
+Tool calls submit single items; a collector thread groups whatever arrives
+within a short window (or until the batch is full) and hands the group to a
+dispatch function in one go. Results are scattered back to each caller's
+future.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """Collect submitted items into batches and dispatch them together.
+
+    ``dispatch_fn`` receives a list of items and must return a list of the
+    same length. An entry that is an ``Exception`` instance is raised to the
+    corresponding caller instead of being returned.
+    """
+
+    def __init__(self, dispatch_fn, max_batch_size=16, max_wait_ms=2.0,
+                 max_inflight_batches=4, name="batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.dispatch_fn = dispatch_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_inflight_batches)),
+                                            thread_name_prefix=f"{name}-dispatch")
+        self._stats_lock = threading.Lock()
+        self._fill_counts = [0] * (self.max_batch_size + 1)
+        self._items = 0
+        self._batches = 0
+        self._wait_total = 0.0
+
+        self._thread = threading.Thread(target=self._collect_loop, name=f"{name}-collector", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue an item for the next batch and return a Future for its result."""
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def call(self, item, timeout=None):
+        """Submit an item and block until its result is available."""
+        return self.submit(item).result(timeout=timeout)
+
+    def close(self):
+        """Stop the collector after draining what has already been queued."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=True)
+
+    def _collect_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+
+            self._record_batch(batch)
+            self._executor.submit(self._dispatch, batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.dispatch_fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: dispatch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            logger.error("%s: batch dispatch failed: %s", self.name, e)
+            results = [e] * len(items)
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _record_batch(self, batch):
+        now = time.monotonic()
+        waited = sum(now - enqueued for _, _, enqueued in batch)
+        with self._stats_lock:
+            self._fill_counts[len(batch)] += 1
+            self._batches += 1
+            self._items += len(batch)
+            self._wait_total += waited
+
+    def stats(self):
+        """Return batch counters and the batch-fill histogram."""
+        with self._stats_lock:
+            fill = {str(size): count for size, count in enumerate(self._fill_counts) if count}
+            batches, items, wait_total = self._batches, self._items, self._wait_total
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "items": items,
+            "mean_fill": (items / batches) if batches else 0.0,
+            "mean_wait_ms": (wait_total / items * 1000.0) if items else 0.0,
+            "queued": self._queue.qsize(),
+            "fill_histogram": fill,
+        }
@@ -0,0 +1,116 @@
+"""
+Confidence-gated cascade: answer from the fast model when it is sure enough.
+
+The emotion API has a cheap ``/predict`` path and slower, better ones
+(``/predict?accurate=1`` and ``/predict_detailed``). In auto mode a text is
+classified by the fast path first, and only sent on to the slow path when the
+fast confidence is below ``threshold``:
+
+    cascade = ConfidenceCascade(threshold=0.7, escalate_to="accurate")
+    result, escalated = cascade.run(lambda: fast(text), lambda: slow(text))
+
+The cascade keeps an exponentially weighted estimate of how long the fast
+and slow paths take, fed by its own calls and by slow-path calls made
+outside it (observe_slow()). Each timed call is credited with the
+difference between the slow-path estimate and what it actually cost (both
+paths when it escalated), which gives the average latency saved against
+always using the slow path.
+
+No dependencies outside the standard library, so the UI can use it too.
+"""
+
+import os
+import threading
+import time
+
+ESCALATION_TARGETS = ("accurate", "detailed")
+
+
+class ConfidenceCascade:
+    """Run fast, then slow only when the fast result's confidence is below threshold."""
+
+    def __init__(self, threshold=0.7, escalate_to="accurate", smoothing=0.1):
+        if escalate_to not in ESCALATION_TARGETS:
+            raise ValueError(f"escalate_to must be one of {', '.join(ESCALATION_TARGETS)}")
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError("threshold must be between 0 and 1")
+        self.threshold = threshold
+        self.escalate_to = escalate_to
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.escalated = 0
+        self.saved_seconds = 0.0
+        self._credited = 0  # calls made once a slow-path estimate existed
+        self.fast_seconds = None  # smoothed latency estimates
+        self.slow_seconds = None
+
+    def _smooth(self, current, sample):
+        return sample if current is None else current + self.smoothing * (sample - current)
+
+    def should_escalate(self, result, threshold=None):
+        """True if result (a prediction dict) is not confident enough to return."""
+        threshold = self.threshold if threshold is None else threshold
+        try:
+            return float(result.get("confidence")) < threshold
+        except (AttributeError, TypeError, ValueError):
+            return True  # no usable confidence: let the better model decide
+
+    def observe_slow(self, seconds):
+        """Record a slow-path call made outside the cascade (keeps the estimate current)."""
+        with self._lock:
+            self.slow_seconds = self._smooth(self.slow_seconds, seconds)
+
+    def record(self, fast_seconds, slow_seconds=None):
+        """Account for one cascaded call; slow_seconds is None unless it escalated."""
+        with self._lock:
+            self.calls += 1
+            self.fast_seconds = self._smooth(self.fast_seconds, fast_seconds)
+            if slow_seconds is not None:
+                self.escalated += 1
+                self.slow_seconds = self._smooth(self.slow_seconds, slow_seconds)
+            if self.slow_seconds is not None:
+                self.saved_seconds += self.slow_seconds - fast_seconds - (slow_seconds or 0.0)
+                self._credited += 1
+
+    def count(self, calls, escalated):
+        """Account for cascaded items whose latency is not measured one by one (a batch)."""
+        with self._lock:
+            self.calls += calls
+            self.escalated += escalated
+
+    def run(self, fast, slow, threshold=None):
+        """(result, escalated): fast(), or slow() if that result's confidence is below threshold."""
+        started = time.monotonic()
+        result = fast()
+        fast_seconds = time.monotonic() - started
+        if not self.should_escalate(result, threshold):
+            self.record(fast_seconds)
+            return result, False
+        started = time.monotonic()
+        result = slow()
+        self.record(fast_seconds, time.monotonic() - started)
+        return result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "escalate_to": self.escalate_to,
+                "calls": self.calls,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.calls, 4) if self.calls else 0.0,
+                "fast_latency_ms": round(self.fast_seconds * 1000.0, 2) if self.fast_seconds is not None else None,
+                "slow_latency_ms": round(self.slow_seconds * 1000.0, 2) if self.slow_seconds is not None else None,
+                "avg_latency_saved_ms": (round(self.saved_seconds / self._credited * 1000.0, 2)
+                                         if self._credited else 0.0),
+            }
+
+
+def from_env(environ=None, prefix="CASCADE_"):
+    """A ConfidenceCascade configured from <prefix>THRESHOLD and <prefix>ESCALATE_TO."""
+    env = os.environ if environ is None else environ
+    return ConfidenceCascade(
+        threshold=float(env.get(prefix + "THRESHOLD", "0.7")),
+        escalate_to=env.get(prefix + "ESCALATE_TO", "accurate"),
+    )
@@ -0,0 +1,73 @@
+"""
+Split long documents into model-sized chunks for parallel emotion analysis.
+"""
+
+import re
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# Sentence end: terminal punctuation (optionally followed by closing quotes/brackets) then whitespace
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+
+def _spans(text, pattern):
+    """Yield (start, end) spans of the non-empty pieces between pattern matches."""
+    start = 0
+    for match in pattern.finditer(text):
+        if text[start:match.start()].strip():
+            yield start, match.start()
+        start = match.end()
+    if text[start:].strip():
+        yield start, len(text)
+
+
+def _split_long(text, start, end, max_chars):
+    """Break an over-long span at whitespace so no piece exceeds max_chars."""
+    while end - start > max_chars:
+        cut = text.rfind(" ", start, start + max_chars)
+        if cut <= start:
+            cut = start + max_chars
+        yield start, cut
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if text[start:end].strip():
+        yield start, end
+
+
+def split_into_chunks(text, max_chars=600, granularity="sentence"):
+    """Split text into chunks of at most max_chars characters.
+
+    ``granularity`` is ``"sentence"`` (pack whole sentences up to max_chars) or
+    ``"paragraph"`` (one chunk per paragraph, long paragraphs split further).
+    Returns a list of {"start", "end", "text"} dicts; offsets index into ``text``.
+    """
+    if granularity not in ("sentence", "paragraph"):
+        raise ValueError("granularity must be 'sentence' or 'paragraph'")
+    max_chars = max(1, int(max_chars))
+
+    pieces = []
+    for p_start, p_end in _spans(text, _PARAGRAPH_BREAK):
+        if granularity == "paragraph":
+            pieces.extend(_split_long(text, p_start, p_end, max_chars))
+            continue
+        # Pack consecutive sentences of the paragraph into chunks up to max_chars
+        paragraph = text[p_start:p_end]
+        chunk_start = chunk_end = None
+        for s_start, s_end in _spans(paragraph, _SENTENCE_END):
+            s_start += p_start
+            s_end += p_start
+            if chunk_start is not None and s_end - chunk_start <= max_chars:
+                chunk_end = s_end
+                continue
+            if chunk_start is not None:
+                pieces.append((chunk_start, chunk_end))
+            if s_end - s_start > max_chars:
+                long_pieces = list(_split_long(text, s_start, s_end, max_chars))
+                pieces.extend(long_pieces[:-1])
+                chunk_start, chunk_end = long_pieces[-1]
+            else:
+                chunk_start, chunk_end = s_start, s_end
+        if chunk_start is not None:
+            pieces.append((chunk_start, chunk_end))
+
+    return [{"start": start, "end": end, "text": text[start:end].strip()} for start, end in pieces]
@@ -0,0 +1,95 @@
+"""
+JSON codec for the MCP hot paths.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. Responses are built as bytes: static results (initialize,
+tools/list) are encoded once at start-up and spliced into a JSON-RPC
+envelope per request, and tool results are encoded exactly once.
+
+Run ``python codec.py`` for a per-request microbenchmark.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+if orjson is not None:
+    def dumps(obj):
+        """Serialise obj to compact JSON bytes."""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj):
+        """Serialise obj to compact JSON bytes."""
+        return _encoder.encode(obj).encode("utf-8")
+
+    def loads(data):
+        """Parse JSON from bytes or str."""
+        return json.loads(data)
+
+
+_ENVELOPE_HEAD = b'{"jsonrpc":"2.0","id":'
+_TOOL_TEXT_HEAD = b',"result":{"content":[{"type":"text","text":'
+
+
+def result_envelope(request_id, result_bytes):
+    """JSON-RPC response around an already-encoded result."""
+    return b"".join((_ENVELOPE_HEAD, dumps(request_id), b',"result":', result_bytes, b"}"))
+
+
+def error_envelope(request_id, code, message, data=None):
+    """JSON-RPC error response."""
+    error = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return b"".join((_ENVELOPE_HEAD, dumps(request_id), b',"error":', dumps(error), b"}"))
+
+
+def tool_text_envelope(request_id, text, is_error=False):
+    """MCP tools/call response with a single text content item."""
+    return b"".join((
+        _ENVELOPE_HEAD, dumps(request_id), _TOOL_TEXT_HEAD, dumps(text),
+        b'}],"isError":true}}' if is_error else b'}],"isError":false}}',
+    ))
+
+
+def tool_json_envelope(request_id, obj, is_error=False):
+    """MCP tools/call response whose text content is obj encoded as JSON."""
+    return tool_text_envelope(request_id, dumps(obj).decode("utf-8"), is_error)
+
+
+def _benchmark(iterations=50000):
+    import timeit
+
+    tools = {"tools": [{"name": f"tool_{i}", "description": "x" * 80,
+                        "inputSchema": {"type": "object", "properties": {"text": {"type": "string"}}}}
+                       for i in range(4)]}
+    tools_bytes = dumps(tools)
+    text = "Emotion: joy (Confidence: 91.23%)"
+
+    cases = {
+        "tools/list  dict+json.dumps": lambda: json.dumps({"jsonrpc": "2.0", "id": 7, "result": tools}).encode(),
+        "tools/list  pre-encoded": lambda: result_envelope(7, tools_bytes),
+        "tool result dict+json.dumps(x2)": lambda: json.dumps({
+            "jsonrpc": "2.0", "id": 7,
+            "result": {"content": [{"type": "text", "text": json.dumps(text)}], "isError": False}}).encode(),
+        "tool result encode once": lambda: tool_text_envelope(7, text),
+    }
+    print(f"JSON backend: {BACKEND}")
+    for name, fn in cases.items():
+        seconds = timeit.timeit(fn, number=iterations)
+        print(f"{name:<34} {seconds / iterations * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,94 @@
+"""
+Request deadlines carried from the caller through every hop.
+
+A caller states its remaining budget in milliseconds, either in the
+``X-Request-Timeout-Ms`` header or in ``params._meta.timeoutMs`` of an MCP
+request. The server turns it into an absolute ``time.monotonic()`` deadline,
+caps its own waits and upstream timeouts to what is left, and drops work
+whose caller has already given up instead of sending it upstream.
+
+The deadline of the request being handled lives in a context variable.
+Context variables do not follow work into thread pools, so code that hands
+work to another thread passes the deadline along explicitly.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's deadline has passed before the work was done."""
+
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+def from_timeout_ms(value, now=None):
+    """Absolute deadline for a budget in milliseconds (str or number); None if absent or invalid."""
+    if value is None or value == "":
+        return None
+    try:
+        budget = float(value) / 1000.0
+    except (TypeError, ValueError):
+        return None
+    return (time.monotonic() if now is None else now) + max(0.0, budget)
+
+
+def earliest(*candidates):
+    """The earliest of the given deadlines, ignoring None."""
+    present = [d for d in candidates if d is not None]
+    return min(present) if present else None
+
+
+def current():
+    """Deadline of the request being handled on this thread, or None."""
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Run the body with deadline (tightened by any enclosing one) as the current deadline."""
+    effective = earliest(deadline, _current.get())
+    token = _current.set(effective)
+    try:
+        yield effective
+    finally:
+        _current.reset(token)
+
+
+def remaining(deadline):
+    """Seconds left until deadline (negative once passed), or None without a deadline."""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def check(deadline):
+    """Raise DeadlineExceeded if deadline has passed."""
+    if expired(deadline):
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def cap_timeout(timeout, deadline):
+    """timeout capped to the time left before deadline. Raises DeadlineExceeded if none is left."""
+    left = remaining(deadline)
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left if timeout is None else min(timeout, left)
+
+
+def header_value(deadline):
+    """Remaining budget to forward downstream in TIMEOUT_HEADER, or None."""
+    left = remaining(deadline)
+    if left is None:
+        return None
+    return str(max(0, int(left * 1000)))
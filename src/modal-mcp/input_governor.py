@@ -0,0 +1,275 @@
+"""
+Input-size governor: bound what each text costs the emotion model.
+
+Inference time grows with input length, so a pasted log or a whole email
+thread can hold the model for seconds. Before a text is sent upstream it is
+
+1. normalised: line endings unified, zero-width characters removed, runs of
+   spaces and blank lines collapsed;
+2. stripped of quoted replies ("> ..." lines, "On ... wrote:" and
+   "-----Original Message-----" blocks and what follows them) and, if
+   enabled, of signatures (everything after a "-- " line, a name or contact
+   block after a closing such as "Best regards," near the end, and "Sent
+   from my ..." lines);
+3. capped at ``max_tokens`` approximate tokens (words and punctuation
+   marks) using one of the policies:
+
+   - ``head``: keep the beginning;
+   - ``tail``: keep the end;
+   - ``head_tail``: keep both ends, where complaints and conclusions usually are;
+   - ``salient``: keep the most emotionally loaded sentences (exclamations,
+     capitals, emotion words), plus the first and last, in their original order.
+
+This module has no dependencies outside the standard library so the UI and
+the demos can use it as well as the MCP server.
+"""
+
+import os
+import re
+import threading
+
+POLICIES = ("head", "tail", "head_tail", "salient")
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_SPACES = re.compile(r"[ \t\f\v\u00a0]+")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*\n+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n+")
+
+# A line that starts a quoted earlier message; it and everything after it are dropped
+_REPLY_HEADER = re.compile(
+    r"^\s*(?:On\b.{0,200}\bwrote:\s*$"
+    r"|-{2,}\s*(?:Original|Forwarded) Message\s*-{2,}"
+    r"|From:\s.+$(?=\n(?:Sent|Date):))",
+    re.IGNORECASE | re.MULTILINE)
+_SIGNATURE_DELIMITER = re.compile(r"^-- ?$", re.MULTILINE)
+_SENT_FROM = re.compile(r"^\s*Sent from my .*$", re.IGNORECASE | re.MULTILINE)
+_CLOSING = re.compile(
+    r"^\s*(?:best|kind|warm)?\s*(?:regards|wishes|cheers|sincerely|yours(?: truly| sincerely)?|thanks|thank you|"
+    r"many thanks|best)\s*,?\s*$", re.IGNORECASE)
+# Closings only count as the start of a signature this close to the end
+_SIGNATURE_MAX_LINES = 6
+# ... and only when every line after them looks like a name or contact detail, not prose
+_SIGNATURE_LINE_MAX_CHARS = 60
+_SENTENCE_PUNCTUATION = re.compile(r"[!?]|\b[a-z]+[.;:](?:\s|$)")
+
+_EMOTION_WORDS = frozenset("""
+    angry anger furious mad hate hated awful terrible horrible unacceptable outraged disgusted disgusting
+    frustrated frustrating annoyed annoying disappointed disappointing upset sad unhappy sorry worried
+    afraid scared fear anxious confused stuck broken useless worst ridiculous
+    happy glad love loved great excellent amazing wonderful fantastic awesome thrilled delighted
+    grateful thank thanks appreciate pleased satisfied excited
+""".split())
+
+
+def count_tokens(text):
+    """Approximate token count: words plus punctuation marks."""
+    return sum(1 for _ in _TOKEN.finditer(text))
+
+
+def normalize_whitespace(text):
+    text = _ZERO_WIDTH.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    text = _SPACES.sub(" ", text)
+    text = "\n".join(line.strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def strip_quoted_replies(text):
+    """Drop quoted earlier messages. Returns (text, whether anything was removed)."""
+    stripped = text
+    match = _REPLY_HEADER.search(stripped)
+    if match and stripped[:match.start()].strip():
+        stripped = stripped[:match.start()]
+    lines = [line for line in stripped.split("\n") if not line.lstrip().startswith(">")]
+    if any(line.strip() for line in lines):
+        stripped = "\n".join(lines)
+    stripped = stripped.strip()
+    return stripped, stripped != text
+
+
+def _signature_line(line):
+    """True if line could be part of a name/contact block (short, no sentence punctuation)."""
+    return len(line) <= _SIGNATURE_LINE_MAX_CHARS and not _SENTENCE_PUNCTUATION.search(line)
+
+
+def strip_signature(text):
+    """Drop a trailing signature block. Returns (text, whether anything was removed)."""
+    stripped = _SENT_FROM.sub("", text)
+    match = _SIGNATURE_DELIMITER.search(stripped)
+    if match and stripped[:match.start()].strip():
+        stripped = stripped[:match.start()]
+    lines = stripped.rstrip().split("\n")
+    for i in range(max(1, len(lines) - _SIGNATURE_MAX_LINES), len(lines) - 1):
+        if _CLOSING.match(lines[i]) and all(_signature_line(line) for line in lines[i + 1:]):
+            # Keep the closing itself ("Thanks," carries tone), drop the name and contact lines
+            lines = lines[:i + 1]
+            break
+    stripped = "\n".join(lines).strip()
+    return stripped, stripped != text
+
+
+def _sentences(text):
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        if text[start:match.start()].strip():
+            yield text[start:match.start()].strip()
+        start = match.end()
+    if text[start:].strip():
+        yield text[start:].strip()
+
+
+def _salience(sentence):
+    words = re.findall(r"[A-Za-z']+", sentence)
+    score = sum(1.0 for w in words if w.lower() in _EMOTION_WORDS)
+    score += 0.5 * sum(1 for w in words if len(w) > 2 and w.isupper())
+    score += 0.5 * min(3, sentence.count("!"))
+    return score / max(1.0, len(words) ** 0.5)
+
+
+def _token_spans(text):
+    return [m.span() for m in _TOKEN.finditer(text)]
+
+
+def truncate(text, max_tokens, policy="head_tail"):
+    """Cut text to at most max_tokens approximate tokens according to policy."""
+    spans = _token_spans(text)
+    if len(spans) <= max_tokens:
+        return text
+    if policy == "head":
+        return text[:spans[max_tokens - 1][1]]
+    if policy == "tail":
+        return text[spans[-max_tokens][0]:]
+    if policy == "head_tail":
+        head = max_tokens // 2
+        tail = max_tokens - head - 1  # one token for the ellipsis
+        return text[:spans[head - 1][1]] + " … " + text[spans[-tail][0]:] if tail > 0 else text[:spans[head - 1][1]]
+    if policy == "salient":
+        sentences = list(_sentences(text))
+        costs = [count_tokens(s) for s in sentences]
+        order = sorted(range(len(sentences)), key=lambda i: (i not in (0, len(sentences) - 1), -_salience(sentences[i])))
+        keep, used = set(), 0
+        for i in order:
+            if used + costs[i] <= max_tokens:
+                keep.add(i)
+                used += costs[i]
+        if not keep:
+            return truncate(text, max_tokens, "head")
+        return " ".join(sentences[i] for i in sorted(keep))
+    raise ValueError(f"Unknown policy {policy!r}; expected one of {', '.join(POLICIES)}")
+
+
+class GovernedText:
+    """A governed text and what was done to it."""
+
+    __slots__ = ("text", "original_chars", "original_tokens", "tokens", "quotes_removed", "signature_removed",
+                 "truncated")
+
+    def __init__(self, text, original_chars, original_tokens, tokens, quotes_removed, signature_removed, truncated):
+        self.text = text
+        self.original_chars = original_chars
+        self.original_tokens = original_tokens
+        self.tokens = tokens
+        self.quotes_removed = quotes_removed
+        self.signature_removed = signature_removed
+        self.truncated = truncated
+
+    @property
+    def trimmed_tokens(self):
+        return self.original_tokens - self.tokens
+
+    def as_dict(self):
+        return {
+            "original_chars": self.original_chars,
+            "chars": len(self.text),
+            "original_tokens": self.original_tokens,
+            "tokens": self.tokens,
+            "quotes_removed": self.quotes_removed,
+            "signature_removed": self.signature_removed,
+            "truncated": self.truncated,
+        }
+
+
+class InputGovernor:
+    """Apply normalisation, reply/signature stripping and a token cap, and count the effect."""
+
+    def __init__(self, max_tokens=384, policy="head_tail", strip_quotes=True, strip_signatures=False):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}; expected one of {', '.join(POLICIES)}")
+        if max_tokens < 2:
+            raise ValueError("max_tokens must be at least 2")
+        self.max_tokens = max_tokens
+        self.policy = policy
+        self.strip_quotes = strip_quotes
+        self.strip_signatures = strip_signatures
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.trimmed = 0
+        self.truncated = 0
+        self.quotes_removed = 0
+        self.signatures_removed = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.max_tokens_in = 0
+
+    def govern(self, text):
+        """Return a GovernedText for text. A text that ends up empty is kept as normalised."""
+        original_tokens = count_tokens(text)
+        governed = normalize_whitespace(text)
+        quotes = signature = False
+        if self.strip_quotes:
+            candidate, quotes = strip_quoted_replies(governed)
+            governed = candidate or governed
+        if self.strip_signatures:
+            candidate, signature = strip_signature(governed)
+            governed = candidate or governed
+        tokens = count_tokens(governed)
+        truncated = tokens > self.max_tokens
+        if truncated:
+            governed = truncate(governed, self.max_tokens, self.policy)
+            tokens = count_tokens(governed)
+        result = GovernedText(governed, len(text), original_tokens, tokens, quotes, signature,
+                              self.policy if truncated else None)
+        with self._lock:
+            self.texts += 1
+            self.trimmed += result.trimmed_tokens > 0
+            self.truncated += truncated
+            self.quotes_removed += quotes
+            self.signatures_removed += signature
+            self.tokens_in += original_tokens
+            self.tokens_out += tokens
+            self.max_tokens_in = max(self.max_tokens_in, original_tokens)
+        return result
+
+    def __call__(self, text):
+        """The governed text only."""
+        return self.govern(text).text
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "policy": self.policy,
+                "texts": self.texts,
+                "trimmed": self.trimmed,
+                "truncated": self.truncated,
+                "quotes_removed": self.quotes_removed,
+                "signatures_removed": self.signatures_removed,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_removed_ratio": round(1.0 - self.tokens_out / self.tokens_in, 4) if self.tokens_in else 0.0,
+                "largest_input_tokens": self.max_tokens_in,
+            }
+
+
+def from_env(environ=None, prefix="INPUT_"):
+    """An InputGovernor configured from <prefix>MAX_TOKENS, <prefix>POLICY, <prefix>STRIP_QUOTES and
+    <prefix>STRIP_SIGNATURES if <prefix>GOVERNOR_ENABLED is "1", otherwise None (texts pass unchanged)."""
+    env = os.environ if environ is None else environ
+    if env.get(prefix + "GOVERNOR_ENABLED", "0") != "1":
+        return None
+    return InputGovernor(
+        max_tokens=int(env.get(prefix + "MAX_TOKENS", "384")),
+        policy=env.get(prefix + "POLICY", "head_tail"),
+        strip_quotes=env.get(prefix + "STRIP_QUOTES", "1") == "1",
+        strip_signatures=env.get(prefix + "STRIP_SIGNATURES", "0") == "1",
+    )
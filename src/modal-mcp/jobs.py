@@ -0,0 +1,346 @@
+"""
+Background classification jobs with a persistent store.
+
+A caller submits a list of texts and gets a job id back immediately. A small
+pool of job workers processes jobs a chunk at a time; after every chunk the
+chunk's results and the job's progress are written to SQLite in one
+transaction (a checkpoint), so callers can read partial results while the
+job runs, and a job interrupted by a restart resumes from its last
+checkpoint instead of starting over.
+
+A running job holds a lease under a token unique to that run, which a
+heartbeat renews while the run is alive (including while a slow chunk is
+being classified). Jobs that are queued with nobody working on them, or
+whose lease has lapsed (their worker or process died), are picked up again
+by whichever process finds them first, so several server processes can
+share one database file. A run whose job was taken over finds out at its
+next checkpoint and stops; results are keyed by item index, and progress is
+counted from the distinct stored items, so an item is never counted twice.
+
+Finished jobs are deleted ``retention_seconds`` after they end, and the
+oldest finished jobs are deleted once more than ``max_jobs`` are stored.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    options TEXT NOT NULL,
+    texts TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    counts TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    owner TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+-- Lets result streams seek to the rows stored since their last poll (the index carries the rowid)
+CREATE INDEX IF NOT EXISTS job_results_seq ON job_results (job_id);
+"""
+
+
+class JobNotFound(KeyError):
+    """Raised when a job id is unknown (or its results have been deleted)."""
+
+
+class JobStore:
+    """SQLite-backed job table and per-item results."""
+
+    def __init__(self, path, retention_seconds=86400.0, max_jobs=1000):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.max_jobs = max_jobs
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, texts, options):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, options, texts, total, created, updated) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(options), json.dumps(texts), len(texts), now, now))
+        return job_id
+
+    def claim(self, job_id, owner, lease_seconds):
+        """Take a job that is queued and unowned, or whose lease has lapsed. Returns True if claimed."""
+        now = time.time()
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, updated = ? WHERE id = ? AND status IN ('queued', 'running')"
+                " AND (owner IS NULL OR updated < ?)",
+                (owner, now, job_id, now - lease_seconds))
+            return cursor.rowcount == 1
+
+    def orphaned(self, lease_seconds, limit=16):
+        """Ids of active jobs nobody is working on."""
+        rows = self._conn().execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND (owner IS NULL OR updated < ?)"
+            " ORDER BY created LIMIT ?", (time.time() - lease_seconds, limit)).fetchall()
+        return [row["id"] for row in rows]
+
+    def renew(self, job_id, owner):
+        """Extend a running job's lease. Returns False if it is no longer this owner's."""
+        with self._conn() as conn:
+            cursor = conn.execute("UPDATE jobs SET updated = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                                  (time.time(), job_id, owner))
+            return cursor.rowcount == 1
+
+    def work(self, job_id):
+        """(texts, options, indexes already done) for a claimed job."""
+        conn = self._conn()
+        row = conn.execute("SELECT texts, options FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFound(job_id)
+        done = {r[0] for r in conn.execute("SELECT idx FROM job_results WHERE job_id = ?", (job_id,))}
+        return json.loads(row["texts"]), json.loads(row["options"]), done
+
+    def checkpoint(self, job_id, owner, items):
+        """Store a chunk of (index, result) items and renew the lease.
+
+        Items whose index is already stored are skipped, and done, errors and
+        the per-emotion counts only grow by the newly stored ones. Returns
+        False if the job was cancelled or taken over, in which case the worker
+        should stop.
+        """
+        with self._conn() as conn:
+            row = conn.execute("SELECT counts FROM jobs WHERE id = ? AND owner = ? AND status = 'running'",
+                               (job_id, owner)).fetchone()
+            if row is None:
+                return False
+            counts = json.loads(row["counts"])
+            stored = errors = 0
+            for index, result in items:
+                cursor = conn.execute("INSERT OR IGNORE INTO job_results (job_id, idx, result) VALUES (?, ?, ?)",
+                                      (job_id, index, json.dumps(result)))
+                if cursor.rowcount != 1:
+                    continue
+                stored += 1
+                if "error" in result:
+                    errors += 1
+                else:
+                    counts[result["emotion"]] = counts.get(result["emotion"], 0) + 1
+            conn.execute("UPDATE jobs SET done = done + ?, errors = errors + ?, counts = ?, updated = ? WHERE id = ?",
+                         (stored, errors, json.dumps(counts), time.time(), job_id))
+        return True
+
+    def finish(self, job_id, owner, status, error=None):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ?, finished = ?, texts = '[]'"
+                " WHERE id = ? AND owner = ? AND status = 'running'",
+                (status, error, now, now, job_id, owner))
+
+    def cancel(self, job_id):
+        """Cancel an active job. Returns its status afterwards."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ?, finished = ?, texts = '[]'"
+                " WHERE id = ? AND status IN ('queued', 'running')", (now, now, job_id))
+        return self.get(job_id)["status"]
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            "SELECT id, status, total, done, errors, counts, error, created, updated, finished FROM jobs WHERE id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFound(job_id)
+        job = dict(row)
+        job["counts"] = json.loads(job["counts"])
+        return job
+
+    def results(self, job_id, offset=0, limit=None):
+        """Stored results with index >= offset, in index order (partial while the job runs)."""
+        rows = self._conn().execute(
+            "SELECT result FROM job_results WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+            (job_id, offset, -1 if limit is None else limit)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def results_since(self, job_id, cursor):
+        """Results stored since the last call, for streaming.
+
+        cursor is a dict this method keeps up to date (start with {}). Items arrive out of index order when a job resumes, so the
+        cursor is the results' rowid, which only grows as rows are inserted.
+        """
+        rows = self._conn().execute(
+            "SELECT rowid, result FROM job_results WHERE job_id = ? AND rowid > ? ORDER BY rowid",
+            (job_id, cursor.get("rowid", 0))).fetchall()
+        if rows:
+            cursor["rowid"] = rows[-1][0]
+        return [json.loads(row[1]) for row in rows]
+
+    def purge(self):
+        """Delete expired finished jobs and the oldest ones beyond max_jobs. Returns how many."""
+        with self._conn() as conn:
+            expired = [r[0] for r in conn.execute(
+                "SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                (time.time() - self.retention_seconds,))]
+            excess = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - len(expired) - self.max_jobs
+            if excess > 0:
+                expired += [r[0] for r in conn.execute(
+                    "SELECT id FROM jobs WHERE finished IS NOT NULL AND finished >= ? ORDER BY finished LIMIT ?",
+                    (time.time() - self.retention_seconds, excess))]
+            for job_id in expired:
+                conn.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(expired)
+
+    def status_counts(self):
+        return {row[0]: row[1] for row in self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+
+class JobManager:
+    """Run stored jobs on a fixed number of background threads.
+
+    process(texts, options) classifies one chunk and returns one result dict
+    per text, in order, each with "emotion" or "error".
+    """
+
+    def __init__(self, store, process, workers=2, chunk_size=32, lease_seconds=60.0, scan_interval=5.0):
+        self.store = store
+        self.process = process
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.scan_interval = scan_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = {}  # job id -> claim token of this process's run
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.resumed = 0
+        self.items_processed = 0
+        self._threads = [threading.Thread(target=self._worker, name=f"job-worker_{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        if self._threads:
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, texts, options):
+        """Store a new job and queue it. Returns the job's status dict."""
+        job_id = self.store.create(texts, options)
+        self.submitted += 1
+        self._queue.put(job_id)
+        return self.store.get(job_id)
+
+    def _worker(self):
+        last_scan = 0.0
+        while True:
+            try:
+                job_id = self._queue.get(timeout=self.scan_interval)
+            except queue.Empty:
+                job_id = None
+            if time.monotonic() - last_scan >= self.scan_interval:
+                # Pick up jobs left behind by a restart or by another process that died
+                last_scan = time.monotonic()
+                try:
+                    self.store.purge()
+                    for orphan in self.store.orphaned(self.lease_seconds):
+                        self._queue.put(orphan)
+                except sqlite3.Error:
+                    pass
+            if job_id is not None:
+                self._run(job_id)
+
+    def _heartbeat(self):
+        """Renew the leases of this process's running jobs well before they lapse."""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                running = list(self._running.items())
+            for job_id, token in running:
+                try:
+                    self.store.renew(job_id, token)
+                except sqlite3.Error:
+                    pass
+
+    def _run(self, job_id):
+        token = f"{self.owner}-{uuid.uuid4().hex[:8]}"
+        with self._lock:
+            if job_id in self._running:
+                return  # already running here (re-queued by an orphan scan)
+            self._running[job_id] = token
+        try:
+            self._run_claimed(job_id, token)
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+    def _run_claimed(self, job_id, token):
+        try:
+            if not self.store.claim(job_id, token, self.lease_seconds):
+                return  # someone else has it, or it is finished or cancelled
+            texts, options, done = self.store.work(job_id)
+        except (JobNotFound, sqlite3.Error):
+            return
+        if done:
+            self.resumed += 1
+        remaining = [i for i in range(len(texts)) if i not in done]
+        try:
+            for start in range(0, len(remaining), self.chunk_size):
+                indexes = remaining[start:start + self.chunk_size]
+                results = self.process([texts[i] for i in indexes], options)
+                items = [(index, dict(result, index=index)) for index, result in zip(indexes, results)]
+                self.items_processed += len(items)
+                if not self.store.checkpoint(job_id, token, items):
+                    return  # cancelled or taken over
+            self.store.finish(job_id, token, "completed")
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            self.store.finish(job_id, token, "failed", str(e))
+
+    def stats(self):
+        try:
+            stored = self.store.status_counts()
+        except sqlite3.Error:
+            stored = {}
+        return {
+            "workers": len(self._threads),
+            "chunk_size": self.chunk_size,
+            "local_queue": self._queue.qsize(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "resumed": self.resumed,
+            "items_processed": self.items_processed,
+            "stored": stored,
+        }
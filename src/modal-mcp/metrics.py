@@ -0,0 +1,353 @@
+"""
+Lightweight in-process metrics: counters, gauges and latency histograms.
+
+Writers never take a lock: every thread owns a private set of value cells
+(one small list per labelled series) and only ever updates its own. Readers
+sum the cells of all threads when /health or /metrics is requested. Cells
+of threads that have exited are folded into a retired total, so the
+per-request threads of a threaded WSGI server do not accumulate.
+
+    registry = MetricsRegistry()
+    calls = registry.counter("tool_calls_total", "Tool calls", ("tool",))
+    calls.labels("emotion_detection").inc()
+    registry.render_prometheus()   # text exposition format
+    registry.as_dict()             # JSON-friendly summary
+
+With several worker processes, share_with_peers(directory) makes each one
+publish its values to a file every few seconds and add the other workers'
+latest files to everything it reports, so any worker can answer for all.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Fold dead threads' cells once this many shards have been registered
+_MAX_SHARDS = 256
+
+
+def _merge(into, cells):
+    for key, values in cells:
+        total = into.get(key)
+        if total is None:
+            into[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                total[i] += value
+
+
+class _ShardedCells:
+    """Per-thread value cells, summed on read."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (thread, cells dict)
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def cell(self, key, width):
+        """This thread's cell for key (a list of width floats)."""
+        cells = getattr(self._local, "cells", None)
+        if cells is None:
+            cells = self._local.cells = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), cells))
+                if len(self._shards) > _MAX_SHARDS:
+                    self._fold()
+        cell = cells.get(key)
+        if cell is None:
+            cell = cells[key] = [0.0] * width
+        return cell
+
+    def _fold(self):
+        live = []
+        for thread, cells in self._shards:
+            if thread.is_alive():
+                live.append((thread, cells))
+            else:
+                _merge(self._retired, list(cells.items()))
+        self._shards = live
+
+    def snapshot(self):
+        """Summed values for every key."""
+        with self._lock:
+            self._fold()
+            totals = {key: list(values) for key, values in self._retired.items()}
+            for _, cells in self._shards:
+                _merge(totals, list(cells.items()))
+        return totals
+
+
+class _Series:
+    __slots__ = ("_cells", "_key", "_width")
+
+    def __init__(self, cells, key, width):
+        self._cells = cells
+        self._key = key
+        self._width = width
+
+
+class _CounterSeries(_Series):
+    __slots__ = ()
+
+    def inc(self, amount=1.0):
+        self._cells.cell(self._key, 1)[0] += amount
+
+
+class _GaugeSeries(_CounterSeries):
+    __slots__ = ()
+
+    def dec(self, amount=1.0):
+        self._cells.cell(self._key, 1)[0] -= amount
+
+
+class _HistogramSeries(_Series):
+    __slots__ = ("_bounds",)
+
+    def __init__(self, cells, key, width, bounds):
+        super().__init__(cells, key, width)
+        self._bounds = bounds
+
+    def observe(self, value):
+        # Layout: one count per bucket (last is +Inf), then sum, then count
+        cell = self._cells.cell(self._key, self._width)
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+
+class _Metric:
+    kind = None
+    series_class = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._default = None if self.labelnames else self._make((name, ()))
+
+    def _width(self):
+        return 1
+
+    def _make(self, key):
+        return self.series_class(self.registry._cells, key, self._width())
+
+    def labels(self, *values):
+        """Series for one combination of label values (cached)."""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            series = self._series.setdefault(values, self._make((self.name, tuple(str(v) for v in values))))
+        return series
+
+    def __getattr__(self, attr):
+        # Unlabelled metrics: counter.inc() instead of counter.labels().inc()
+        default = self.__dict__.get("_default")
+        if default is None:
+            raise AttributeError(attr)
+        return getattr(default, attr)
+
+
+class Counter(_Metric):
+    kind = "counter"
+    series_class = _CounterSeries
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; or, with fn, a value computed at read time."""
+
+    kind = "gauge"
+    series_class = _GaugeSeries
+
+    def __init__(self, registry, name, help_text, labelnames=(), fn=None):
+        super().__init__(registry, name, help_text, labelnames)
+        self.fn = fn  # returns a number, or {label value tuple: number} for labelled gauges
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    series_class = _HistogramSeries
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(registry, name, help_text, labelnames)
+
+    def _width(self):
+        return len(self.bounds) + 3
+
+    def _make(self, key):
+        return _HistogramSeries(self.registry._cells, key, self._width(), self.bounds)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _quantile(bounds, buckets, count, q):
+    """Upper bound of the bucket holding the q-quantile (None past the last bound)."""
+    rank = q * count
+    seen = 0.0
+    for bound, n in zip(bounds, buckets):
+        seen += n
+        if seen >= rank:
+            return bound
+    return None
+
+
+class MetricsRegistry:
+    """Holds the metrics of one process and renders them."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._cells = _ShardedCells()
+        self._metrics = []
+        self._peers = None  # returns other processes' export() lists
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(self, self.prefix + name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), fn=None):
+        return self._register(Gauge(self, self.prefix + name, help_text, labelnames, fn))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(self, self.prefix + name, help_text, labelnames, buckets))
+
+    def _local_series(self):
+        """{metric name: {label values: values list}} for this process."""
+        by_metric = {}
+        for (name, labels), values in self._cells.snapshot().items():
+            by_metric.setdefault(name, {})[labels] = values
+        for metric in self._metrics:
+            if isinstance(metric, Gauge) and metric.fn is not None:
+                try:
+                    value = metric.fn()
+                except Exception:
+                    value = None
+                if isinstance(value, dict):
+                    by_metric[metric.name] = {tuple(str(v) for v in k): [float(x)] for k, x in value.items()}
+                elif value is not None:
+                    by_metric[metric.name] = {(): [float(value)]}
+        return by_metric
+
+    def export(self):
+        """This process's values as a JSON-serialisable list of [name, labels, values]."""
+        return [[name, list(labels), values]
+                for name, series in self._local_series().items() for labels, values in series.items()]
+
+    def _collect(self):
+        """Yield (metric, {label values: values list}) for every metric, summed over peers."""
+        by_metric = self._local_series()
+        if self._peers is not None:
+            for name, labels, values in (entry for snapshot in self._peers() for entry in snapshot):
+                series = by_metric.setdefault(name, {})
+                total = series.get(tuple(labels))
+                if total is None:
+                    series[tuple(labels)] = list(values)
+                elif len(total) == len(values):
+                    for i, value in enumerate(values):
+                        total[i] += value
+        for metric in self._metrics:
+            yield metric, by_metric.get(metric.name, {})
+
+    def share_with_peers(self, directory, interval=2.0):
+        """Publish this process's values to directory and include other processes' in reports.
+
+        Peer values are at most ``interval`` seconds old; files not refreshed
+        for five intervals (an exited worker) are ignored.
+        """
+        os.makedirs(directory, exist_ok=True)
+        own = f"{os.getpid()}.json"
+        path = os.path.join(directory, own)
+
+        def publish_loop():
+            while True:
+                tmp = path + ".tmp"
+                try:
+                    with open(tmp, "w") as f:
+                        json.dump(self.export(), f)
+                    os.replace(tmp, path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+
+        def peers():
+            snapshots = []
+            stale = time.time() - 5 * interval
+            for name in os.listdir(directory):
+                if name == own or not name.endswith(".json"):
+                    continue
+                try:
+                    file_path = os.path.join(directory, name)
+                    if os.path.getmtime(file_path) < stale:
+                        continue
+                    with open(file_path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+            return snapshots
+
+        self._peers = peers
+        threading.Thread(target=publish_loop, name="metrics-publisher", daemon=True).start()
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric, series in self._collect():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, values in sorted(series.items()):
+                if metric.kind != "histogram":
+                    lines.append(f"{metric.name}{_label_text(metric.labelnames, labels)} {_format_number(values[0])}")
+                    continue
+                cumulative = 0.0
+                for bound, n in zip(metric.bounds + (float("inf"),), values):
+                    cumulative += n
+                    le = _label_text(metric.labelnames, labels, ("le", _format_number(bound)))
+                    lines.append(f"{metric.name}_bucket{le} {_format_number(cumulative)}")
+                label_text = _label_text(metric.labelnames, labels)
+                lines.append(f"{metric.name}_sum{label_text} {_format_number(values[-2])}")
+                lines.append(f"{metric.name}_count{label_text} {_format_number(values[-1])}")
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self):
+        """JSON summary: label values joined by '/', histograms as count/mean/p50/p95/p99 in ms."""
+        result = {}
+        for metric, series in self._collect():
+            entries = {}
+            for labels, values in sorted(series.items()):
+                key = "/".join(labels) if labels else "total"
+                if metric.kind != "histogram":
+                    entries[key] = values[0]
+                    continue
+                count = values[-1]
+                summary = {"count": int(count), "mean_ms": round(values[-2] / count * 1000.0, 2) if count else 0.0}
+                for q in (0.5, 0.95, 0.99):
+                    bound = _quantile(metric.bounds, values, count, q) if count else None
+                    summary[f"p{int(q * 100)}_ms"] = round(bound * 1000.0, 2) if bound is not None else None
+                entries[key] = summary
+            result[metric.name[len(self.prefix):]] = entries
+        return result
@@ -0,0 +1,286 @@
+"""
+In-process pre-filter that answers obvious texts without calling the model.
+
+Many messages are short and say what they feel in so many words ("thank
+you!", "this is unacceptable"). A small weighted lexicon, in the spirit of
+the keyword fallback in the agentic routing demo, classifies those locally
+and forwards everything else to the emotion API. It abstains on anything it
+could misread:
+
+- texts longer than ``max_tokens``;
+- negated cues ("not happy", "never again thanks to you") and contrasts
+  ("great, but ...");
+- sarcasm markers ("oh great", "yeah right", "thanks a lot") and questions;
+- cues of more than one emotion;
+
+and otherwise only answers when its confidence (how much of the text the
+cues explain, and how strong they are) reaches ``min_confidence``.
+
+    prefilter = LexiconPrefilter(min_confidence=0.9)
+    prefilter.classify("Thank you so much!")   # {"emotion": "happiness", ...}
+    prefilter.classify("The invoice is attached")   # None: ask the model
+
+``python prefilter.py --benchmark labeled.csv [--api URL]`` measures it on
+labeled data (CSV with Sentence/Label columns or JSON lines with text/label):
+the share of traffic it would answer, its accuracy on that share, its
+agreement with the full model, and the model latency it would save.
+
+Standard library only, so the UI can use it too.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+
+# (phrase, weight) cues per emotion; phrases match whole words, case-insensitively
+LEXICON = {
+    "happiness": [("thank you", 1.0), ("thanks", 0.9), ("thank you so much", 1.2), ("much appreciated", 1.0),
+                  ("great", 0.8), ("awesome", 1.0), ("excellent", 1.0), ("wonderful", 1.0), ("fantastic", 1.0),
+                  ("amazing", 0.9), ("perfect", 0.9), ("happy", 1.0), ("glad", 0.9), ("delighted", 1.0),
+                  ("thrilled", 1.0), ("brilliant", 0.9), ("works now", 0.8), ("well done", 0.9), ("love it", 1.0)],
+    "anger": [("unacceptable", 1.2), ("furious", 1.2), ("outraged", 1.2), ("angry", 1.1), ("livid", 1.2),
+              ("ridiculous", 0.9), ("absurd", 0.8), ("fed up", 1.0), ("sick of", 0.9), ("i hate", 1.0),
+              ("pissed", 1.1), ("how dare", 1.1), ("disgrace", 1.0)],
+    "sadness": [("sad", 1.0), ("heartbroken", 1.2), ("devastated", 1.1), ("depressed", 1.1), ("miserable", 1.0),
+                ("unhappy", 0.9), ("i miss", 0.9), ("grieving", 1.1), ("lonely", 1.0)],
+    "fear": [("scared", 1.1), ("terrified", 1.2), ("afraid", 1.0), ("frightened", 1.1), ("panicking", 1.0),
+             ("worried", 0.8), ("anxious", 0.9)],
+    "love": [("i love you", 1.2), ("love you", 1.1), ("adore", 1.0), ("my love", 1.0)],
+    "disgust": [("disgusting", 1.2), ("gross", 1.0), ("revolting", 1.2), ("nauseating", 1.1), ("repulsive", 1.1)],
+    "confusion": [("confused", 1.1), ("makes no sense", 1.1), ("i don't understand", 1.0), ("puzzled", 1.0)],
+    "surprise": [("wow", 0.8), ("unexpected", 0.8), ("surprised", 1.0), ("astonished", 1.1)],
+}
+
+# Whole messages that carry no emotion
+NEUTRAL_MESSAGES = frozenset((
+    "ok", "okay", "k", "noted", "received", "acknowledged", "sure", "yes", "no", "hi", "hello", "hey", "fyi", "done",
+    "good morning", "see attached", "please see attached", "will do", "on it", "got it", "sounds good",
+))
+
+_TOKEN = re.compile(r"[a-z']+|[^\w\s]")
+_NEGATIONS = frozenset(("not", "no", "never", "nothing", "hardly", "barely", "without", "isn't", "wasn't", "aren't",
+                        "don't", "doesn't", "didn't", "won't", "can't", "couldn't", "shouldn't", "wouldn't",
+                        "nor", "neither", "cannot"))
+_CONTRASTS = frozenset(("but", "however", "although", "though", "yet", "except", "unless", "still"))
+_SARCASM = ("oh great", "just great", "yeah right", "thanks a lot", "thanks for nothing", "thanks a bunch",
+            "oh wonderful", "how wonderful", "just perfect", "oh perfect", "big surprise", "what a surprise",
+            "/ s", "lol")
+_STOPWORDS = frozenset(("a", "an", "the", "so", "very", "really", "much", "for", "to", "of", "and", "is", "it",
+                        "this", "that", "i", "i'm", "am", "you", "me", "my", "we", "are", "was", "be", "all",
+                        "just", "again", "too", "now", "your", "our", "with", "at", "on", "in", "totally",
+                        "absolutely", "completely", "quite", "such", "what", "lot"))
+# Negation scope: a cue this many tokens after a negation is considered negated
+_NEGATION_WINDOW = 3
+
+
+def _compile_lexicon(lexicon):
+    """{first word: [(phrase words, emotion, weight), ...]}, longest phrase first."""
+    index = {}
+    for emotion, phrases in lexicon.items():
+        for phrase, weight in phrases:
+            words = tuple(_TOKEN.findall(phrase.lower()))
+            index.setdefault(words[0], []).append((words, emotion, weight))
+    # Longest phrases first, so "thank you so much" wins over "thank you"
+    for cues in index.values():
+        cues.sort(key=lambda cue: -len(cue[0]))
+    return index
+
+
+class LexiconPrefilter:
+    """Classify short, unambiguous texts locally; return None for everything else."""
+
+    def __init__(self, min_confidence=0.9, max_tokens=24, lexicon=None):
+        self.min_confidence = min_confidence
+        self.max_tokens = max_tokens
+        self._cues = _compile_lexicon(lexicon or LEXICON)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.answered = 0
+        self.by_emotion = {}
+        self.abstained = {}
+
+    def _abstain(self, reason):
+        with self._lock:
+            self.abstained[reason] = self.abstained.get(reason, 0) + 1
+        return None
+
+    def _answer(self, emotion, confidence):
+        with self._lock:
+            self.answered += 1
+            self.by_emotion[emotion] = self.by_emotion.get(emotion, 0) + 1
+        return {"emotion": emotion, "confidence": round(confidence, 4), "source": "prefilter"}
+
+    def classify(self, text):
+        """{"emotion", "confidence", "source": "prefilter"} if the text is obvious, else None."""
+        with self._lock:
+            self.checked += 1
+        lowered = text.lower().strip()
+        if lowered.rstrip(".!") in NEUTRAL_MESSAGES:
+            return self._answer("neutral", 0.95)
+        tokens = _TOKEN.findall(lowered)
+        words = [t for t in tokens if t[0].isalpha()]
+        if not words:
+            return self._abstain("empty")
+        if len(words) > self.max_tokens:
+            return self._abstain("too_long")
+        if "?" in tokens:
+            return self._abstain("question")
+        padded = " " + " ".join(tokens) + " "
+        if any(f" {marker} " in padded for marker in _SARCASM):
+            return self._abstain("sarcasm")
+        if any(word in _CONTRASTS for word in words):
+            return self._abstain("contrast")
+
+        scores = {}
+        matched = [False] * len(words)
+        i = 0
+        while i < len(words):
+            for phrase, emotion, weight in self._cues.get(words[i], ()):
+                n = len(phrase)
+                if tuple(words[i:i + n]) == phrase:
+                    if any(w in _NEGATIONS for w in words[max(0, i - _NEGATION_WINDOW):i]):
+                        return self._abstain("negated")
+                    matched[i:i + n] = [True] * n
+                    scores[emotion] = scores.get(emotion, 0.0) + weight
+                    i += n
+                    break
+            else:
+                i += 1
+        if not scores:
+            return self._abstain("no_cue")
+        if len(scores) > 1:
+            return self._abstain("mixed")
+        if any(w in _NEGATIONS for w, m in zip(words, matched) if not m):
+            return self._abstain("negated")
+
+        emotion, strength = next(iter(scores.items()))
+        content = [m for w, m in zip(words, matched) if m or w not in _STOPWORDS]
+        coverage = sum(content) / len(content)
+        # Strong cues that explain most of the text; "!" adds a little conviction
+        confidence = min(0.99, (0.55 + 0.45 * coverage) * min(1.0, 0.75 + 0.25 * strength)
+                         + (0.02 if "!" in tokens else 0.0))
+        if confidence < self.min_confidence:
+            return self._abstain("low_confidence")
+        return self._answer(emotion, confidence)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_confidence": self.min_confidence,
+                "max_tokens": self.max_tokens,
+                "checked": self.checked,
+                "answered": self.answered,
+                "offload_rate": round(self.answered / self.checked, 4) if self.checked else 0.0,
+                "by_emotion": dict(self.by_emotion),
+                "abstained": dict(self.abstained),
+            }
+
+
+def from_env(environ=None, prefix="PREFILTER_"):
+    """A LexiconPrefilter configured from <prefix>MIN_CONFIDENCE and <prefix>MAX_TOKENS,
+    or None unless <prefix>ENABLED is "1"."""
+    env = os.environ if environ is None else environ
+    if env.get(prefix + "ENABLED", "0") != "1":
+        return None
+    return LexiconPrefilter(
+        min_confidence=float(env.get(prefix + "MIN_CONFIDENCE", "0.9")),
+        max_tokens=int(env.get(prefix + "MAX_TOKENS", "24")),
+    )
+
+
+# -- benchmark ------------------------------------------------------------------
+
+def load_labeled(path):
+    """[(text, label)] from a CSV with Sentence/Label (or text/label) columns, or JSON lines."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    samples = []
+    for row in rows:
+        row = {key.lower(): value for key, value in row.items()}
+        text, label = row.get("sentence") or row.get("text"), row.get("label")
+        if text and label:
+            samples.append((text, label.strip().lower()))
+    return samples
+
+
+def _model_prediction(api_url, text, timeout=30.0):
+    request = urllib.request.Request(api_url, data=json.dumps({"text": text}).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    started = time.monotonic()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        emotion = json.loads(response.read()).get("emotion")
+    return emotion, time.monotonic() - started
+
+
+def benchmark(samples, prefilter, api_url=None):
+    """Offload, accuracy, agreement with the model (if api_url) and latency saved, as a dict."""
+    answered = correct = agreed = compared = 0
+    prefilter_seconds = 0.0
+    model_seconds = []
+    model_correct = 0
+    for text, label in samples:
+        started = time.perf_counter()
+        result = prefilter.classify(text)
+        prefilter_seconds += time.perf_counter() - started
+        model_emotion = None
+        if api_url:
+            try:
+                model_emotion, seconds = _model_prediction(api_url, text)
+                model_seconds.append(seconds)
+                model_correct += model_emotion == label
+            except OSError as e:
+                print(f"Model call failed: {e}", file=sys.stderr)
+        if result is None:
+            continue
+        answered += 1
+        correct += result["emotion"] == label
+        if model_emotion is not None:
+            compared += 1
+            agreed += result["emotion"] == model_emotion
+    total = len(samples)
+    report = {
+        "samples": total,
+        "offloaded": answered,
+        "offload_rate": round(answered / total, 4) if total else 0.0,
+        "prefilter_accuracy_on_offloaded": round(correct / answered, 4) if answered else None,
+        "prefilter_ms_per_text": round(prefilter_seconds / total * 1000.0, 4) if total else 0.0,
+        "abstained": prefilter.stats()["abstained"],
+    }
+    if model_seconds:
+        mean_model = sum(model_seconds) / len(model_seconds)
+        report.update({
+            "model_accuracy": round(model_correct / len(model_seconds), 4),
+            "agreement_with_model_on_offloaded": round(agreed / compared, 4) if compared else None,
+            "model_ms_per_text": round(mean_model * 1000.0, 2),
+            # Offloaded texts skip a model call; every text pays for the pre-filter check
+            "latency_saved_ms_per_text": round((answered * mean_model - prefilter_seconds) / total * 1000.0, 2),
+        })
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the lexicon pre-filter on labeled data")
+    parser.add_argument("--benchmark", required=True, help="CSV (Sentence,Label) or JSON lines (text,label)")
+    parser.add_argument("--api", help="Emotion API /predict URL to compare against (e.g. http://localhost:8000/predict)")
+    parser.add_argument("--min-confidence", type=float, default=0.9)
+    parser.add_argument("--max-tokens", type=int, default=24)
+    parser.add_argument("--limit", type=int, default=0, help="Use only the first N samples")
+    args = parser.parse_args(argv)
+    samples = load_labeled(args.benchmark)
+    if args.limit:
+        samples = samples[:args.limit]
+    report = benchmark(samples, LexiconPrefilter(args.min_confidence, args.max_tokens), args.api)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Pre-fork multi-worker runner for the MCP web app.
+
+One Python process handles JSON and HTTP on a single core. This master binds
+the listening socket once, creates the shared-memory prediction cache
+(shm_cache.py) and forks ``--workers`` processes that each import the WSGI
+app and accept connections on the inherited socket; the kernel spreads the
+connections across them. Every worker maps the same cache, and publishes its
+metrics to a common directory so /health and /metrics on any worker report
+the totals of all of them. With MCP_CACHE_SNAPSHOT_PATH set, the master
+restores the cache from disk and snapshots it periodically and on exit.
+
+The master imports only the standard library and shm_cache, so the
+connection pools and thread pools the app creates at import time are
+created fresh in each worker. A worker that dies is replaced.
+
+    python -m prefork --workers 2 --port 8000 working_solution:web_app
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import shm_cache
+
+logger = logging.getLogger("prefork")
+
+# Set in the workers' environment (to the master's pid), so the app knows it runs under a master
+MASTER_ENV = "MCP_PREFORK_MASTER"
+
+
+def bind_socket(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock, app_spec):
+    """Worker body: import the app and serve on the inherited socket. Never returns."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        from werkzeug.serving import make_server
+
+        module_name, _, attr = app_spec.partition(":")
+        app = getattr(importlib.import_module(module_name), attr or "app")
+        host, port = sock.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+    except BaseException:
+        logger.exception("Worker %d failed", os.getpid())
+        code = 1
+    finally:
+        os._exit(code)
+
+
+class PreforkMaster:
+    """Fork workers over one listening socket and keep them running."""
+
+    def __init__(self, app_spec, host="0.0.0.0", port=8000, workers=2, respawn_delay=1.0):
+        self.app_spec = app_spec
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.respawn_delay = respawn_delay
+        self._children = {}  # pid -> worker number
+        self._stopping = False
+
+    def _spawn(self, number):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(self._sock, self.app_spec)
+        self._children[pid] = number
+        logger.info("Started worker %d (pid %d)", number, pid)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """Bind, fork the workers and supervise them until SIGTERM/SIGINT."""
+        self._sock = bind_socket(self.host, self.port)
+        if os.environ.get("MCP_CACHE_ENABLED", "1") == "1":
+            # Entries restored by the master's thread show up in every worker
+            cache = shm_cache.create_shared(**shm_cache.settings_from_env())
+            shm_cache.warm_start(cache, **shm_cache.snapshot_settings_from_env())
+        shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        metrics_dir = tempfile.mkdtemp(prefix="mcp-metrics-", dir=shm_dir)
+        os.environ["MCP_METRICS_DIR"] = metrics_dir
+        os.environ["MCP_WORKER_COUNT"] = str(self.workers)
+        os.environ[MASTER_ENV] = str(os.getpid())
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        try:
+            for number in range(self.workers):
+                self._spawn(number)
+            while self._children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+                except InterruptedError:
+                    continue
+                number = self._children.pop(pid, None)
+                try:
+                    os.unlink(os.path.join(metrics_dir, f"{pid}.json"))
+                except OSError:
+                    pass
+                if number is None or self._stopping:
+                    continue
+                logger.warning("Worker %d (pid %d) exited with status %d; restarting", number, pid, status)
+                time.sleep(self.respawn_delay)
+                if not self._stopping:
+                    self._spawn(number)
+        finally:
+            self._sock.close()
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("app", help="WSGI app as module:attribute, e.g. working_solution:web_app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    PreforkMaster(args.app, args.host, args.port, max(1, args.workers)).run()
+
+
+if __name__ == "__main__":
+    main()
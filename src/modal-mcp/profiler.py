@@ -0,0 +1,170 @@
+"""
+On-demand statistical profiler for a running server.
+
+While a profile runs, the requesting thread wakes every ``interval`` seconds,
+reads every other thread's current stack with ``sys._current_frames()`` and
+counts it. Nothing is instrumented and nothing runs between profiles, so the
+server pays only for the requests' tag()/untag() dict updates.
+
+Samples are attributed to the HTTP endpoint the thread is serving (set with
+tag() by the web app) or to its thread name for pool threads; untagged threads
+that are just parked on a lock or queue are skipped. Each stack is classified
+by its innermost recognisable frame, looking through lock and queue waits:
+upstream calls (including waiting on a batch or a failover), the admission
+queue, JSON encoding, Flask/Werkzeug, another wait, or the server's own code.
+Results come back as collapsed stacks (one ``frame;frame;frame count`` line
+per stack, the input format of flamegraph.pl and speedscope) plus a
+per-endpoint wall-time breakdown.
+"""
+
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running."""
+
+
+# (category, path fragments) checked from the innermost frame outwards
+_CATEGORIES = (
+    ("upstream", ("/requests/", "/urllib3/", "/http/client.py", "/ssl.py",
+                  "batching.py", "resilience.py", "upstream_pool.py")),
+    ("admission", ("admission.py",)),
+    ("json", ("/json/", "codec.py", "orjson")),
+    ("flask", ("/flask/", "/werkzeug/", "/socketserver.py", "/http/server.py", "/jinja2/")),
+)
+_WAIT_FRAGMENTS = ("/threading.py", "/queue.py", "/concurrent/futures/", "/selectors.py")
+# Socket I/O belongs to whoever called it (HTTP client or server)
+_PASS_THROUGH_FRAGMENTS = ("/socket.py", "/selectors.py")
+
+# Innermost frames of idle pool and accept-loop threads
+_IDLE_FRAMES = frozenset(("thread.py:_worker", "selectors.py:select", "socketserver.py:serve_forever"))
+
+_THREAD_NUMBER = re.compile(r"[-_]\d+.*$")
+
+
+def _is_wait(filename):
+    return any(fragment in filename for fragment in _WAIT_FRAGMENTS)
+
+
+def _classify(frames):
+    waiting = False
+    for filename, _ in reversed(frames):
+        for category, fragments in _CATEGORIES:
+            if any(fragment in filename for fragment in fragments):
+                return category
+        if any(fragment in filename for fragment in _PASS_THROUGH_FRAGMENTS):
+            continue
+        if _is_wait(filename):
+            waiting = True
+        else:
+            break
+    return "waiting" if waiting else "app"
+
+
+class SamplingProfiler:
+    """Collect stack samples from all threads for a fixed duration."""
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._tags = {}  # thread ident -> endpoint label
+        self._lock = threading.Lock()
+        self._running = False
+        self.profiles_run = 0
+
+    def tag(self, label):
+        """Attribute the calling thread's samples to label (e.g. the request path)."""
+        self._tags[threading.get_ident()] = label
+
+    def untag(self):
+        self._tags.pop(threading.get_ident(), None)
+
+    @staticmethod
+    def _frame_label(code):
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _stack(self, frame):
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            frames.append((frame.f_code.co_filename, self._frame_label(frame.f_code)))
+            frame = frame.f_back
+        frames.reverse()
+        return frames
+
+    def profile(self, seconds):
+        """Sample all threads for ``seconds`` and return the aggregated result.
+
+        Blocks the caller for the duration. Raises ProfilerBusy if a profile is
+        already running.
+        """
+        with self._lock:
+            if self._running:
+                raise ProfilerBusy("A profile is already running")
+            self._running = True
+        try:
+            return self._profile_loop(seconds)
+        finally:
+            with self._lock:
+                self._running = False
+                self.profiles_run += 1
+
+    def _profile_loop(self, seconds):
+        me = threading.get_ident()
+        names = {}
+        stacks = collections.Counter()
+        endpoints = collections.defaultdict(collections.Counter)
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        overhead = 0.0
+        while True:
+            tick = time.monotonic()
+            if tick >= deadline:
+                break
+            frames = sys._current_frames()
+            if not names.keys() >= frames.keys():
+                # Pool threads are grouped by name prefix: "upstream_3" -> "upstream"
+                names = {t.ident: _THREAD_NUMBER.sub("", t.name) for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = self._stack(frame)
+                label = self._tags.get(ident)
+                if not stack or (label is None and (stack[-1][1] in _IDLE_FRAMES or _is_wait(stack[-1][0]))):
+                    continue
+                label = label or names.get(ident, "thread")
+                stacks[label + ";" + ";".join(name for _, name in stack)] += 1
+                endpoints[label][_classify(stack)] += 1
+            samples += 1
+            del frames
+            overhead += time.monotonic() - tick
+            time.sleep(max(0.0, min(self.interval, deadline - time.monotonic())))
+        elapsed = time.monotonic() - started
+
+        per_sample_ms = elapsed / samples * 1000.0 if samples else 0.0
+        breakdown = {}
+        for label, categories in endpoints.items():
+            total = sum(categories.values())
+            breakdown[label] = {
+                "samples": total,
+                "wall_ms": round(total * per_sample_ms, 1),
+                "categories_ms": {c: round(n * per_sample_ms, 1) for c, n in categories.most_common()},
+            }
+        return {
+            "seconds": round(elapsed, 3),
+            "interval_ms": self.interval * 1000.0,
+            "samples": samples,
+            "sampler_overhead_ms": round(overhead * 1000.0, 1),
+            "endpoints": dict(sorted(breakdown.items(), key=lambda item: -item[1]["samples"])),
+            "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {"running": self._running, "profiles_run": self.profiles_run,
+                    "tagged_threads": len(self._tags)}
@@ -0,0 +1,102 @@
+"""
+Per-client token-bucket rate limiting.
+
+Each client key gets a bucket of ``burst`` tokens refilled at ``rate`` tokens
+per second. Buckets live in an insertion-ordered dict that is kept in
+least-recently-used order, so lookups, refills and idle eviction are all
+O(1) (amortised) per request.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimitDecision:
+    """Outcome of one check, with the values for the X-RateLimit-* headers."""
+
+    __slots__ = ("allowed", "limit", "remaining", "reset_seconds", "retry_after")
+
+    def __init__(self, allowed, limit, remaining, reset_seconds, retry_after):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_seconds = reset_seconds
+        self.retry_after = retry_after
+
+    def headers(self):
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_seconds),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class TokenBucketLimiter:
+    """Token buckets keyed by client, with idle eviction and a cap on tracked clients."""
+
+    def __init__(self, rate=5.0, burst=20, idle_seconds=300.0, max_clients=10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be > 0 and burst >= 1")
+        self.rate = float(rate)
+        self.burst = int(burst)
+        self.idle_seconds = idle_seconds
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> [tokens, last_refill]; oldest activity first
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.evicted = 0
+
+    def _evict(self, now):
+        while self._buckets:
+            key, (_, last) = next(iter(self._buckets.items()))
+            if now - last < self.idle_seconds and len(self._buckets) <= self.max_clients:
+                break
+            del self._buckets[key]
+            self.evicted += 1
+
+    def check(self, key, cost=1.0):
+        """Take ``cost`` tokens from key's bucket if available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+            else:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            self._evict(now)
+
+            allowed = bucket[0] >= cost
+            if allowed:
+                bucket[0] -= cost
+                self.allowed += 1
+            else:
+                self.limited += 1
+            tokens = bucket[0]
+
+        deficit = max(0.0, cost - tokens)
+        return RateLimitDecision(
+            allowed=allowed,
+            limit=self.burst,
+            remaining=int(tokens),
+            reset_seconds=math.ceil((self.burst - tokens) / self.rate),
+            retry_after=max(1, math.ceil(deficit / self.rate)),
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "tracked_clients": len(self._buckets),
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "evicted": self.evicted,
+            }
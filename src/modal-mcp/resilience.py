@@ -0,0 +1,250 @@
+"""
+Upstream resilience helpers: a circuit breaker that fails fast while an
+upstream is unhealthy, and request hedging to cut tail latency.
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by a rolling window of outcomes.
+
+    The circuit opens when, over the last ``window`` calls (and at least
+    ``min_calls`` of them), the failure rate or the rate of calls slower than
+    ``slow_call_seconds`` reaches its threshold. After ``open_seconds`` up to
+    ``half_open_max_calls`` probe calls are let through; a successful probe
+    closes the circuit and a failed one re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, slow_call_seconds=10.0,
+                 slow_call_rate=0.8, open_seconds=10.0, half_open_max_calls=1):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque(maxlen=window)  # (failed, slow)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_inflight = 0
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._half_open_inflight = 0
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opened_count += 1
+        logger.warning("Circuit %s opened", self.name)
+
+    def acquire(self):
+        """Reserve permission to call the upstream, or raise CircuitOpenError."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.HALF_OPEN and self._half_open_inflight < self.half_open_max_calls:
+                self._half_open_inflight += 1
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"Circuit open for upstream {self.name}")
+
+    def record(self, succeeded, latency):
+        """Record the outcome of a call made after acquire()."""
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+                if succeeded and not slow:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info("Circuit %s closed", self.name)
+                else:
+                    self._trip()
+                return
+            if self._state == self.OPEN:
+                return
+            self._outcomes.append((not succeeded, slow))
+            total = len(self._outcomes)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            slows = sum(1 for _, was_slow in self._outcomes if was_slow)
+            if failures / total >= self.failure_rate or slows / total >= self.slow_call_rate:
+                self._trip()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn through the breaker."""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record(False, time.monotonic() - start)
+            raise
+        self.record(True, time.monotonic() - start)
+        return result
+
+    def stats(self):
+        with self._lock:
+            self._maybe_half_open()
+            total = len(self._outcomes)
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            return {
+                "state": self._state,
+                "window_calls": total,
+                "window_failure_rate": (failures / total) if total else 0.0,
+                "opened_count": self.opened_count,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyTracker:
+    """Recent-latency reservoir used to pick the hedge delay."""
+
+    def __init__(self, size=512):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(p / 100.0 * len(samples))) - 1))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class HedgeBudget:
+    """Global cap on hedged requests as a fraction of all hedgeable requests.
+
+    Shared by every Hedger so that, across all upstreams, at most
+    ``ratio`` extra requests are sent per primary request.
+    """
+
+    def __init__(self, ratio=0.05):
+        self.ratio = ratio
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+
+    def note_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def take(self):
+        with self._lock:
+            if self.hedges + 1 > self.ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ratio": self.ratio,
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": (self.hedges / self.requests) if self.requests else 0.0,
+            }
+
+
+class Hedger:
+    """Send a backup request when the primary is slower than the upstream's recent pXX latency.
+
+    Each upstream gets its own Hedger (and latency history); all of them draw
+    from one shared HedgeBudget.
+    """
+
+    def __init__(self, executor, budget, percentile=95.0, min_delay=0.05, min_samples=20):
+        self.executor = executor
+        self.budget = budget
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _delay(self):
+        if len(self.latency) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+
+    def _timed(self, fn, args, kwargs):
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.latency.observe(time.monotonic() - start)
+        return result
+
+    def run(self, fn, *args, **kwargs):
+        """Call fn, hedging once if it is slow. Returns the first successful result."""
+        self.budget.note_request()
+        primary = self.executor.submit(self._timed, fn, args, kwargs)
+        delay = self._delay()
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.take():
+            return primary.result()
+
+        with self._lock:
+            self.hedges += 1
+        hedge = self.executor.submit(self._timed, fn, args, kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stats(self):
+        with self._lock:
+            hedges, wins = self.hedges, self.hedge_wins
+        return {
+            "hedges": hedges,
+            "hedge_wins": wins,
+            "current_delay_seconds": self._delay(),
+        }
@@ -4,12 +4,28 @@ SaaS MCP Client - Connect to the public MCP server for SaaS tools
 This script can be used by SaaS tools to connect to your public MCP server
 """
 
-import sys
 import json
+import sys
 import requests
 import logging
 import os
 
+try:
+    import codec  # faster JSON (orjson) when codec.py sits next to this script
+except ImportError:
+    codec = None
+
+def _dumps(obj):
+    if codec is not None:
+        return codec.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _loads(data):
+    return codec.loads(data) if codec is not None else json.loads(data)
+
+def _error_envelope(request_id, code, message):
+    return _dumps({"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}})
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,32 +41,43 @@ class SaaSMCPClient:
     
     def handle_request(self, request_data):
         """Forward MCP request to public server"""
+        return _loads(self.forward(_dumps(request_data), request_data.get("id")))
+    
+    def forward(self, body, request_id=None):
+        """Forward an encoded MCP request and return the encoded response line.
+
+        The server's JSON is passed through as bytes rather than parsed and re-encoded.
+        """
         try:
             # Try the main MCP endpoint first
             response = self.session.post(
                 f"{self.server_url}/mcp",
-                json=request_data,
+                data=body,
                 timeout=30
             )
             response.raise_for_status()
-            return response.json()
+            return self._single_line(response.content)
         except requests.exceptions.RequestException as e:
             # Fallback to message endpoint for compatibility
             try:
                 response = self.session.post(
                     f"{self.server_url}/message",
-                    json=request_data,
+                    data=body,
                     timeout=30
                 )
                 response.raise_for_status()
-                return response.json()
+                return self._single_line(response.content)
             except requests.exceptions.RequestException as e2:
                 logger.error(f"Error calling MCP server: {e2}")
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request_data.get("id"),
-                    "error": {"code": -32603, "message": f"Server error: {str(e2)}"}
-                }
+                return _error_envelope(request_id, -32603, f"Server error: {str(e2)}")
+    
+    @staticmethod
+    def _single_line(content):
+        """stdio framing is one message per line; re-encode only if the server pretty-printed."""
+        content = content.strip()
+        if b"\n" in content:
+            content = _dumps(_loads(content))
+        return content
     
     def run_stdio(self):
         """Run the MCP client on stdio for SaaS tools"""
@@ -67,32 +94,25 @@ class SaaSMCPClient:
                 if not line:
                     continue
                 
-                # Parse JSON-RPC request
+                # Parse JSON-RPC request (only the id is needed locally)
                 try:
-                    request = json.loads(line)
-                except json.JSONDecodeError as e:
-                    error_response = {
-                        "jsonrpc": "2.0",
-                        "id": None,
-                        "error": {"code": -32700, "message": f"Parse error: {str(e)}"}
-                    }
-                    print(json.dumps(error_response), flush=True)
+                    request = _loads(line)
+                except ValueError as e:
+                    self._write(_error_envelope(None, -32700, f"Parse error: {str(e)}"))
                     continue
                 
-                # Forward to public server
-                response = self.handle_request(request)
-                
-                # Send response to stdout
-                print(json.dumps(response), flush=True)
+                # Forward the original line to the public server and relay its bytes
+                request_id = request.get("id") if isinstance(request, dict) else None
+                self._write(self.forward(line.encode("utf-8"), request_id))
                 
             except Exception as e:
                 logger.error(f"Error processing request: {e}")
-                error_response = {
-                    "jsonrpc": "2.0",
-                    "id": None,
-                    "error": {"code": -32603, "message": f"Client error: {str(e)}"}
-                }
-                print(json.dumps(error_response), flush=True)
+                self._write(_error_envelope(None, -32603, f"Client error: {str(e)}"))
+    
+    @staticmethod
+    def _write(data):
+        sys.stdout.buffer.write(data + b"\n")
+        sys.stdout.buffer.flush()
 
 def main():
     """Main function"""
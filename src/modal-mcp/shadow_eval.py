@@ -0,0 +1,196 @@
+"""
+Sampled shadow evaluation against a baseline model, off the request path.
+
+A fraction of live predictions (text plus the emotion we answered) is offered
+to a bounded queue. offer() never blocks: when the queue is full the sample
+is dropped and counted, so a slow baseline can never slow down callers. One
+background thread takes samples off the queue in batches, classifies them
+with the baseline and records how often the two agree, overall, per answer
+source (model, prefilter, escalated ...) and as a confusion table.
+
+The default baseline is the Hugging Face model used in
+``src/tests/test_agains_others.py`` (bhadresh-savani/distilbert-base-uncased-emotion,
+labels mapped the same way). It only knows six emotions, so agreement is
+computed over samples whose answered emotion is one of those ("comparable");
+the rest are counted but not judged. ``transformers`` is optional: without
+it the evaluator reports itself unavailable and stops sampling.
+"""
+
+import importlib.util
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+HF_BASELINE_MODEL = "bhadresh-savani/distilbert-base-uncased-emotion"
+# Same mapping as the comparison test: the baseline's labels to ours
+HF_LABEL_MAP = {"sadness": "sadness", "joy": "happiness", "love": "love", "anger": "anger", "fear": "fear",
+                "surprise": "surprise"}
+
+logger = logging.getLogger(__name__)
+
+
+def hf_baseline(model=HF_BASELINE_MODEL, threads=1):
+    """A scorer(texts) -> [emotion] backed by a transformers pipeline, loaded on first use.
+
+    Raises ImportError on first use if transformers is not installed.
+    """
+    state = {}
+
+    def score(texts):
+        classifier = state.get("pipeline")
+        if classifier is None:
+            from transformers import pipeline  # optional dependency
+            try:
+                import torch
+                torch.set_num_threads(threads)  # leave the CPUs to the request path
+            except ImportError:
+                pass
+            classifier = state["pipeline"] = pipeline("text-classification", model=model, truncation=True)
+        return [HF_LABEL_MAP.get(p["label"].lower(), "neutral") for p in classifier(list(texts))]
+
+    score.labels = frozenset(HF_LABEL_MAP.values())
+    return score
+
+
+class ShadowEvaluator:
+    """Mirror sampled (text, answer) pairs to a baseline in the background and count agreement.
+
+    scorer(texts) returns the baseline's emotion for each text; its optional
+    ``labels`` attribute is the set of emotions it can produce.
+    """
+
+    def __init__(self, scorer, sample_rate=0.01, queue_size=256, batch_size=16, flush_seconds=2.0,
+                 max_text_chars=2000):
+        self.scorer = scorer
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_text_chars = max_text_chars
+        self.labels = getattr(scorer, "labels", None)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self.sampled = 0
+        self.dropped = 0
+        self.scored = 0
+        self.comparable = 0
+        self.agreed = 0
+        self.failed_batches = 0
+        self.unavailable = None  # why the baseline cannot run, once known
+        self.batch_seconds = 0.0
+        self.by_source = {}  # source -> [comparable, agreed]
+        self.confusion = {}  # (our emotion, baseline emotion) -> count
+        self._thread = threading.Thread(target=self._worker, name="shadow-eval", daemon=True)
+        self._thread.start()
+
+    def offer(self, text, emotion, source="model"):
+        """Maybe queue (text, emotion) for scoring. Never blocks; returns True if queued."""
+        if self.unavailable or random.random() >= self.sample_rate or not isinstance(text, str):
+            return False
+        try:
+            self._queue.put_nowait((text[:self.max_text_chars], emotion, source))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.sampled += 1
+        return True
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        flush_at = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            try:
+                baseline = self.scorer([text for text, _, _ in batch])
+            except ImportError as e:
+                self.unavailable = f"baseline unavailable: {e}"
+                logger.warning("Shadow evaluation disabled: %s", e)
+                self._drain()
+                return
+            except Exception as e:
+                with self._lock:
+                    self.failed_batches += 1
+                logger.warning("Shadow evaluation batch failed: %s", e)
+                continue
+            self._record(batch, baseline, time.monotonic() - started)
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _record(self, batch, baseline, seconds):
+        with self._lock:
+            self.batch_seconds += seconds
+            for (_, ours, source), theirs in zip(batch, baseline):
+                self.scored += 1
+                self.confusion[(ours, theirs)] = self.confusion.get((ours, theirs), 0) + 1
+                if self.labels is not None and ours not in self.labels:
+                    continue
+                self.comparable += 1
+                counts = self.by_source.setdefault(source, [0, 0])
+                counts[0] += 1
+                if ours == theirs:
+                    self.agreed += 1
+                    counts[1] += 1
+
+    def stats(self):
+        with self._lock:
+            batches_ms = self.batch_seconds * 1000.0
+            return {
+                "sample_rate": self.sample_rate,
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "sampled": self.sampled,
+                "dropped": self.dropped,
+                "scored": self.scored,
+                "comparable": self.comparable,
+                "agreement": round(self.agreed / self.comparable, 4) if self.comparable else None,
+                "agreement_by_source": {source: round(agreed / compared, 4)
+                                        for source, (compared, agreed) in self.by_source.items() if compared},
+                "baseline_ms_per_text": round(batches_ms / self.scored, 2) if self.scored else None,
+                "failed_batches": self.failed_batches,
+                "unavailable": self.unavailable,
+                # The most frequent disagreements, as "ours->baseline"
+                "top_disagreements": {f"{ours}->{theirs}": n for (ours, theirs), n in sorted(
+                    ((pair, n) for pair, n in self.confusion.items() if pair[0] != pair[1]),
+                    key=lambda item: -item[1])[:5]},
+            }
+
+
+def from_env(environ=None, prefix="SHADOW_"):
+    """A ShadowEvaluator using the Hugging Face baseline, configured from <prefix>SAMPLE_RATE,
+    <prefix>QUEUE_SIZE, <prefix>BATCH_SIZE, <prefix>MODEL and <prefix>THREADS; None if the
+    sample rate is 0 (the default)."""
+    env = os.environ if environ is None else environ
+    sample_rate = float(env.get(prefix + "SAMPLE_RATE", "0"))
+    if sample_rate <= 0:
+        return None
+    evaluator = ShadowEvaluator(
+        hf_baseline(env.get(prefix + "MODEL", HF_BASELINE_MODEL), int(env.get(prefix + "THREADS", "1"))),
+        sample_rate=sample_rate,
+        queue_size=int(env.get(prefix + "QUEUE_SIZE", "256")),
+        batch_size=int(env.get(prefix + "BATCH_SIZE", "16")),
+    )
+    if importlib.util.find_spec("transformers") is None:
+        evaluator.unavailable = "transformers is not installed"
+        logger.warning("Shadow evaluation disabled: transformers is not installed")
+    return evaluator
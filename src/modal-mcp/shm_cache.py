@@ -0,0 +1,299 @@
+"""
+Prediction cache in shared memory, usable from every worker process.
+
+The cache is a fixed-size, 4-way set-associative hash table in an anonymous
+shared mmap. A pre-fork master creates it before forking (see prefork.py),
+so every worker maps the same memory and a prediction cached by one worker
+is a hit in all of them. Without a master, the process simply gets its own
+table.
+
+Each slot is ``slot_size`` bytes:
+
+    u32 version | u16 length | 2 pad | f64 expires_at | 16-byte key digest | value
+
+Writers lock the slot's set (a striped multiprocessing lock) and bump
+``version`` to odd while they write and back to even when done; readers take
+no lock and treat an odd or changed version as a miss (a seqlock).
+Full sets evict the entry that expires first.
+
+snapshot() writes the live entries to a file and restore() loads one back,
+so a restarted server starts warm. A snapshot is a header (magic, write
+time, fingerprint of the upstream configuration, entry count), one record
+per entry (key digest, absolute expiry, value) and a checksum over all of
+it. Files that are truncated, corrupt or from another configuration are
+ignored, and entries that expired meanwhile are skipped.
+"""
+
+import atexit
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import signal
+import struct
+import threading
+import time
+
+_HEADER = struct.Struct("<IHxxd16s")
+_VERSION = struct.Struct("<I")
+_INHERITED = None
+
+_SNAPSHOT_MAGIC = b"MCPCACH1"
+_SNAPSHOT_HEADER = struct.Struct("<8sd16sI")  # magic, written at, fingerprint digest, entries
+_RECORD = struct.Struct("<16sdH")  # key digest, expires at, value length
+_CHECKSUM_SIZE = 16
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(key):
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+
+class SharedPredictionCache:
+    """Fixed-size shared-memory cache mapping str keys to short byte values."""
+
+    def __init__(self, slots=65536, slot_size=512, ttl=3600.0, ways=4, lock_stripes=64):
+        if slot_size <= _HEADER.size:
+            raise ValueError(f"slot_size must be larger than {_HEADER.size}")
+        self.ways = ways
+        self.sets = max(1, slots // ways)
+        self.slots = self.sets * ways
+        self.slot_size = slot_size
+        self.max_value_size = slot_size - _HEADER.size
+        self.ttl = ttl
+        self._mem = mmap.mmap(-1, self.slots * slot_size)  # MAP_SHARED: survives fork
+        self._locks = [multiprocessing.Lock() for _ in range(lock_stripes)]
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.oversized = 0
+        self.restored = 0
+        self.snapshots_written = 0
+
+    def _locate(self, digest):
+        index = int.from_bytes(digest[:8], "little") % self.sets
+        return index, index * self.ways * self.slot_size
+
+    def get(self, key):
+        """Cached bytes for key, or None on a miss or an expired entry."""
+        digest = _digest(key)
+        _, base = self._locate(digest)
+        mem = self._mem
+        now = time.time()
+        for way in range(self.ways):
+            offset = base + way * self.slot_size
+            version, length, expires, slot_digest = _HEADER.unpack_from(mem, offset)
+            if version & 1 or slot_digest != digest or expires <= now:
+                continue
+            start = offset + _HEADER.size
+            value = mem[start:start + length]
+            if _VERSION.unpack_from(mem, offset)[0] != version:
+                break  # overwritten while reading
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, ttl=None, expires_at=None):
+        """Store value (bytes) under key. Returns False if it is too large for a slot."""
+        if len(value) > self.max_value_size:
+            self.oversized += 1
+            return False
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._store(_digest(key), value, expires_at)
+        self.stores += 1
+        return True
+
+    def _store(self, digest, value, expires_at):
+        index, base = self._locate(digest)
+        mem = self._mem
+        with self._locks[index % len(self._locks)]:
+            victim, victim_expires = base, None
+            for way in range(self.ways):
+                offset = base + way * self.slot_size
+                _, _, expires, slot_digest = _HEADER.unpack_from(mem, offset)
+                if slot_digest == digest:
+                    victim = offset
+                    break
+                if victim_expires is None or expires < victim_expires:
+                    victim, victim_expires = offset, expires
+            writing = (_VERSION.unpack_from(mem, victim)[0] + 1) & 0xFFFFFFFF
+            _VERSION.pack_into(mem, victim, writing)
+            start = victim + _HEADER.size
+            mem[start:start + len(value)] = value
+            _HEADER.pack_into(mem, victim, writing, len(value), expires_at, digest)
+            _VERSION.pack_into(mem, victim, (writing + 1) & 0xFFFFFFFF)
+
+    def snapshot(self, path, fingerprint=""):
+        """Atomically write every live entry to path. Returns the number of entries written."""
+        now = time.time()
+        mem = self._mem
+        records = []
+        for offset in range(0, self.slots * self.slot_size, self.slot_size):
+            version, length, expires, digest = _HEADER.unpack_from(mem, offset)
+            if version & 1 or expires <= now:
+                continue
+            start = offset + _HEADER.size
+            value = mem[start:start + length]
+            if _VERSION.unpack_from(mem, offset)[0] != version:
+                continue  # being rewritten; it will be in the next snapshot
+            records.append(_RECORD.pack(digest, expires, length) + value)
+        data = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, now, _digest(fingerprint), len(records)) + b"".join(records)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.write(hashlib.blake2b(data, digest_size=_CHECKSUM_SIZE).digest())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.snapshots_written += 1
+        return len(records)
+
+    def restore(self, path, fingerprint=""):
+        """Load a snapshot written by snapshot(). Returns the number of entries restored.
+
+        Returns 0 without loading anything if the file is missing, damaged or
+        was written for a different fingerprint; expired entries are skipped.
+        """
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < _SNAPSHOT_HEADER.size + _CHECKSUM_SIZE:
+                    return 0
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return 0
+        with data:
+            body = memoryview(data)[:size - _CHECKSUM_SIZE]
+            try:
+                if hashlib.blake2b(body, digest_size=_CHECKSUM_SIZE).digest() != data[size - _CHECKSUM_SIZE:]:
+                    logger.warning("Ignoring cache snapshot %s: checksum mismatch", path)
+                    return 0
+                magic, _, snapshot_fingerprint, count = _SNAPSHOT_HEADER.unpack_from(body, 0)
+                if magic != _SNAPSHOT_MAGIC or snapshot_fingerprint != _digest(fingerprint):
+                    logger.info("Ignoring cache snapshot %s: written for another configuration", path)
+                    return 0
+                now = time.time()
+                restored = 0
+                offset = _SNAPSHOT_HEADER.size
+                for _ in range(count):
+                    digest, expires, length = _RECORD.unpack_from(body, offset)
+                    offset += _RECORD.size
+                    if expires > now and length <= self.max_value_size:
+                        self._store(digest, bytes(body[offset:offset + length]), expires)
+                        restored += 1
+                    offset += length
+            finally:
+                body.release()
+        self.restored += restored
+        return restored
+
+    def stats(self):
+        """Capacity and this process's counters."""
+        lookups = self.hits + self.misses
+        return {
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "oversized": self.oversized,
+            "restored": self.restored,
+            "snapshots_written": self.snapshots_written,
+        }
+
+
+def settings_from_env():
+    """Cache size and TTL from MCP_CACHE_SLOTS / MCP_CACHE_SLOT_BYTES / MCP_CACHE_TTL_SECONDS."""
+    return {
+        "slots": int(os.environ.get("MCP_CACHE_SLOTS", "65536")),
+        "slot_size": int(os.environ.get("MCP_CACHE_SLOT_BYTES", "512")),
+        "ttl": float(os.environ.get("MCP_CACHE_TTL_SECONDS", "3600")),
+    }
+
+
+def snapshot_settings_from_env():
+    """Snapshot file, interval and fingerprint from MCP_CACHE_SNAPSHOT_PATH / _SECONDS / MCP_CACHE_FINGERPRINT.
+
+    The default fingerprint covers the upstream URLs, so cached predictions
+    from another model deployment are not restored.
+    """
+    fingerprint = os.environ.get("MCP_CACHE_FINGERPRINT") or "|".join(
+        os.environ.get(name, "") for name in ("EMOTION_API_URL", "EMOTION_API_URLS", "EMOTION_DETAILED_API_URL",
+                                              "EMOTION_BATCH_URL"))
+    return {
+        "path": os.environ.get("MCP_CACHE_SNAPSHOT_PATH", ""),
+        "interval": float(os.environ.get("MCP_CACHE_SNAPSHOT_SECONDS", "60")),
+        "fingerprint": fingerprint,
+    }
+
+
+def warm_start(cache, path, interval=60.0, fingerprint=""):
+    """Restore cache from path, then snapshot it every interval seconds, at exit and on SIGTERM.
+
+    Restoring runs on the snapshot thread, so startup does not wait for it;
+    entries become visible (in every process sharing the cache) as they load.
+    Does nothing without a path.
+    """
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def write_snapshot():
+        try:
+            cache.snapshot(path, fingerprint)
+        except OSError as e:
+            logger.warning("Cache snapshot to %s failed: %s", path, e)
+
+    def snapshot_loop():
+        started = time.monotonic()
+        restored = cache.restore(path, fingerprint)
+        logger.info("Restored %d cache entries from %s in %.1f ms", restored, path,
+                    (time.monotonic() - started) * 1000.0)
+        while True:
+            time.sleep(interval)
+            write_snapshot()
+
+    threading.Thread(target=snapshot_loop, name="cache-snapshot", daemon=True).start()
+    atexit.register(write_snapshot)
+    if threading.current_thread() is threading.main_thread():
+        _snapshot_on_sigterm(write_snapshot)
+
+
+def _snapshot_on_sigterm(write_snapshot):
+    """Write a snapshot on SIGTERM (atexit does not run then), then do what the previous handler did."""
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        write_snapshot()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def create_shared(**kwargs):
+    """Create the cache to be inherited by processes forked after this call."""
+    global _INHERITED
+    _INHERITED = SharedPredictionCache(**kwargs)
+    return _INHERITED
+
+
+def get_cache(**kwargs):
+    """The cache inherited from a pre-fork master, or a new process-local one."""
+    return _INHERITED if _INHERITED is not None else SharedPredictionCache(**kwargs)
+
+
+def is_inherited(cache):
+    """True if cache came from a pre-fork master (which then owns its snapshots)."""
+    return cache is not None and cache is _INHERITED
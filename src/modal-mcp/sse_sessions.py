@@ -0,0 +1,160 @@
+"""
+Session-based SSE transport for the MCP server.
+
+A client opens ``GET /sse`` and receives an ``endpoint`` event carrying its
+``/message?sessionId=...`` URL. The stream then stays open: JSON-RPC
+responses to messages posted for that session are pushed as ``message``
+events, with comment heartbeats in between so proxies keep the connection.
+Each session owns a bounded queue so one slow reader cannot grow memory
+without limit.
+"""
+
+import json
+import queue
+import threading
+import time
+import uuid
+
+_CLOSE = object()
+
+
+class SessionNotFound(KeyError):
+    """Raised when a message targets a session that does not exist."""
+
+
+class SessionQueueFull(RuntimeError):
+    """Raised when a session's outbound queue has no room left."""
+
+
+class SSESession:
+    """One connected SSE client and its outbound event queue."""
+
+    def __init__(self, session_id, max_queue):
+        self.id = session_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.created = time.time()
+        self.last_activity = self.created
+        self.delivered = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event, data, timeout=0.0):
+        """Queue an event for the stream. Returns False if the queue stayed full."""
+        try:
+            if timeout:
+                self.queue.put((event, data), timeout=timeout)
+            else:
+                self.queue.put_nowait((event, data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def has_room(self):
+        return not self.queue.full()
+
+
+def format_event(event, data):
+    """Encode one SSE event. ``data`` may be str, encoded JSON bytes or a JSON-serialisable object."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    elif not isinstance(data, str):
+        data = json.dumps(data, separators=(",", ":"))
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n"
+
+
+class SSESessionRegistry:
+    """Track open SSE sessions and route messages to their streams."""
+
+    def __init__(self, max_sessions=256, max_queue=64, heartbeat_interval=15.0, put_timeout=1.0,
+                 message_path="/message"):
+        self.max_sessions = max_sessions
+        self.max_queue = max_queue
+        self.heartbeat_interval = heartbeat_interval
+        self.put_timeout = put_timeout
+        self.message_path = message_path
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.total_sessions = 0
+        self.rejected_sessions = 0
+        self._closed_delivered = 0
+        self._closed_dropped = 0
+
+    def create(self):
+        """Register a new session, or return None if the session limit is reached."""
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                self.rejected_sessions += 1
+                return None
+            session = SSESession(str(uuid.uuid4()), self.max_queue)
+            self._sessions[session.id] = session
+            self.total_sessions += 1
+            return session
+
+    def find(self, session_id):
+        """Return the open session with this id, or None."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or session.closed:
+            return None
+        return session
+
+    def get(self, session_id):
+        session = self.find(session_id)
+        if session is None:
+            raise SessionNotFound(session_id)
+        return session
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._closed_delivered += session.delivered
+                self._closed_dropped += session.dropped
+        if session is not None:
+            session.closed = True
+            try:
+                session.queue.put_nowait((_CLOSE, None))
+            except queue.Full:
+                pass
+
+    def publish(self, session_id, message, event="message"):
+        """Push a JSON-RPC message to a session's stream, waiting briefly for queue space."""
+        session = self.get(session_id)
+        if not session.put(event, message, timeout=self.put_timeout):
+            raise SessionQueueFull(session_id)
+        return True
+
+    def stream(self, session):
+        """Generator yielding the SSE byte stream for ``session`` until the client goes away."""
+        try:
+            yield format_event("endpoint", f"{self.message_path}?sessionId={session.id}")
+            while not session.closed:
+                try:
+                    event, data = session.queue.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield f": heartbeat {int(time.time())}\n\n"
+                    continue
+                if event is _CLOSE:
+                    break
+                session.delivered += 1
+                session.last_activity = time.time()
+                yield format_event(event, data)
+        finally:
+            # Runs on normal end and on GeneratorExit when the client disconnects
+            self.close(session.id)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            closed_delivered, closed_dropped = self._closed_delivered, self._closed_dropped
+        return {
+            "active_sessions": len(sessions),
+            "total_sessions": self.total_sessions,
+            "rejected_sessions": self.rejected_sessions,
+            "queued_events": sum(s.queue.qsize() for s in sessions),
+            "delivered_events": closed_delivered + sum(s.delivered for s in sessions),
+            "dropped_events": closed_dropped + sum(s.dropped for s in sessions),
+            "max_queue": self.max_queue,
+        }
@@ -0,0 +1,90 @@
+"""
+Readiness-driven startup for the Modal web server.
+
+Instead of sleeping a fixed time after starting the server thread, poll until
+the port accepts connections and the health endpoint answers, backing off
+briefly between attempts. Each phase is recorded on a StartupTimeline so the
+cold-start breakdown can be logged and served on /health.
+"""
+
+import http.client
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimeline:
+    """Ordered (phase, seconds since start) marks for one cold start."""
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.monotonic()
+        self._marks = []
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            self._marks.append((phase, elapsed))
+        logger.info("startup: %-24s +%.1f ms", phase, elapsed * 1000.0)
+        return elapsed
+
+    def as_dict(self):
+        with self._lock:
+            marks = list(self._marks)
+        phases = []
+        previous = 0.0
+        for phase, elapsed in marks:
+            phases.append({"phase": phase, "at_ms": round(elapsed * 1000.0, 1),
+                           "took_ms": round((elapsed - previous) * 1000.0, 1)})
+            previous = elapsed
+        return {"total_ms": round(previous * 1000.0, 1), "phases": phases}
+
+
+def _accepts(host, port, timeout):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _health_ok(host, port, path, timeout):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        return conn.getresponse().status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+def wait_until_ready(host, port, health_path="/health", timeout=30.0, initial_delay=0.005,
+                     max_delay=0.2, timeline=None, is_alive=None):
+    """Poll until host:port accepts connections and health_path returns 200.
+
+    Backs off from initial_delay up to max_delay between attempts. Returns False
+    on timeout or if is_alive() reports that the server process/thread died.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    accepting = False
+    while time.monotonic() < deadline:
+        if is_alive is not None and not is_alive():
+            logger.error("startup: server exited before becoming ready")
+            return False
+        if not accepting and _accepts(host, port, timeout=0.5):
+            accepting = True
+            if timeline is not None:
+                timeline.mark("socket_accepting")
+        if accepting and _health_ok(host, port, health_path, timeout=2.0):
+            if timeline is not None:
+                timeline.mark("health_ok")
+            return True
+        time.sleep(delay)
+        delay = min(max_delay, delay * 2)
+    logger.error("startup: %s:%s not ready after %.1fs", host, port, timeout)
+    return False
@@ -0,0 +1,152 @@
+"""
+Pool of emotion API backends with pluggable selection and passive health checks.
+
+Backends are chosen by round-robin, least outstanding requests, or an EWMA of
+observed latency weighted by outstanding requests. A backend that fails
+``failure_threshold`` times in a row is ejected for a back-off period and
+re-admitted automatically once it expires. Backup backends (for example the
+hosted endpoint) are only used when no primary backend can take the request.
+"""
+
+import itertools
+import threading
+import time
+
+
+class NoBackendAvailable(RuntimeError):
+    """Raised when every backend is ejected, saturated or excluded."""
+
+
+class Backend:
+    """One upstream emotion API instance."""
+
+    def __init__(self, name, endpoints, backup=False):
+        self.name = name
+        self.endpoints = endpoints  # endpoint key -> URL
+        self.backup = backup
+        self.outstanding = 0
+        self.ewma = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @classmethod
+    def from_base_url(cls, base_url, backup=False):
+        base = base_url.rstrip("/")
+        return cls(base, {"predict": f"{base}/predict", "predict_detailed": f"{base}/predict_detailed"}, backup=backup)
+
+    def url(self, endpoint):
+        return self.endpoints[endpoint]
+
+    def is_ejected(self, now):
+        return now < self.ejected_until
+
+    def stats(self, now):
+        return {
+            "name": self.name,
+            "backup": self.backup,
+            "outstanding": self.outstanding,
+            "ewma_latency_ms": round(self.ewma * 1000.0, 2) if self.ewma is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "ejected": self.is_ejected(now),
+            "ejected_for_seconds": round(max(0.0, self.ejected_until - now), 2),
+        }
+
+
+class UpstreamPool:
+    """Select a backend per request and track its health."""
+
+    STRATEGIES = ("round_robin", "least_outstanding", "ewma")
+
+    def __init__(self, backends, strategy="ewma", failure_threshold=3, ejection_seconds=10.0,
+                 max_ejection_seconds=120.0, ewma_alpha=0.3, max_outstanding=0):
+        if not backends:
+            raise ValueError("UpstreamPool needs at least one backend")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}; expected one of {', '.join(self.STRATEGIES)}")
+        self.backends = list(backends)
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.ewma_alpha = ewma_alpha
+        self.max_outstanding = max_outstanding  # 0 = unlimited; above it a primary overflows to backups
+        self._lock = threading.Lock()
+        self._rr = itertools.count()
+
+    def __len__(self):
+        return len(self.backends)
+
+    def _eligible(self, now, exclude):
+        def usable(b):
+            if b in exclude or b.is_ejected(now):
+                return False
+            return not self.max_outstanding or b.outstanding < self.max_outstanding
+        primaries = [b for b in self.backends if not b.backup and usable(b)]
+        if primaries:
+            return primaries
+        return [b for b in self.backends if b.backup and usable(b)]
+
+    def _choose(self, candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+        if self.strategy == "round_robin":
+            return candidates[next(self._rr) % len(candidates)]
+        if self.strategy == "least_outstanding":
+            return min(candidates, key=lambda b: b.outstanding)
+        # ewma: unmeasured backends first, then lowest latency scaled by queue depth
+        unmeasured = [b for b in candidates if b.ewma is None]
+        if unmeasured:
+            return min(unmeasured, key=lambda b: b.outstanding)
+        return min(candidates, key=lambda b: b.ewma * (b.outstanding + 1))
+
+    def acquire(self, exclude=()):
+        """Pick a backend and count the request as outstanding on it."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = self._eligible(now, exclude)
+            if not candidates:
+                raise NoBackendAvailable("No emotion API backend available")
+            backend = self._choose(candidates)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend, succeeded, latency=None):
+        """Record the outcome of a request started with acquire().
+
+        ``succeeded=None`` releases the slot without judging the backend.
+        """
+        with self._lock:
+            backend.outstanding = max(0, backend.outstanding - 1)
+            if succeeded is None:
+                return
+            if succeeded:
+                backend.consecutive_failures = 0
+                backend.ejections = 0
+                if latency is not None:
+                    backend.ewma = latency if backend.ewma is None else (
+                        self.ewma_alpha * latency + (1.0 - self.ewma_alpha) * backend.ewma)
+                return
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            now = time.monotonic()
+            if backend.consecutive_failures >= self.failure_threshold and not backend.is_ejected(now):
+                backend.ejections += 1
+                backoff = min(self.max_ejection_seconds, self.ejection_seconds * (2 ** (backend.ejections - 1)))
+                backend.ejected_until = now + backoff
+                # Re-admitted after the back-off with one strike left before the next ejection
+                backend.consecutive_failures = self.failure_threshold - 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "strategy": self.strategy,
+                "backends": [b.stats(now) for b in self.backends],
+            }
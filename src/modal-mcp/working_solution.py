@@ -2,41 +2,494 @@ import modal
 import threading
 import time
 import requests
-import json
+import hashlib
+import heapq
+import hmac
+import os
+import queue
+import subprocess
 import sys
 import logging
-from flask import Flask, request, jsonify
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+
+import cascade
+import codec
+import deadlines
+import input_governor
+import prefilter
+import prefork
+import shadow_eval
+import shm_cache
+import ws_transport
+from admission import AdmissionController, Overloaded, parse_lanes
+from batching import MicroBatcher
+from metrics import MetricsRegistry
+from profiler import ProfilerBusy, SamplingProfiler
+from chunking import split_into_chunks
+from deadlines import DeadlineExceeded
+from jobs import ACTIVE_STATUSES, JobManager, JobNotFound, JobStore
+from rate_limit import TokenBucketLimiter
+from resilience import CircuitBreaker, CircuitOpenError, HedgeBudget, Hedger
+from sse_sessions import SSESessionRegistry, SessionNotFound, SessionQueueFull, format_event
+from startup import StartupTimeline, wait_until_ready
+from upstream_pool import Backend, NoBackendAvailable, UpstreamPool
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cold-start phases, served on /health
+startup_timeline = StartupTimeline()
+STARTUP_TIMEOUT = float(os.environ.get("MCP_STARTUP_TIMEOUT_SECONDS", "30"))
+# Worker processes for the web server (see prefork.py); 1 serves from a thread in this process
+SERVE_WORKERS = int(os.environ.get("MCP_WORKERS", "1"))
+# True in the process whose serve() hands the traffic to a prefork master (not in the workers).
+# That process serves nothing, so it starts no cache, batcher, shadow evaluator or job workers.
+DELEGATES_TO_PREFORK = SERVE_WORKERS > 1 and prefork.MASTER_ENV not in os.environ
+
+# Live counters and latency histograms, served on /health (JSON) and /metrics (Prometheus)
+metrics = MetricsRegistry(prefix="mcp_")
+mcp_requests = metrics.counter("requests_total", "MCP JSON-RPC requests by method", ("method",))
+tool_calls = metrics.counter("tool_calls_total", "Tool calls by outcome", ("tool", "outcome"))
+tool_inflight = metrics.gauge("tool_inflight", "Tool calls currently running", ("tool",))
+tool_latency = metrics.histogram("tool_duration_seconds", "Tool call latency, including admission wait", ("tool",))
+upstream_calls = metrics.counter("upstream_requests_total", "Upstream requests by outcome", ("upstream", "outcome"))
+upstream_latency = metrics.histogram("upstream_duration_seconds", "Upstream request latency", ("upstream",))
+deadline_drops = metrics.counter("deadline_expired_total", "Work dropped because the caller's deadline had passed", ("stage",))
+wasted_inference = metrics.counter("wasted_inference_total",
+                                   "Upstream inferences sent for callers that gave up before the result arrived", ("reason",))
+cache_lookups = metrics.counter("cache_lookups_total", "Prediction cache lookups", ("result",))
+input_tokens = metrics.counter("input_tokens_total", "Approximate input tokens received and sent upstream", ("stage",))
+cascade_items = metrics.counter("cascade_items_total", "Auto-mode predictions, by whether they were escalated", ("escalated",))
+prefilter_checks = metrics.counter("prefilter_checks_total", "Texts checked by the local pre-filter", ("result",))
+inputs_trimmed = metrics.counter("inputs_trimmed_total", "Inputs shortened before inference, by what was removed", ("reason",))
+
+# Under prefork.py every worker reports the totals of all workers
+WORKER_COUNT = int(os.environ.get("MCP_WORKER_COUNT", "1"))
+if os.environ.get("MCP_METRICS_DIR"):
+    metrics.share_with_peers(os.environ["MCP_METRICS_DIR"],
+                             interval=float(os.environ.get("MCP_METRICS_SHARE_SECONDS", "2")))
+
 # Define the app
 app = modal.App("mcp-emotion-server-working-solution")
 
+# Keeps the prediction cache snapshot across containers (see MCP_CACHE_SNAPSHOT_PATH)
+cache_volume = modal.Volume.from_name("mcp-emotion-cache", create_if_missing=True)
+
 # Create a Modal image that matches your working Docker setup
-image = modal.Image.debian_slim(python_version="3.11").pip_install("flask", "requests").apt_install("wget", "nodejs", "npm").run_commands([
+image = modal.Image.debian_slim(python_version="3.11").pip_install("flask", "requests", "orjson").apt_install("wget", "nodejs", "npm").run_commands([
     "wget https://go.dev/dl/go1.22.0.linux-amd64.tar.gz",
     "tar -C /usr/local -xzf go1.22.0.linux-amd64.tar.gz",
     "rm go1.22.0.linux-amd64.tar.gz",
     "npm install -g supergateway"
-]).env({"PATH": "/usr/local/go/bin:${PATH}"})
+]).env({"PATH": "/usr/local/go/bin:${PATH}", "MCP_CACHE_SNAPSHOT_PATH": "/cache/predictions.snapshot"}).add_local_python_source(
+    # Helper modules that live next to this file
+    "codec", "admission", "batching", "cascade", "chunking", "deadlines", "input_governor", "jobs", "metrics", "prefilter", "prefork", "profiler",
+    "rate_limit", "resilience", "shadow_eval", "shm_cache", "sse_sessions", "startup", "upstream_pool", "ws_transport"
+)
+
+EMOTION_API_URL = os.environ.get("EMOTION_API_URL", "https://stevef1uk--emotion-server-serve.modal.run/predict")
+EMOTION_DETAILED_API_URL = os.environ.get("EMOTION_DETAILED_API_URL", "https://stevef1uk--emotion-server-serve.modal.run/predict_detailed")
+# Optional batch endpoint; when unset, batches are sent as concurrent requests over a pooled session
+EMOTION_BATCH_URL = os.environ.get("EMOTION_BATCH_URL", "")
+
+# Micro-batching of upstream /predict calls
+BATCH_ENABLED = os.environ.get("MCP_BATCH_ENABLED", "1") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("MCP_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("MCP_BATCH_MAX_WAIT_MS", "2"))
+BATCH_MAX_INFLIGHT = int(os.environ.get("MCP_BATCH_MAX_INFLIGHT", "4"))
+
+# Shared keep-alive session so grouped requests reuse upstream connections
+upstream_session = requests.Session()
+upstream_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=BATCH_MAX_SIZE * BATCH_MAX_INFLIGHT))
+upstream_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=BATCH_MAX_SIZE * BATCH_MAX_INFLIGHT))
+_fanout_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_SIZE * BATCH_MAX_INFLIGHT, thread_name_prefix="upstream")
 
-def detect_emotion(text, accurate: bool = False):
-    """Call the Modal emotion service. If accurate is True, append ?accurate=1 to request."""
+UPSTREAM_TIMEOUT = float(os.environ.get("MCP_UPSTREAM_TIMEOUT_SECONDS", "30"))
+
+# Circuit breaker per upstream endpoint: fail fast while it errors or stalls
+BREAKER_WINDOW = int(os.environ.get("MCP_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.environ.get("MCP_BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.environ.get("MCP_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.environ.get("MCP_BREAKER_SLOW_CALL_SECONDS", "10"))
+BREAKER_SLOW_CALL_RATE = float(os.environ.get("MCP_BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("MCP_BREAKER_OPEN_SECONDS", "10"))
+
+# Optional hedged requests: re-send once if no answer by the upstream's recent pXX latency
+HEDGE_ENABLED = os.environ.get("MCP_HEDGE_ENABLED", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("MCP_HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET_RATIO = float(os.environ.get("MCP_HEDGE_BUDGET_RATIO", "0.05"))
+hedge_budget = HedgeBudget(HEDGE_BUDGET_RATIO)
+_attempt_executor = ThreadPoolExecutor(max_workers=2 * BATCH_MAX_SIZE * BATCH_MAX_INFLIGHT,
+                                       thread_name_prefix="upstream-attempt") if HEDGE_ENABLED else None
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+def _upstream_guards(name):
+    """Return the (CircuitBreaker, Hedger or None) pair for an upstream endpoint."""
+    guards = _upstreams.get(name)
+    if guards is None:
+        with _upstreams_lock:
+            guards = _upstreams.get(name)
+            if guards is None:
+                breaker = CircuitBreaker(
+                    name,
+                    window=BREAKER_WINDOW,
+                    min_calls=BREAKER_MIN_CALLS,
+                    failure_rate=BREAKER_FAILURE_RATE,
+                    slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+                    slow_call_rate=BREAKER_SLOW_CALL_RATE,
+                    open_seconds=BREAKER_OPEN_SECONDS,
+                )
+                hedger = Hedger(_attempt_executor, hedge_budget, percentile=HEDGE_PERCENTILE) if HEDGE_ENABLED else None
+                guards = _upstreams[name] = (breaker, hedger)
+    return guards
+
+def _upstream_post(name, url, payload, deadline=None):
+    """POST JSON to an upstream through its circuit breaker (and hedger, if enabled).
+
+    With a deadline, the request is not sent once it has passed (DeadlineExceeded),
+    its timeout is capped to the time left and the remaining budget is forwarded.
+    """
+    breaker, hedger = _upstream_guards(name)
     try:
-        url = "https://stevef1uk--emotion-server-serve.modal.run/predict"
-        if accurate:
-            url += "?accurate=1"
-        payload = {"text": text}
-        
-        response = requests.post(url, json=payload, timeout=30)
+        timeout = deadlines.cap_timeout(UPSTREAM_TIMEOUT, deadline)
+    except DeadlineExceeded:
+        deadline_drops.labels("upstream").inc()
+        raise
+    budget = deadlines.header_value(deadline)
+    headers = {deadlines.TIMEOUT_HEADER: budget} if budget is not None else None
+
+    def attempt():
+        response = upstream_session.post(url, json=payload, timeout=timeout, headers=headers)
         response.raise_for_status()
-        
-        result = response.json()
+        return response.json()
+
+    try:
+        breaker.acquire()
+    except CircuitOpenError:
+        upstream_calls.labels(name, "circuit_open").inc()
+        raise
+    start = time.monotonic()
+    try:
+        result = hedger.run(attempt) if hedger is not None else attempt()
+    except requests.HTTPError as e:
+        # 4xx means the request was bad, not that the upstream is unhealthy
+        client_error = e.response is not None and e.response.status_code < 500
+        elapsed = time.monotonic() - start
+        breaker.record(client_error, elapsed)
+        upstream_calls.labels(name, "client_error" if client_error else "error").inc()
+        upstream_latency.labels(name).observe(elapsed)
+        raise
+    except requests.Timeout:
+        # A timeout cut short by the caller's deadline says nothing about the upstream
+        elapsed = time.monotonic() - start
+        caller_gave_up = timeout < UPSTREAM_TIMEOUT and deadlines.expired(deadline)
+        breaker.record(caller_gave_up, elapsed)
+        upstream_calls.labels(name, "deadline" if caller_gave_up else "error").inc()
+        upstream_latency.labels(name).observe(elapsed)
+        if caller_gave_up:
+            wasted_inference.labels("abandoned").inc()
+            raise DeadlineExceeded("Request deadline exceeded waiting for the upstream")
+        raise
+    except Exception:
+        elapsed = time.monotonic() - start
+        breaker.record(False, elapsed)
+        upstream_calls.labels(name, "error").inc()
+        upstream_latency.labels(name).observe(elapsed)
+        raise
+    elapsed = time.monotonic() - start
+    breaker.record(True, elapsed)
+    upstream_calls.labels(name, "ok").inc()
+    upstream_latency.labels(name).observe(elapsed)
+    if deadlines.expired(deadline):
+        wasted_inference.labels("late_result").inc()
+    return result
+
+def upstream_stats():
+    """Per-upstream breaker and hedging state for /health."""
+    with _upstreams_lock:
+        items = list(_upstreams.items())
+    stats = {}
+    for name, (breaker, hedger) in items:
+        stats[name] = {"circuit": breaker.stats()}
+        if hedger is not None:
+            stats[name]["hedging"] = hedger.stats()
+    return stats
+
+def _build_upstream_pool():
+    """Build the backend pool from EMOTION_API_URLS / EMOTION_API_BACKUP_URLS.
+
+    Both take comma-separated base URLs (each serving /predict and /predict_detailed).
+    Without EMOTION_API_URLS the pool holds the single EMOTION_API_URL backend.
+    """
+    primaries = [u.strip() for u in os.environ.get("EMOTION_API_URLS", "").split(",") if u.strip()]
+    backups = [u.strip() for u in os.environ.get("EMOTION_API_BACKUP_URLS", "").split(",") if u.strip()]
+    if primaries:
+        backends = [Backend.from_base_url(u) for u in primaries]
+    else:
+        backends = [Backend(EMOTION_API_URL, {"predict": EMOTION_API_URL, "predict_detailed": EMOTION_DETAILED_API_URL})]
+    backends += [Backend.from_base_url(u, backup=True) for u in backups]
+    return UpstreamPool(
+        backends,
+        strategy=os.environ.get("MCP_UPSTREAM_STRATEGY", "ewma"),
+        failure_threshold=int(os.environ.get("MCP_UPSTREAM_EJECT_AFTER_FAILURES", "3")),
+        ejection_seconds=float(os.environ.get("MCP_UPSTREAM_EJECT_SECONDS", "10")),
+        max_outstanding=int(os.environ.get("MCP_UPSTREAM_MAX_OUTSTANDING", "0")),
+    )
+
+upstream_pool = _build_upstream_pool()
+
+def _pooled_post(endpoint, payload, query="", deadline=None):
+    """POST to the named endpoint on a backend chosen by the pool, failing over once on error."""
+    tried = []
+    last_error = None
+    for _ in range(min(2, len(upstream_pool))):
+        try:
+            backend = upstream_pool.acquire(exclude=tried)
+        except NoBackendAvailable as e:
+            last_error = last_error or e
+            break
+        tried.append(backend)
+        url = backend.url(endpoint)
+        start = time.monotonic()
+        try:
+            result = _upstream_post(url, url + query, payload, deadline)
+        except DeadlineExceeded:
+            # The caller gave up; neither a backend failure nor worth a failover
+            upstream_pool.release(backend, None)
+            raise
+        except CircuitOpenError as e:
+            # Breaker already knows; don't double count against the backend
+            upstream_pool.release(backend, None)
+            last_error = e
+            continue
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code < 500:
+                upstream_pool.release(backend, True, time.monotonic() - start)
+                raise
+            upstream_pool.release(backend, False)
+            last_error = e
+            continue
+        except Exception as e:
+            upstream_pool.release(backend, False)
+            last_error = e
+            continue
+        upstream_pool.release(backend, True, time.monotonic() - start)
+        return result
+    raise last_error
+
+# Predictions depend only on the text, so they are cached; shared by all workers under prefork.py.
+# A process that delegates to prefork keeps no cache (and writes no snapshots).
+CACHE_ENABLED = os.environ.get("MCP_CACHE_ENABLED", "1") == "1" and not DELEGATES_TO_PREFORK
+prediction_cache = shm_cache.get_cache(**shm_cache.settings_from_env()) if CACHE_ENABLED else None
+if prediction_cache is not None and not shm_cache.is_inherited(prediction_cache):
+    # Start warm after a scale-to-zero; under prefork.py the master does this
+    shm_cache.warm_start(prediction_cache, **shm_cache.snapshot_settings_from_env())
+
+def _cache_key(kind, text, accurate=False):
+    return f"{kind}:{int(bool(accurate))}:{text}"
+
+def _cache_get(key):
+    """Cached prediction for key, or None."""
+    if prediction_cache is None:
+        return None
+    raw = prediction_cache.get(key)
+    cache_lookups.labels("hit" if raw is not None else "miss").inc()
+    return codec.loads(raw) if raw is not None else None
+
+def _cache_put(key, result):
+    if prediction_cache is not None and isinstance(result, dict) and "error" not in result:
+        prediction_cache.put(key, codec.dumps(result))
+
+# Opt-in (MCP_INPUT_GOVERNOR_ENABLED=1): normalise, strip quoted replies (and optionally
+# signatures), and cap every text before inference
+governor = input_governor.from_env(prefix="MCP_INPUT_")
+GOVERNED_CHARS_PER_TOKEN = 6
+
+def _govern(text):
+    """The text as it is sent upstream (unchanged when the governor is disabled)."""
+    if governor is None or not isinstance(text, str):
+        return text
+    result = governor.govern(text)
+    input_tokens.labels("received").inc(result.original_tokens)
+    input_tokens.labels("sent").inc(result.tokens)
+    if result.quotes_removed:
+        inputs_trimmed.labels("quoted_reply").inc()
+    if result.signature_removed:
+        inputs_trimmed.labels("signature").inc()
+    if result.truncated:
+        inputs_trimmed.labels("truncated").inc()
+        logger.info("Input truncated from %d to %d tokens (%s)", result.original_tokens, result.tokens, result.truncated)
+    return result.text
+
+# Optionally answer obvious texts locally (see prefilter.py); accurate requests always reach the model
+local_prefilter = prefilter.from_env(prefix="MCP_PREFILTER_")
+
+def _prefiltered(text, accurate=False):
+    """The pre-filter's answer for a governed text, or None to ask the upstream."""
+    if local_prefilter is None or accurate:
+        return None
+    result = local_prefilter.classify(text)
+    prefilter_checks.labels("answered" if result is not None else "forwarded").inc()
+    return result
+
+def _predict_one(text, accurate=False, deadline=None):
+    """POST a single text to the emotion API and return the parsed JSON."""
+    result = _pooled_post("predict", {"text": text}, "?accurate=1" if accurate else "", deadline)
+    _cache_put(_cache_key("predict", text, accurate), result)
+    return result
+
+def _predict_detailed_one(text, deadline=None):
+    """Detailed prediction for text, from the cache or the detailed endpoint."""
+    return _predict_detailed_governed(_govern(text), deadline)
+
+def _predict_detailed_governed(text, deadline=None):
+    key = _cache_key("detailed", text)
+    result = _cache_get(key)
+    if result is None:
+        result = _pooled_post("predict_detailed", {"text": text}, deadline=deadline)
+        _cache_put(key, result)
+    return result
+
+def _predict_batch_endpoint(texts, accurate, deadline=None):
+    """POST a group of texts to the batch endpoint. Expects a list (or {"results": [...]}) back."""
+    url = EMOTION_BATCH_URL + ("?accurate=1" if accurate else "")
+    body = _upstream_post(EMOTION_BATCH_URL, url, {"texts": texts}, deadline)
+    results = body.get("results") if isinstance(body, dict) else body
+    if not isinstance(results, list) or len(results) != len(texts):
+        raise ValueError("Batch endpoint returned an unexpected payload")
+    for text, result in zip(texts, results):
+        _cache_put(_cache_key("predict", text, accurate), result)
+    return results
+
+def _dispatch_predict_batch(items):
+    """Dispatch a batch of (text, accurate, deadline) items and return results in the same order.
+
+    Items whose deadline passed while they were queued are dropped, not sent upstream.
+    """
+    results = [None] * len(items)
+    groups = {}
+    for index, (text, accurate, deadline) in enumerate(items):
+        if deadlines.expired(deadline):
+            deadline_drops.labels("batch_queue").inc()
+            results[index] = DeadlineExceeded("Request deadline exceeded before dispatch")
+            continue
+        groups.setdefault(accurate, []).append(index)
+
+    futures = []
+    for accurate, indexes in groups.items():
+        if EMOTION_BATCH_URL and len(indexes) > 1:
+            group_deadlines = [items[i][2] for i in indexes]
+            # A shared request only needs to finish for the most patient caller
+            deadline = None if None in group_deadlines else max(group_deadlines)
+            futures.append((indexes, _fanout_executor.submit(
+                _predict_batch_endpoint, [items[i][0] for i in indexes], accurate, deadline)))
+        else:
+            for i in indexes:
+                futures.append(([i], _fanout_executor.submit(_predict_one, items[i][0], accurate, items[i][2])))
+
+    for indexes, future in futures:
+        try:
+            value = future.result()
+            values = value if len(indexes) > 1 else [value]
+        except Exception as e:
+            values = [e] * len(indexes)
+        for i, v in zip(indexes, values):
+            results[i] = v
+    return results
+
+predict_batcher = MicroBatcher(
+    _dispatch_predict_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_inflight_batches=BATCH_MAX_INFLIGHT,
+    name="predict",
+) if BATCH_ENABLED and not DELEGATES_TO_PREFORK else None
+
+def predict(text, accurate=False, deadline=None):
+    """Return the raw /predict JSON for text, going through the micro-batcher when enabled.
+
+    deadline defaults to the current request's deadline.
+    """
+    return _predict_governed(_govern(text), accurate, deadline)
+
+def _predict_governed(text, accurate=False, deadline=None):
+    cached = _cache_get(_cache_key("predict", text, accurate))
+    if cached is not None:
+        return cached
+    local = _prefiltered(text, accurate)
+    if local is not None:
+        return local
+    deadline = deadline if deadline is not None else deadlines.current()
+    if predict_batcher is None:
+        return _predict_one(text, accurate, deadline)
+    try:
+        return predict_batcher.call((text, bool(accurate), deadline),
+                                    timeout=deadlines.cap_timeout(UPSTREAM_TIMEOUT + 5, deadline))
+    except FutureTimeoutError:
+        if deadlines.expired(deadline):
+            raise DeadlineExceeded("Request deadline exceeded waiting for the upstream")
+        raise
+
+# Auto mode: answer from the fast path, escalating low-confidence texts (see cascade.py)
+PREDICT_MODES = ("fast", "accurate", "auto")
+DEFAULT_PREDICT_MODE = os.environ.get("MCP_DEFAULT_MODE", "fast")
+cascade_policy = cascade.from_env(prefix="MCP_CASCADE_")
+
+def _escalate(text, deadline):
+    """Slow-path prediction for an already governed text, as {"emotion", "confidence"}."""
+    if cascade_policy.escalate_to == "detailed":
+        raw = _predict_detailed_governed(text, deadline)
+        return {"emotion": raw.get("predicted_emotion", "unknown"), "confidence": raw.get("confidence", 0.0)}
+    return _predict_governed(text, True, deadline)
+
+def predict_auto(text, threshold=None, deadline=None):
+    """(prediction, escalated): the fast prediction, or the escalation target's when it is below threshold."""
+    text = _govern(text)
+    deadline = deadline if deadline is not None else deadlines.current()
+    result, escalated = cascade_policy.run(lambda: _predict_governed(text, False, deadline),
+                                           lambda: _escalate(text, deadline), threshold)
+    cascade_items.labels("true" if escalated else "false").inc()
+    return result, escalated
+
+# Compare a sample of answers with a baseline model in the background (see shadow_eval.py)
+shadow = shadow_eval.from_env(prefix="MCP_SHADOW_") if not DELEGATES_TO_PREFORK else None
+
+def _shadow(text, emotion, source="model"):
+    """Offer an answer for shadow evaluation; costs a random draw unless the sample is taken."""
+    if shadow is not None and emotion:
+        shadow.offer(text, emotion, source)
+
+def detect_emotion(text, accurate: bool = False, mode=None, threshold=None):
+    """Call the Modal emotion service. If accurate is True, append ?accurate=1 to request.
+
+    mode ("fast", "accurate" or "auto") overrides accurate; auto tries the
+    fast path first and escalates when its confidence is below threshold.
+    """
+    mode = mode or ("accurate" if accurate else "fast")
+    try:
+        escalated = False
+        if mode == "auto":
+            result, escalated = predict_auto(text, threshold)
+        elif mode == "accurate":
+            started = time.monotonic()
+            result = predict(text, accurate=True)
+            if cascade_policy.escalate_to == "accurate":
+                cascade_policy.observe_slow(time.monotonic() - started)
+        else:
+            result = predict(text)
         emotion = result.get('emotion', 'unknown')
         confidence = result.get('confidence', 0.0)
+        # Named after the path that answered, like the batch path, never after the raw mode argument
+        _shadow(text, emotion, "escalated" if escalated else
+                result.get("source", "accurate" if mode == "accurate" else "fast"))
         
+        if escalated:
+            return f"Emotion: {emotion} (Confidence: {confidence:.2%}) [escalated to {cascade_policy.escalate_to}]"
         return f"Emotion: {emotion} (Confidence: {confidence:.2%})"
         
     except Exception as e:
@@ -45,19 +498,241 @@ def detect_emotion(text, accurate: bool = False):
 def detect_emotion_detailed(text):
     """Call the Modal emotion service for detailed analysis"""
     try:
-        url = "https://stevef1uk--emotion-server-serve.modal.run/predict_detailed"
-        payload = {"text": text}
-        
-        response = requests.post(url, json=payload, timeout=30)
-        response.raise_for_status()
-        
         # Return the raw JSON object so callers can render as they wish
-        result = response.json()
+        result = _predict_detailed_one(text, deadlines.current())
+        _shadow(text, result.get("predicted_emotion"), "detailed")
         return result
         
     except Exception as e:
         return {"error": f"Error detecting detailed emotion: {str(e)}"}
 
+def _top_emotions(emotions, top_k):
+    """The top_k entries of an {emotion: probability} dict as [name, probability] pairs."""
+    ranked = heapq.nlargest(top_k, emotions.items(), key=lambda kv: kv[1])
+    return [[name, round(float(prob), 4)] for name, prob in ranked]
+
+def compact_detailed(raw, top_k=3, arrays=False, labels=False):
+    """Compact form of a detailed prediction.
+
+    {"emotion", "confidence", "top": [[name, probability], ...]} with the top_k
+    emotions; with arrays, "probs" (every probability, in the alphabetical order
+    of the emotion names) replaces "top". The names themselves are sent as
+    "labels" only if asked for, so a client fetches them once and caches them.
+    Errors pass through.
+    """
+    if not isinstance(raw, dict) or "error" in raw:
+        return raw
+    emotions = raw.get("all_emotions") or {}
+    compact = {"emotion": raw.get("predicted_emotion", "unknown"), "confidence": round(float(raw.get("confidence", 0.0)), 4)}
+    if arrays:
+        names = sorted(emotions)
+        if labels:
+            compact["labels"] = names
+        compact["probs"] = [round(float(emotions[name]), 4) for name in names]
+    else:
+        compact["top"] = _top_emotions(emotions, top_k)
+    return compact
+
+BATCH_TOOL_MAX_ITEMS = int(os.environ.get("MCP_BATCH_TOOL_MAX_ITEMS", "256"))
+
+def _batch_futures(texts, accurate, detailed, deadline):
+    """{future: index} classifying already governed texts concurrently."""
+    if detailed:
+        return {_fanout_executor.submit(_predict_detailed_governed, text, deadline): i for i, text in enumerate(texts)}
+    futures = {}
+    for i, text in enumerate(texts):
+        ready = _cache_get(_cache_key("predict", text, accurate))
+        if ready is None:
+            ready = _prefiltered(text, accurate)
+        if ready is not None:
+            future = Future()
+            future.set_result(ready)
+        elif predict_batcher is not None:
+            future = predict_batcher.submit((text, bool(accurate), deadline))
+        else:
+            future = _fanout_executor.submit(_predict_one, text, accurate, deadline)
+        futures[future] = i
+    return futures
+
+def _batch_item(index, raw, detailed, top_k):
+    if detailed:
+        item = {"index": index, "emotion": raw.get("predicted_emotion", "unknown"),
+                "confidence": round(float(raw.get("confidence", 0.0)), 4)}
+        item["top"] = _top_emotions(raw.get("all_emotions", {}), top_k)
+        return item
+    item = {"index": index, "emotion": raw.get("emotion", "unknown"), "confidence": round(float(raw.get("confidence", 0.0)), 4)}
+    if "source" in raw:
+        item["source"] = raw["source"]
+    return item
+
+def _escalate_batch(texts, results, threshold, top_k, deadline):
+    """Re-classify the low-confidence items of a fast batch with the escalation target, in place.
+
+    An item whose escalation fails keeps its fast result.
+    """
+    threshold = cascade_policy.threshold if threshold is None else threshold
+    low = [i for i, item in enumerate(results) if "error" not in item and item["confidence"] < threshold]
+    detailed = cascade_policy.escalate_to == "detailed"
+    futures = _batch_futures([texts[i] for i in low], not detailed, detailed, deadline)
+    for future in as_completed(futures):
+        index = low[futures[future]]
+        try:
+            results[index] = dict(_batch_item(index, future.result(), detailed, top_k), escalated=True)
+        except Exception:
+            pass
+    answered = sum(1 for item in results if "error" not in item)
+    cascade_policy.count(answered, len(low))
+    cascade_items.labels("true").inc(len(low))
+    cascade_items.labels("false").inc(answered - len(low))
+
+def detect_emotion_batch(texts, accurate=False, detailed=False, top_k=3, on_progress=None, auto=False,
+                         threshold=None):
+    """Classify many texts concurrently and return a compact summary.
+
+    Each item becomes {"index", "emotion", "confidence"} (plus "top" in detailed mode,
+    the top_k emotions as [name, probability] pairs) or {"index", "error"}.
+    With auto, items the fast path is unsure of are re-classified by the
+    cascade's escalation target and marked "escalated".
+    on_progress(done, total) is called as items complete.
+    """
+    if len(texts) > BATCH_TOOL_MAX_ITEMS:
+        raise ValueError(f"Too many texts: {len(texts)} (max {BATCH_TOOL_MAX_ITEMS})")
+
+    deadline = deadlines.current()
+    texts = [_govern(text) for text in texts]
+    auto = auto and not accurate and not detailed
+    futures = _batch_futures(texts, accurate, detailed, deadline)
+
+    results = [None] * len(texts)
+    step = max(1, len(texts) // 20)
+    for done, future in enumerate(as_completed(futures), start=1):
+        index = futures[future]
+        try:
+            results[index] = _batch_item(index, future.result(), detailed, top_k)
+        except Exception as e:
+            results[index] = {"index": index, "error": str(e)}
+        if on_progress is not None and (done % step == 0 or done == len(texts)):
+            on_progress(done, len(texts))
+    if auto:
+        _escalate_batch(texts, results, threshold, top_k, deadline)
+
+    counts = {}
+    errors = 0
+    for text, item in zip(texts, results):
+        if "error" in item:
+            errors += 1
+        else:
+            counts[item["emotion"]] = counts.get(item["emotion"], 0) + 1
+            _shadow(text, item["emotion"], "escalated" if item.get("escalated") else
+                    item.get("source", "detailed" if detailed else "accurate" if accurate else "fast"))
+    return {"total": len(texts), "errors": errors, "counts": counts, "results": results}
+
+DOCUMENT_CHUNK_MAX_CHARS = int(os.environ.get("MCP_DOCUMENT_CHUNK_MAX_CHARS", "600"))
+# Smallest max_chunk_chars a caller may ask for; shorter chunks carry too little text to classify
+DOCUMENT_CHUNK_MIN_CHARS = 50
+
+def _merge_chunks(text, chunks, limit):
+    """Join runs of adjacent chunks so that at most limit remain (offsets still index into text)."""
+    group = -(-len(chunks) // limit)
+    merged = []
+    for i in range(0, len(chunks), group):
+        start, end = chunks[i]["start"], chunks[min(i + group, len(chunks)) - 1]["end"]
+        merged.append({"start": start, "end": end, "text": text[start:end].strip()})
+    return merged
+
+def analyze_document(text, granularity="sentence", accurate=False, max_chunk_chars=None, on_progress=None, auto=False,
+                     threshold=None):
+    """Chunk a long text, classify the chunks concurrently and combine the results.
+
+    Returns a per-chunk timeline (character offsets, emotion, confidence) and an
+    emotion distribution weighted by chunk length. A document that would need
+    more than BATCH_TOOL_MAX_ITEMS chunks is analysed in coarser chunks, each
+    a run of adjacent ones.
+    """
+    chunks = split_into_chunks(text, max_chunk_chars or DOCUMENT_CHUNK_MAX_CHARS, granularity)
+    if len(chunks) > BATCH_TOOL_MAX_ITEMS:
+        chunks = _merge_chunks(text, chunks, BATCH_TOOL_MAX_ITEMS)
+    if not chunks:
+        return {"chunks": 0, "dominant_emotion": None, "distribution": {}, "timeline": []}
+
+    summary = detect_emotion_batch([c["text"] for c in chunks], accurate=accurate, on_progress=on_progress, auto=auto,
+                                   threshold=threshold)
+
+    weights = {}
+    timeline = []
+    for chunk, item in zip(chunks, summary["results"]):
+        entry = {"index": item["index"], "start": chunk["start"], "end": chunk["end"]}
+        if "error" in item:
+            entry["error"] = item["error"]
+        else:
+            entry["emotion"] = item["emotion"]
+            entry["confidence"] = item["confidence"]
+            weights[item["emotion"]] = weights.get(item["emotion"], 0) + len(chunk["text"])
+        timeline.append(entry)
+
+    total_weight = sum(weights.values())
+    distribution = {emotion: round(weight / total_weight, 4)
+                    for emotion, weight in sorted(weights.items(), key=lambda kv: kv[1], reverse=True)}
+    return {
+        "chunks": len(chunks),
+        "errors": summary["errors"],
+        "dominant_emotion": next(iter(distribution), None),
+        "distribution": distribution,
+        "timeline": timeline,
+    }
+
+# Admission control for tool calls (the requests that reach the upstream)
+_KNOWN_METHODS = frozenset(("initialize", "tools/list", "tools/call", "notifications/initialized"))
+
+admission = AdmissionController(
+    max_inflight=int(os.environ.get("MCP_MAX_INFLIGHT", "32")),
+    max_queue=int(os.environ.get("MCP_MAX_QUEUE", "64")),
+    queue_timeout=float(os.environ.get("MCP_QUEUE_TIMEOUT_SECONDS", "10")),
+    policy=os.environ.get("MCP_ADMISSION_POLICY", "sjf"),
+    aging_rate=float(os.environ.get("MCP_SJF_AGING_CHARS_PER_SECOND", "1000")),
+    # name:weight:reserved_slots; interactive keeps 4 slots to itself and wins most contended slots
+    lanes=parse_lanes(os.environ.get("MCP_PRIORITY_LANES", "interactive:4:4,default:2,bulk:1")),
+    default_lane="default",
+)
+PRIORITY_HEADER = "X-MCP-Priority"
+# Tools that default to the bulk lane when the caller names no priority
+BULK_TOOLS = frozenset(("emotion_detection_batch", "emotion_document_analysis"))
+MODE_TOOLS = ("emotion_detection", "emotion_detection_batch", "emotion_document_analysis")
+OVERLOADED_ERROR_CODE = -32000
+DEADLINE_ERROR_CODE = -32001
+
+# Fixed per-text cost of an upstream call, in characters, on top of the text itself
+ITEM_COST_CHARS = 200
+
+def request_lane(params, priority=None):
+    """Admission lane for a tools/call: the 'priority' argument, then the header value, then by tool."""
+    arguments = params.get("arguments") if isinstance(params, dict) else None
+    requested = arguments.get("priority") if isinstance(arguments, dict) else None
+    requested = requested or priority
+    if requested in admission.lanes:
+        return requested
+    if isinstance(params, dict) and params.get("name") in BULK_TOOLS and "bulk" in admission.lanes:
+        return "bulk"
+    return admission.default_lane.name
+
+def estimate_tool_cost(arguments):
+    """Estimated upstream work for a tool call, in characters, used to order the admission queue."""
+    if not isinstance(arguments, dict):
+        return ITEM_COST_CHARS
+    # Texts longer than the governor's budget are cut to about this size before they cost anything
+    cap = governor.max_tokens * GOVERNED_CHARS_PER_TOKEN if governor is not None else float("inf")
+    text = arguments.get("text")
+    if isinstance(text, str):
+        return ITEM_COST_CHARS + min(len(text), cap)
+    texts = arguments.get("texts")
+    if isinstance(texts, list):
+        return sum(ITEM_COST_CHARS + min(len(t), cap) for t in texts if isinstance(t, str)) or ITEM_COST_CHARS
+    return ITEM_COST_CHARS
+
+def overloaded_envelope(request_id, exc):
+    """JSON-RPC error telling the client to back off for exc.retry_after seconds."""
+    return codec.error_envelope(request_id, OVERLOADED_ERROR_CODE, str(exc), data={"retryAfter": exc.retry_after})
+
 class MCPEmotionServer:
     """MCP Server for emotion detection that works with MCP Inspector"""
     
@@ -90,6 +765,79 @@ class MCPEmotionServer:
                         "text": {
                             "type": "string",
                             "description": "The text to analyze for detailed emotion breakdown"
+                        },
+                        "compact": {
+                            "type": "boolean",
+                            "description": "Return only the top_k emotions as [name, probability] pairs instead of the full upstream response"
+                        },
+                        "top_k": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "description": "Number of emotions in compact mode (default 3)"
+                        },
+                        "arrays": {
+                            "type": "boolean",
+                            "description": "Compact mode with every probability as a 'probs' array, in the alphabetical order of the emotion names"
+                        },
+                        "labels": {
+                            "type": "boolean",
+                            "description": "With arrays, also return the emotion names as 'labels' (fetch once and cache; the order is fixed)"
+                        }
+                    },
+                    "required": ["text"]
+                }
+            },
+            "emotion_detection_batch": {
+                "name": "emotion_detection_batch",
+                "description": "Analyze many texts in one call. Returns per-item emotion and confidence plus aggregate counts",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "texts": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": f"The texts to analyze (at most {BATCH_TOOL_MAX_ITEMS})"
+                        },
+                        "accurate": {
+                            "type": "boolean",
+                            "description": "Return accurate confidence (slower)"
+                        },
+                        "detailed": {
+                            "type": "boolean",
+                            "description": "Use the detailed model and include the top_k emotions per item"
+                        },
+                        "top_k": {
+                            "type": "integer",
+                            "minimum": 1,
+                            "description": "Number of emotions to include per item in detailed mode (default 3)"
+                        }
+                    },
+                    "required": ["texts"]
+                }
+            },
+            "emotion_document_analysis": {
+                "name": "emotion_document_analysis",
+                "description": "Analyze a long document (e.g. an email thread) chunk by chunk. Returns a per-chunk emotion timeline and a length-weighted emotion distribution",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "text": {
+                            "type": "string",
+                            "description": "The document to analyze"
+                        },
+                        "granularity": {
+                            "type": "string",
+                            "enum": ["sentence", "paragraph"],
+                            "description": "Chunk by packed sentences (default) or by paragraph"
+                        },
+                        "max_chunk_chars": {
+                            "type": "integer",
+                            "minimum": DOCUMENT_CHUNK_MIN_CHARS,
+                            "description": f"Maximum characters per chunk (default {DOCUMENT_CHUNK_MAX_CHARS})"
+                        },
+                        "accurate": {
+                            "type": "boolean",
+                            "description": "Return accurate confidence (slower)"
                         }
                     },
                     "required": ["text"]
@@ -97,105 +845,245 @@ class MCPEmotionServer:
             }
         }
     
-    def handle_request(self, request_data):
-        """Handle incoming MCP requests"""
+        # Tools with a fast and an accurate path can also cascade between them
+        for name in MODE_TOOLS:
+            properties = self.tools[name]["inputSchema"]["properties"]
+            properties["mode"] = {
+                "type": "string",
+                "enum": list(PREDICT_MODES),
+                "description": "'fast', 'accurate', or 'auto': fast first, escalating to the "
+                               f"{cascade_policy.escalate_to} model when confidence is below the threshold "
+                               f"(overrides accurate; default {DEFAULT_PREDICT_MODE})"
+            }
+            properties["threshold"] = {
+                "type": "number",
+                "description": f"Confidence below which auto mode escalates (default {cascade_policy.threshold})"
+            }
+    
+        # Every tool accepts an optional priority lane
+        for tool in self.tools.values():
+            tool["inputSchema"]["properties"]["priority"] = {
+                "type": "string",
+                "enum": list(admission.lanes),
+                "description": "Scheduling lane for this call (default depends on the tool)"
+            }
+    
+        # Static responses are encoded once; only the id is spliced in per request
+        self._initialize_result = codec.dumps({
+            "protocolVersion": "2024-11-05",
+            "capabilities": {
+                "tools": {"listChanged": True}
+            },
+            "serverInfo": {
+                "name": "Emotion Detection MCP Server",
+                "version": "1.0.0",
+                "description": "MCP server for emotion detection using AI"
+            }
+        })
+        self._tools_list_result = codec.dumps({"tools": list(self.tools.values())})
+    
+    @staticmethod
+    def _progress_callback(params, notify):
+        """Return an on_progress(done, total) callback sending MCP progress notifications, or None."""
+        progress_token = (params.get("_meta") or {}).get("progressToken")
+        if notify is None or progress_token is None:
+            return None
+
+        def on_progress(done, total):
+            notify({
+                "jsonrpc": "2.0",
+                "method": "notifications/progress",
+                "params": {"progressToken": progress_token, "progress": done, "total": total}
+            })
+        return on_progress
+
+    def handle_request(self, request_data, notify=None):
+        """Handle incoming MCP requests and return the response as a dict.
+
+        Transports use respond(), which returns the encoded bytes directly.
+        """
+        return codec.loads(self.respond(request_data, notify=notify))
+
+    def respond(self, request_data, notify=None, raise_overloaded=False, priority=None, deadline=None):
+        """Handle an MCP request and return the JSON-RPC response as bytes.
+
+        notify, if given, is called with JSON-RPC notifications (such as progress)
+        to send to the client before the response. Tool calls go through admission
+        control; when it rejects one the response is a JSON-RPC error carrying
+        retryAfter, or Overloaded is raised if raise_overloaded is set (HTTP maps it to 429).
+        priority is the caller's priority lane (e.g. from the X-MCP-Priority header);
+        a 'priority' tool argument overrides it. deadline is the caller's absolute
+        time.monotonic() deadline (e.g. from X-Request-Timeout-Ms), tightened by
+        params._meta.timeoutMs; tool calls that cannot start before it get a
+        JSON-RPC error instead of reaching the upstream.
+        """
+        request_id = request_data.get("id")
         try:
             method = request_data.get("method")
-            request_id = request_data.get("id")
             params = request_data.get("params", {})
+            mcp_requests.labels(method if method in _KNOWN_METHODS else "other").inc()
             
             if method == "initialize":
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "result": {
-                        "protocolVersion": "2024-11-05",
-                        "capabilities": {
-                            "tools": {"listChanged": True}
-                        },
-                        "serverInfo": {
-                            "name": "Emotion Detection MCP Server",
-                            "version": "1.0.0",
-                            "description": "MCP server for emotion detection using AI"
-                        }
-                    }
-                }
-                
+                return codec.result_envelope(request_id, self._initialize_result)
             elif method == "tools/list":
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "result": {
-                        "tools": list(self.tools.values())
-                    }
-                }
-                
+                return codec.result_envelope(request_id, self._tools_list_result)
             elif method == "tools/call":
-                tool_name = params.get("name")
-                arguments = params.get("arguments", {})
-                
-                if tool_name == "emotion_detection":
-                    text = arguments.get("text", "")
-                    accurate = bool(arguments.get("accurate", False))
-                    emotion_result = detect_emotion(text, accurate=accurate)
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": json.dumps(emotion_result)
-                                }
-                            ],
-                            "isError": False
-                        }
-                    }
-                elif tool_name == "emotion_detection_detailed":
-                    text = arguments.get("text", "")
-                    detailed = detect_emotion_detailed(text)
-                    # If detect_emotion_detailed returns a dict, wrap as JSON text for MCP content
-                    if isinstance(detailed, dict):
-                        content_text = json.dumps(detailed)
-                    else:
-                        content_text = str(detailed)
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "result": {
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": content_text
-                                }
-                            ],
-                            "isError": False
-                        }
-                    }
-                else:
-                    response = {
-                        "jsonrpc": "2.0",
-                        "id": request_id,
-                        "error": {"code": -32601, "message": f"Tool not found: {tool_name}"}
-                    }
+                return self._admit_tool_call(request_id, params, notify, raise_overloaded, priority, deadline)
             else:
-                response = {
-                    "jsonrpc": "2.0",
-                    "id": request_id,
-                    "error": {"code": -32601, "message": f"Method not found: {method}"}
-                }
-            
-            return response
+                return codec.error_envelope(request_id, -32601, f"Method not found: {method}")
             
+        except Overloaded:
+            raise
         except Exception as e:
-            return {
-                "jsonrpc": "2.0",
-                "id": request_data.get("id"),
-                "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
-            }
+            return codec.error_envelope(request_id, -32603, f"Internal error: {str(e)}")
+
+    def _admit_tool_call(self, request_id, params, notify, raise_overloaded, priority=None, deadline=None):
+        """Run a tools/call inside an admission slot, recording per-tool metrics."""
+        tool = params.get("name")
+        if tool not in self.tools:
+            tool = "unknown"
+        deadline = deadlines.earliest(deadline, deadlines.from_timeout_ms((params.get("_meta") or {}).get("timeoutMs")))
+        inflight = tool_inflight.labels(tool)
+        inflight.inc()
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            with deadlines.deadline_scope(deadline):
+                deadlines.check(deadline)
+                with admission.slot(estimate_tool_cost(params.get("arguments")), request_lane(params, priority),
+                                    max_wait=deadlines.remaining(deadline)):
+                    # The slot may have come too late for this caller
+                    deadlines.check(deadline)
+                    response = self._call_tool(request_id, params, notify)
+            if not (response.endswith(b'"isError":true}}') or b',"error":{' in response):
+                outcome = "ok"
+            return response
+        except DeadlineExceeded as e:
+            outcome = "deadline"
+            deadline_drops.labels("admission").inc()
+            return codec.error_envelope(request_id, DEADLINE_ERROR_CODE, str(e))
+        except Overloaded as e:
+            if deadlines.expired(deadline):
+                outcome = "deadline"
+                deadline_drops.labels("admission").inc()
+                return codec.error_envelope(request_id, DEADLINE_ERROR_CODE, "Request deadline exceeded")
+            outcome = "overloaded"
+            if raise_overloaded:
+                raise
+            return overloaded_envelope(request_id, e)
+        finally:
+            inflight.dec()
+            tool_calls.labels(tool, outcome).inc()
+            tool_latency.labels(tool).observe(time.monotonic() - start)
+
+    @staticmethod
+    def _prediction_mode(arguments):
+        """(mode, threshold) for a tool call. Raises ValueError for unknown values."""
+        mode = arguments.get("mode") or ("accurate" if arguments.get("accurate") else DEFAULT_PREDICT_MODE)
+        if mode not in PREDICT_MODES:
+            raise ValueError(f"'mode' must be one of {', '.join(PREDICT_MODES)}")
+        threshold = arguments.get("threshold")
+        if threshold is not None:
+            threshold = float(threshold)
+            if not 0.0 <= threshold <= 1.0:
+                raise ValueError("'threshold' must be between 0 and 1")
+        return mode, threshold
+
+    @staticmethod
+    def _top_k(arguments):
+        """The top_k argument (default 3). Raises ValueError unless it is a positive integer."""
+        try:
+            top_k = int(arguments.get("top_k", 3))
+        except (TypeError, ValueError):
+            raise ValueError("'top_k' must be a positive integer") from None
+        if top_k < 1:
+            raise ValueError("'top_k' must be a positive integer")
+        return top_k
+
+    def _call_tool(self, request_id, params, notify):
+        """Run a tools/call request and return the encoded response."""
+        tool_name = params.get("name")
+        arguments = params.get("arguments", {})
+        if tool_name in MODE_TOOLS:
+            try:
+                mode, threshold = self._prediction_mode(arguments)
+            except (TypeError, ValueError) as e:
+                return codec.error_envelope(request_id, -32602, f"Invalid params: {e}")
+        
+        if tool_name == "emotion_detection":
+            text = arguments.get("text", "")
+            return codec.tool_text_envelope(request_id, detect_emotion(text, mode=mode, threshold=threshold))
+        
+        elif tool_name == "emotion_detection_detailed":
+            compact = arguments.get("compact") or arguments.get("arrays")
+            try:
+                top_k = self._top_k(arguments) if compact else None
+            except ValueError as e:
+                return codec.error_envelope(request_id, -32602, f"Invalid params: {e}")
+            detailed = detect_emotion_detailed(arguments.get("text", ""))
+            if compact:
+                detailed = compact_detailed(detailed, top_k, bool(arguments.get("arrays")), bool(arguments.get("labels")))
+            # If detect_emotion_detailed returns a dict, wrap as JSON text for MCP content
+            if isinstance(detailed, dict):
+                return codec.tool_json_envelope(request_id, detailed)
+            return codec.tool_text_envelope(request_id, str(detailed))
+        
+        elif tool_name == "emotion_detection_batch":
+            texts = arguments.get("texts")
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                return codec.error_envelope(request_id, -32602, "Invalid params: 'texts' must be an array of strings")
+            try:
+                top_k = self._top_k(arguments)
+            except ValueError as e:
+                return codec.error_envelope(request_id, -32602, f"Invalid params: {e}")
+            summary = detect_emotion_batch(
+                texts,
+                accurate=mode == "accurate",
+                detailed=bool(arguments.get("detailed", False)),
+                top_k=top_k,
+                on_progress=self._progress_callback(params, notify),
+                auto=mode == "auto",
+                threshold=threshold,
+            )
+            return codec.tool_json_envelope(
+                request_id, summary, is_error=summary["errors"] == summary["total"] and summary["total"] > 0)
+        
+        elif tool_name == "emotion_document_analysis":
+            granularity = arguments.get("granularity", "sentence")
+            if granularity not in ("sentence", "paragraph"):
+                return codec.error_envelope(request_id, -32602, "Invalid params: 'granularity' must be 'sentence' or 'paragraph'")
+            max_chunk_chars = arguments.get("max_chunk_chars")
+            if max_chunk_chars is not None:
+                try:
+                    max_chunk_chars = int(max_chunk_chars)
+                except (TypeError, ValueError):
+                    max_chunk_chars = 0
+                if max_chunk_chars < DOCUMENT_CHUNK_MIN_CHARS:
+                    return codec.error_envelope(
+                        request_id, -32602,
+                        f"Invalid params: 'max_chunk_chars' must be an integer of at least {DOCUMENT_CHUNK_MIN_CHARS}")
+            analysis = analyze_document(
+                arguments.get("text", ""),
+                granularity=granularity,
+                accurate=mode == "accurate",
+                max_chunk_chars=max_chunk_chars,
+                on_progress=self._progress_callback(params, notify),
+                auto=mode == "auto",
+                threshold=threshold,
+            )
+            return codec.tool_json_envelope(
+                request_id, analysis, is_error=analysis["chunks"] > 0 and analysis["errors"] == analysis["chunks"])
+        
+        return codec.error_envelope(request_id, -32601, f"Tool not found: {tool_name}")
     
-    def run_stdio(self):
-        """Run the MCP server on stdio for MCP Inspector compatibility"""
+    def run_stdio(self, max_inflight=1):
+        """Run the MCP server on stdio for MCP Inspector compatibility.
+
+        With max_inflight > 1 requests are handled concurrently and responses are
+        written as they complete (matched by JSON-RPC id), not in arrival order.
+        """
+        if max_inflight > 1:
+            return self._run_stdio_concurrent(max_inflight)
         logger.info("Starting MCP Emotion Server on stdio")
         
         while True:
@@ -211,50 +1099,219 @@ class MCPEmotionServer:
                 
                 # Parse JSON-RPC request
                 try:
-                    request_data = json.loads(line)
-                except json.JSONDecodeError as e:
-                    error_response = {
-                        "jsonrpc": "2.0",
-                        "id": None,
-                        "error": {"code": -32700, "message": f"Parse error: {str(e)}"}
-                    }
-                    print(json.dumps(error_response), flush=True)
+                    request_data = codec.loads(line)
+                except ValueError as e:
+                    _write_stdout(codec.error_envelope(None, -32700, f"Parse error: {str(e)}"))
+                    continue
+                if not isinstance(request_data, dict):
+                    _write_stdout(codec.error_envelope(None, -32600, "Invalid Request: expected a JSON-RPC object"))
                     continue
                 
-                # Handle the request
-                response = self.handle_request(request_data)
-                
-                # Send response to stdout
-                print(json.dumps(response), flush=True)
+                # Handle the request and send the response to stdout
+                _write_stdout(self.respond(request_data, notify=_write_stdout))
                 
             except Exception as e:
                 logger.error("Error processing request: %s", e)
-                error_response = {
-                    "jsonrpc": "2.0",
-                    "id": None,
-                    "error": {"code": -32603, "message": f"Server error: {str(e)}"}
-                }
-                print(json.dumps(error_response), flush=True)
+                _write_stdout(codec.error_envelope(None, -32603, f"Server error: {str(e)}"))
+
+    def _run_stdio_concurrent(self, max_inflight):
+        """Reader dispatches to a worker pool; a single writer emits responses as they finish."""
+        logger.info("Starting MCP Emotion Server on stdio (concurrent, max in-flight %d)", max_inflight)
+        outbox = queue.Queue()
+        slots = threading.BoundedSemaphore(max_inflight)
+        executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="stdio-worker")
+
+        def writer():
+            while True:
+                message = outbox.get()
+                if message is None:
+                    return
+                try:
+                    _write_stdout(message)
+                except Exception as e:
+                    logger.error("Error writing response: %s", e)
+
+        def work(request_data, request_id):
+            try:
+                outbox.put(self.respond(request_data, notify=outbox.put))
+            except Exception as e:
+                outbox.put(codec.error_envelope(request_id, -32603, f"Server error: {str(e)}"))
+            finally:
+                slots.release()
+
+        writer_thread = threading.Thread(target=writer, name="stdio-writer", daemon=True)
+        writer_thread.start()
+        try:
+            while True:
+                line = sys.stdin.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    request_data = codec.loads(line)
+                except ValueError as e:
+                    outbox.put(codec.error_envelope(None, -32700, f"Parse error: {str(e)}"))
+                    continue
+                if not isinstance(request_data, dict):
+                    outbox.put(codec.error_envelope(None, -32600, "Invalid Request: expected a JSON-RPC object"))
+                    continue
+                # Stop reading while max_inflight requests are outstanding
+                slots.acquire()
+                executor.submit(work, request_data, request_data.get("id"))
+        finally:
+            executor.shutdown(wait=True)
+            outbox.put(None)
+            writer_thread.join()
+
+def _write_stdout(message):
+    """Write one JSON-RPC message (encoded bytes or a dict) as a line on stdout."""
+    data = message if isinstance(message, bytes) else codec.dumps(message)
+    sys.stdout.buffer.write(data + b"\n")
+    sys.stdout.buffer.flush()
 
 # Create Flask app for web server mode
 web_app = Flask(__name__)
 mcp_server = MCPEmotionServer()
 
+# Persistent SSE sessions; responses to /message?sessionId= are handled on a worker pool
+sse_registry = SSESessionRegistry(
+    max_sessions=int(os.environ.get("MCP_SSE_MAX_SESSIONS", "256")),
+    max_queue=int(os.environ.get("MCP_SSE_QUEUE_SIZE", "64")),
+    heartbeat_interval=float(os.environ.get("MCP_SSE_HEARTBEAT_SECONDS", "15")),
+)
+session_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("MCP_SSE_WORKERS", "32")),
+                                      thread_name_prefix="sse-session")
+
+# WebSocket connections on /ws; each may have up to WS_MAX_INFLIGHT calls running on the pool
+ws_registry = ws_transport.WebSocketRegistry(max_connections=int(os.environ.get("MCP_WS_MAX_CONNECTIONS", "256")))
+WS_MAX_INFLIGHT = int(os.environ.get("MCP_WS_MAX_INFLIGHT", "16"))
+WS_PING_SECONDS = float(os.environ.get("MCP_WS_PING_SECONDS", "20"))
+WS_MAX_MESSAGE_BYTES = int(os.environ.get("MCP_WS_MAX_MESSAGE_BYTES", str(1 << 20)))
+ws_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("MCP_WS_WORKERS", "32")),
+                                 thread_name_prefix="ws-call")
+
 # Configure Flask to run on the correct host and port for Modal
 if __name__ != "__main__":
     web_app.config['HOST'] = '0.0.0.0'
     web_app.config['PORT'] = 8000
 
+# Per-client rate limiting on the POST endpoints (the public server is shared by every client)
+RATE_LIMIT_ENABLED = os.environ.get("MCP_RATE_LIMIT_ENABLED", "1") == "1"
+rate_limiter = TokenBucketLimiter(
+    rate=float(os.environ.get("MCP_RATE_LIMIT_RPS", "5")),
+    burst=int(os.environ.get("MCP_RATE_LIMIT_BURST", "20")),
+    idle_seconds=float(os.environ.get("MCP_RATE_LIMIT_IDLE_SECONDS", "300")),
+) if RATE_LIMIT_ENABLED else None
+# Headers are client-controlled, so a caller is only identified by an API key we issued (hashed here)
+# or by the X-Forwarded-For hop our own proxies added (Modal's web endpoint adds one)
+RATE_LIMIT_API_KEYS = frozenset(
+    hashlib.sha256(key.strip().encode("utf-8")).hexdigest()
+    for key in os.environ.get("MCP_RATE_LIMIT_API_KEYS", "").split(",") if key.strip())
+TRUSTED_PROXY_HOPS = int(os.environ.get("MCP_TRUSTED_PROXY_HOPS", "1"))
+# MCP methods that cost no inference and are not rate limited
+RATE_LIMIT_EXEMPT_METHODS = frozenset(("initialize", "notifications/initialized", "tools/list", "ping"))
+
+# On-demand sampling profiler, behind POST /admin/profile (disabled unless MCP_ADMIN_TOKEN is set)
+ADMIN_TOKEN = os.environ.get("MCP_ADMIN_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.environ.get("MCP_PROFILE_MAX_SECONDS", "60"))
+profiler = SamplingProfiler(interval=float(os.environ.get("MCP_PROFILE_INTERVAL_MS", "10")) / 1000.0)
+
+@web_app.before_request
+def _tag_profiler_thread():
+    profiler.tag(request.path)
+
+@web_app.teardown_request
+def _untag_profiler_thread(exc):
+    profiler.untag()
+
+def _client_ip():
+    """The client address as seen by the outermost trusted proxy (TRUSTED_PROXY_HOPS from the right)."""
+    if TRUSTED_PROXY_HOPS > 0:
+        hops = [hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.remote_addr or "unknown"
+
+def _client_key():
+    """Identify the caller: a known API key (and its X-Client-Id, if any), else the client IP."""
+    api_key = request.headers.get("X-API-Key")
+    if not api_key:
+        auth = request.headers.get("Authorization", "")
+        if auth.lower().startswith("bearer "):
+            api_key = auth[7:].strip()
+    if api_key:
+        digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        if digest in RATE_LIMIT_API_KEYS:
+            client_id = request.headers.get("X-Client-Id")
+            return f"key:{digest[:16]}" + (f":client:{client_id[:128]}" if client_id else "")
+    return "ip:" + _client_ip()
+
+@web_app.before_request
+def _apply_rate_limit():
+    if rate_limiter is None or request.method != "POST":
+        return None
+    if request.path in ("/mcp", "/message"):
+        data = _read_json()
+        if isinstance(data, dict) and data.get("method") in RATE_LIMIT_EXEMPT_METHODS:
+            return None
+    decision = rate_limiter.check(_client_key())
+    g.rate_limit = decision
+    if not decision.allowed:
+        return _json_response(codec.error_envelope(
+            None, OVERLOADED_ERROR_CODE, "Rate limit exceeded", data={"retryAfter": decision.retry_after}), status=429)
+    return None
+
+@web_app.after_request
+def _add_rate_limit_headers(response):
+    decision = g.get("rate_limit")
+    if decision is not None:
+        for name, value in decision.headers().items():
+            response.headers[name] = value
+    return response
+
+def _read_json():
+    """Parse the request body with the fast codec; None if it is empty or not JSON.
+
+    The result is kept for the rest of the request, so hooks and views can both call this.
+    """
+    if "json_body" not in g:
+        body = request.get_data(cache=False)
+        try:
+            g.json_body = codec.loads(body) if body else None
+        except ValueError:
+            g.json_body = None
+    return g.json_body
+
+def _json_response(body, status=200):
+    """Return pre-encoded JSON bytes as a Flask response."""
+    return Response(body, status=status, mimetype='application/json')
+
+def _overloaded_response(request_id, exc):
+    """Fast 429 with a Retry-After hint and a JSON-RPC error body."""
+    response = _json_response(overloaded_envelope(request_id, exc), status=429)
+    response.headers['Retry-After'] = str(max(1, int(round(exc.retry_after))))
+    return response
+
+def _respond_http(data):
+    """Run an MCP request for an HTTP caller, mapping admission rejection to 429."""
+    try:
+        return _json_response(mcp_server.respond(
+            data, raise_overloaded=True, priority=request.headers.get(PRIORITY_HEADER),
+            deadline=deadlines.from_timeout_ms(request.headers.get(deadlines.TIMEOUT_HEADER))))
+    except Overloaded as e:
+        return _overloaded_response(data.get("id"), e)
+
 @web_app.route('/mcp', methods=['POST'])
 def mcp_endpoint():
     """Handle MCP protocol messages via HTTP"""
     try:
-        data = request.get_json()
+        data = _read_json()
         if not data:
             return {"error": "No JSON data provided"}, 400
         
-        response = mcp_server.handle_request(data)
-        return jsonify(response)
+        return _respond_http(data)
         
     except Exception as e:
         return jsonify({
@@ -263,49 +1320,130 @@ def mcp_endpoint():
             "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
         }), 500
 
+metrics.gauge("admission_inflight", "Tool calls holding an admission slot",
+              fn=lambda: admission.stats()["inflight"])
+metrics.gauge("admission_queue_depth", "Tool calls waiting for an admission slot",
+              fn=lambda: admission.stats()["queue_depth"])
+metrics.gauge("sse_sessions", "Open SSE sessions", fn=lambda: sse_registry.stats()["active_sessions"])
+metrics.gauge("websocket_connections", "Open WebSocket connections", fn=lambda: ws_registry.stats()["active_connections"])
+if shadow is not None:
+    metrics.gauge("shadow_comparisons", "Shadow-evaluated answers the baseline could judge, by agreement", ("agreed",),
+                  fn=lambda: {("true",): shadow.agreed, ("false",): shadow.comparable - shadow.agreed})
+    metrics.gauge("shadow_samples_dropped", "Shadow samples dropped because the queue was full",
+                  fn=lambda: shadow.dropped)
+metrics.gauge("upstream_outstanding", "Requests in flight per upstream backend", ("backend",),
+              fn=lambda: {(b["name"],): b["outstanding"] for b in upstream_pool.stats()["backends"]})
+
 @web_app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return {
+    health = {
         "status": "healthy", 
         "server": "MCP Emotion Server",
         "version": "1.0.0",
-        "tools": ["emotion_detection", "emotion_detection_detailed"]
+        "tools": list(mcp_server.tools)
     }
+    if predict_batcher is not None:
+        health["batching"] = predict_batcher.stats()
+    health["sse"] = sse_registry.stats()
+    health["websocket"] = ws_registry.stats()
+    health["jobs"] = job_manager.stats()
+    if governor is not None:
+        health["input_governor"] = governor.stats()
+    if local_prefilter is not None:
+        health["prefilter"] = local_prefilter.stats()
+    if shadow is not None:
+        health["shadow"] = shadow.stats()
+    health["cascade"] = dict(cascade_policy.stats(), default_mode=DEFAULT_PREDICT_MODE)
+    health["admission"] = admission.stats()
+    if rate_limiter is not None:
+        health["rate_limit"] = rate_limiter.stats()
+    health["upstream_pool"] = upstream_pool.stats()
+    health["upstreams"] = upstream_stats()
+    if HEDGE_ENABLED:
+        health["hedge_budget"] = hedge_budget.stats()
+    health["startup"] = startup_timeline.as_dict()
+    health["metrics"] = metrics.as_dict()
+    health["profiler"] = profiler.stats()
+    health["worker"] = {"pid": os.getpid(), "workers": WORKER_COUNT}
+    if prediction_cache is not None:
+        health["cache"] = prediction_cache.stats()
+    return health
+
+@web_app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of the server metrics"""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 @web_app.route('/sse', methods=['GET'])
 def sse_endpoint():
-    """Handle SSE connections for MCP protocol."""
-    from flask import Response
-    
-    def generate_sse():
-        # Send initial connection event
-        yield "data: {\"type\": \"connected\", \"message\": \"MCP server connected\"}\n\n"
-        # Send a few more events and then close
-        yield "data: {\"type\": \"ready\", \"message\": \"MCP server ready\"}\n\n"
-        yield "data: {\"type\": \"heartbeat\", \"timestamp\": " + str(int(__import__('time').time())) + "}\n\n"
-    
+    """Open a persistent MCP SSE session.
+
+    The first event names the session's message endpoint; responses to messages
+    posted there are delivered on this stream, with heartbeats in between.
+    """
+    session = sse_registry.create()
+    if session is None:
+        return {"error": "Too many open SSE sessions"}, 503
+    logger.info("SSE session opened: %s", session.id)
+
     return Response(
-        generate_sse(),
+        stream_with_context(sse_registry.stream(session)),
         mimetype='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no',
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Headers': 'Cache-Control'
         }
     )
 
+def _deliver_to_session(session_id, data, priority=None, deadline=None):
+    """Handle a message off the request thread and push the response onto the session stream."""
+    def notify(message):
+        try:
+            sse_registry.publish(session_id, message)
+        except (SessionNotFound, SessionQueueFull):
+            pass  # progress is best-effort
+
+    response = mcp_server.respond(data, notify=notify, priority=priority, deadline=deadline)
+    if data.get("id") is None:
+        return  # JSON-RPC notifications get no response
+    try:
+        sse_registry.publish(session_id, response)
+    except SessionNotFound:
+        logger.info("SSE session %s closed before response %s was delivered", session_id, data.get("id"))
+    except SessionQueueFull:
+        logger.warning("SSE session %s queue full, dropped response %s", session_id, data.get("id"))
+
 @web_app.route('/message', methods=['POST'])
 def message_endpoint():
-    """Handle MCP protocol messages directly (legacy endpoint)."""
+    """Handle MCP protocol messages.
+
+    For a session opened via ``/sse`` the message is accepted (202) and its response is
+    pushed on that session's stream; otherwise the response is returned inline (legacy).
+    """
     try:
-        data = request.get_json()
+        data = _read_json()
         if not data:
             return {"error": "No JSON data provided"}, 400
         
-        response = mcp_server.handle_request(data)
-        return jsonify(response)
+        session_id = request.args.get("sessionId")
+        session = sse_registry.find(session_id) if session_id else None
+        if session is not None:
+            if not session.has_room():
+                return {"error": "Session queue full"}, 503
+            priority = request.headers.get(PRIORITY_HEADER)
+            if data.get("method") == "tools/call" and admission.saturated(request_lane(data.get("params"), priority)):
+                return _overloaded_response(data.get("id"), Overloaded("Server overloaded: admission queue full", admission.stats()["retry_after_seconds"]))
+            # The budget starts now, so time spent waiting for a session worker counts against it
+            deadline = deadlines.from_timeout_ms(request.headers.get(deadlines.TIMEOUT_HEADER))
+            session_executor.submit(_deliver_to_session, session_id, data, priority, deadline)
+            return "Accepted", 202
+        
+        # No live session (or a client-invented id): answer inline
+        return _respond_http(data)
         
     except Exception as e:
         return jsonify({
@@ -314,19 +1452,246 @@ def message_endpoint():
             "error": {"code": -32603, "message": f"Internal error: {str(e)}"}
         }), 500
 
+class _WebSocketClosedResponse(Response):
+    """Returned once a WebSocket ends; the socket is already closed, so nothing is written."""
+
+    def __call__(self, environ, start_response):
+        # Werkzeug treats a ConnectionError from the app as a dropped connection
+        raise ConnectionError("WebSocket closed")
+
+def _serve_websocket(ws, client_key, priority):
+    """Read JSON-RPC messages from ws and answer each one from the pool as soon as it is done.
+
+    At most WS_MAX_INFLIGHT calls per connection run at once; beyond that the
+    connection stops reading, so TCP flow control slows the client down.
+    """
+    slots = threading.BoundedSemaphore(WS_MAX_INFLIGHT)
+
+    def send(message):
+        try:
+            ws.send(message)
+        except ws_transport.ConnectionClosed:
+            pass  # the caller went away; the result is dropped
+
+    def work(data, deadline):
+        try:
+            response = mcp_server.respond(data, notify=send, priority=priority, deadline=deadline)
+            if data.get("id") is not None:
+                send(response)
+        except Exception as e:
+            send(codec.error_envelope(data.get("id"), -32603, f"Server error: {str(e)}"))
+        finally:
+            slots.release()
+
+    while True:
+        message = ws.receive()
+        if message is None:
+            return
+        try:
+            data = codec.loads(message)
+        except ValueError as e:
+            send(codec.error_envelope(None, -32700, f"Parse error: {str(e)}"))
+            continue
+        if not isinstance(data, dict):
+            send(codec.error_envelope(None, -32600, "Invalid Request: expected a JSON-RPC object"))
+            continue
+        if rate_limiter is not None and data.get("method") == "tools/call":
+            decision = rate_limiter.check(client_key)
+            if not decision.allowed:
+                send(codec.error_envelope(data.get("id"), OVERLOADED_ERROR_CODE, "Rate limit exceeded",
+                                          data={"retryAfter": decision.retry_after}))
+                continue
+        params = data.get("params")
+        meta = params.get("_meta") if isinstance(params, dict) else None
+        # The budget starts when the message arrives, not when a worker picks it up
+        deadline = deadlines.from_timeout_ms(meta.get("timeoutMs") if isinstance(meta, dict) else None)
+        slots.acquire()
+        ws_executor.submit(work, data, deadline)
+
+# websocket=True: Werkzeug only routes requests carrying "Upgrade: websocket" here
+@web_app.route('/ws', methods=['GET'], websocket=True)
+def websocket_endpoint():
+    """Bidirectional MCP over a WebSocket: JSON-RPC text messages, responses in completion order."""
+    key = request.headers.get("Sec-WebSocket-Key")
+    if not key:
+        return {"error": "Missing Sec-WebSocket-Key"}, 400
+    sock = request.environ.get("werkzeug.socket")
+    if sock is None:
+        return {"error": "WebSocket is not supported by this WSGI server"}, 501
+    if not ws_registry.has_room():
+        return {"error": "Too many WebSocket connections"}, 503
+    ws_transport.server_handshake(sock, key)
+    ws = ws_transport.WebSocket(sock, max_message_size=WS_MAX_MESSAGE_BYTES, ping_interval=WS_PING_SECONDS,
+                                send_timeout=UPSTREAM_TIMEOUT)
+    if not ws_registry.try_register(ws):
+        ws.close(ws_transport.CLOSE_GOING_AWAY, "Too many connections")
+        return _WebSocketClosedResponse()
+    try:
+        _serve_websocket(ws, _client_key(), request.headers.get(PRIORITY_HEADER))
+    finally:
+        ws.close()
+        ws_registry.unregister(ws)
+    return _WebSocketClosedResponse()
+
+# Background jobs for large batches: submit, then poll or stream (see jobs.py)
+JOB_MAX_ITEMS = int(os.environ.get("MCP_JOB_MAX_ITEMS", "10000"))
+JOB_STREAM_POLL_SECONDS = 0.5
+
+def _process_job_chunk(texts, options):
+    """Classify one chunk of a job in the bulk lane, waiting out overload instead of failing."""
+    cost = estimate_tool_cost({"texts": texts})
+    while True:
+        try:
+            with admission.slot(cost, "bulk"):
+                return detect_emotion_batch(texts, accurate=options.get("accurate", False),
+                                            detailed=options.get("detailed", False),
+                                            top_k=options.get("top_k", 3), auto=options.get("auto", False),
+                                            threshold=options.get("threshold"))["results"]
+        except Overloaded as e:
+            time.sleep(e.retry_after)
+
+job_manager = JobManager(
+    JobStore(os.environ.get("MCP_JOB_DB", "/tmp/mcp_jobs.sqlite3"),
+             retention_seconds=float(os.environ.get("MCP_JOB_RETENTION_SECONDS", "86400")),
+             max_jobs=int(os.environ.get("MCP_JOB_MAX_STORED", "1000"))),
+    _process_job_chunk,
+    # No job workers in a process that delegates to prefork: they would claim jobs beside the real ones
+    workers=0 if DELEGATES_TO_PREFORK else int(os.environ.get("MCP_JOB_WORKERS", "2")),
+    chunk_size=int(os.environ.get("MCP_JOB_CHUNK_SIZE", "32")),
+    lease_seconds=float(os.environ.get("MCP_JOB_LEASE_SECONDS", "60")),
+)
+
+def _job_links(job_id):
+    return {"self": f"/jobs/{job_id}", "results": f"/jobs/{job_id}?results=1", "stream": f"/jobs/{job_id}/stream"}
+
+@web_app.route('/jobs', methods=['POST'])
+def submit_job_endpoint():
+    """Submit {"texts": [...], "mode", "threshold", "detailed", "top_k"} and get a job id back at once (202)."""
+    data = _read_json()
+    texts = data.get("texts") if isinstance(data, dict) else None
+    if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+        return {"error": "'texts' must be a non-empty list of strings"}, 400
+    if len(texts) > JOB_MAX_ITEMS:
+        return {"error": f"Too many texts: {len(texts)} (max {JOB_MAX_ITEMS})"}, 413
+    try:
+        top_k = MCPEmotionServer._top_k(data)
+        mode, threshold = MCPEmotionServer._prediction_mode(data)
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}, 400
+    options = {"accurate": mode == "accurate", "auto": mode == "auto", "threshold": threshold,
+               "detailed": bool(data.get("detailed", False)), "top_k": top_k}
+    job = job_manager.submit(texts, options)
+    job["links"] = _job_links(job["id"])
+    return job, 202, {"Location": job["links"]["self"]}
+
+@web_app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_endpoint(job_id):
+    """Job progress; with ?results=1 also its (partial) results, paged by offset/limit."""
+    try:
+        job = job_manager.store.get(job_id)
+        if request.args.get("results") in ("1", "true"):
+            offset = int(request.args.get("offset", 0))
+            limit = int(request.args["limit"]) if "limit" in request.args else None
+            job["results"] = job_manager.store.results(job_id, offset, limit)
+    except JobNotFound:
+        return {"error": "Job not found"}, 404
+    except ValueError:
+        return {"error": "offset and limit must be integers"}, 400
+    job["links"] = _job_links(job_id)
+    return job
+
+@web_app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job_endpoint(job_id):
+    """Cancel a queued or running job; results stored so far are kept."""
+    try:
+        return {"id": job_id, "status": job_manager.store.cancel(job_id)}
+    except JobNotFound:
+        return {"error": "Job not found"}, 404
+
+@web_app.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream_endpoint(job_id):
+    """SSE stream: a 'result' event per new item, 'progress' after each batch of them, then 'done'."""
+    try:
+        job_manager.store.get(job_id)
+    except JobNotFound:
+        return {"error": "Job not found"}, 404
+
+    def stream():
+        cursor = {}
+        while True:
+            try:
+                job = job_manager.store.get(job_id)
+            except JobNotFound:
+                yield format_event("done", {"id": job_id, "status": "deleted"})
+                return
+            fresh = job_manager.store.results_since(job_id, cursor)
+            for item in fresh:
+                yield format_event("result", item)
+            if fresh or job["status"] not in ACTIVE_STATUSES:
+                yield format_event("progress", {k: job[k] for k in ("id", "status", "done", "total", "errors")})
+            if job["status"] not in ACTIVE_STATUSES:
+                yield format_event("done", job)
+                return
+            time.sleep(JOB_STREAM_POLL_SECONDS)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@web_app.route('/admin/profile', methods=['POST'])
+def admin_profile_endpoint():
+    """Sample all threads for ?seconds=N and return the profile.
+
+    Requires Authorization: Bearer $MCP_ADMIN_TOKEN. Returns a per-endpoint
+    wall-time breakdown plus collapsed stacks as JSON, or just the collapsed
+    stacks (flamegraph.pl / speedscope input) with ?format=collapsed.
+    """
+    if not ADMIN_TOKEN:
+        return {"error": "Not found"}, 404
+    auth = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(auth.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+        return {"error": "Unauthorized"}, 401
+    try:
+        seconds = float(request.args.get("seconds", "10"))
+    except ValueError:
+        return {"error": "seconds must be a number"}, 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return {"error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"}, 400
+    try:
+        result = profiler.profile(seconds)
+    except ProfilerBusy as e:
+        return {"error": str(e)}, 409
+    logger.info("Profiled %.1fs: %d samples", result["seconds"], result["samples"])
+    if request.args.get("format") == "collapsed":
+        response = Response(result["collapsed"] + "\n", mimetype="text/plain")
+        response.headers["Content-Disposition"] = "attachment; filename=mcp-profile.collapsed"
+        return response
+    return result
+
 @web_app.route('/predict-detailed', methods=['POST'])
 def predict_detailed_endpoint():
-    """Direct API endpoint for detailed emotion prediction."""
+    """Direct API endpoint for detailed emotion prediction.
+
+    Body: {"text"} for the full upstream JSON, plus "compact"/"top_k"/"arrays"/"labels" for
+    the compact form (see compact_detailed).
+    """
     try:
         data = request.get_json()
         if not data or 'text' not in data:
             return {"error": "No text provided"}, 400
         
         text = data['text']
-        detailed_result = detect_emotion_detailed(text)
+        compact = data.get("compact") or data.get("arrays")
+        try:
+            top_k = MCPEmotionServer._top_k(data) if compact else None
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        with deadlines.deadline_scope(deadlines.from_timeout_ms(request.headers.get(deadlines.TIMEOUT_HEADER))):
+            detailed_result = detect_emotion_detailed(text)
         
-        # Return the detailed result as JSON passthrough
-        return jsonify(detailed_result)
+        if compact:
+            detailed_result = compact_detailed(detailed_result, top_k, bool(data.get("arrays")), bool(data.get("labels")))
+        # Otherwise the detailed result is passed through as is
+        return _json_response(codec.dumps(detailed_result))
         
     except Exception as e:
         return jsonify({
@@ -345,16 +1710,20 @@ def root_endpoint():
             "mcp": "/mcp",
             "message": "/message", 
             "sse": "/sse",
+            "websocket": "/ws",
+            "jobs": "/jobs",
             "health": "/health",
+            "metrics": "/metrics",
             "predict_detailed": "/predict-detailed"
         },
-        "tools": ["emotion_detection", "emotion_detection_detailed"]
+        "tools": list(mcp_server.tools)
     }
 
 @app.function(
     image=image,
     cpu=2,
     memory=4096,
+    volumes={"/cache": cache_volume},
     max_containers=1,  # Only one container at a time
     timeout=600,
     min_containers=0  # No keep-warm, container shuts down after idle
@@ -362,15 +1731,31 @@ def root_endpoint():
 @modal.web_server(port=8000)
 def serve():
     """Modal web server implementation"""
-    # Start Flask app in a thread
-    def run_flask():
-        web_app.run(host="0.0.0.0", port=8000, debug=False, use_reloader=False)
-    
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    startup_timeline.mark("serve_called")
+
+    if DELEGATES_TO_PREFORK:
+        # Several worker processes behind one socket, sharing the prediction cache
+        here = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+        master = subprocess.Popen([sys.executable, "-m", "prefork", "--workers", str(SERVE_WORKERS),
+                                   "--port", "8000", "working_solution:web_app"], env=env, cwd=here)
+        is_alive = lambda: master.poll() is None
+        startup_timeline.mark("workers_started")
+    else:
+        # Start Flask app in a thread
+        def run_flask():
+            web_app.run(host="0.0.0.0", port=8000, debug=False, use_reloader=False)
+
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
+        is_alive = flask_thread.is_alive
+        startup_timeline.mark("flask_thread_started")
     
-    # Wait a moment for Flask to start
-    time.sleep(2)
+    # Return as soon as the server answers /health rather than after a fixed sleep
+    if not wait_until_ready("127.0.0.1", 8000, timeout=STARTUP_TIMEOUT,
+                            timeline=startup_timeline, is_alive=is_alive):
+        raise RuntimeError("MCP server did not become ready")
+    logger.info("MCP server ready in %.1f ms", startup_timeline.as_dict()["total_ms"])
     
     return web_app
 
@@ -379,7 +1764,7 @@ def main():
     if len(sys.argv) > 1 and sys.argv[1] == "--stdio":
         # Run in stdio mode for MCP Inspector
         server = MCPEmotionServer()
-        server.run_stdio()
+        server.run_stdio(max_inflight=int(os.environ.get("MCP_STDIO_MAX_INFLIGHT", "16")))
     else:
         # Run in web server mode for Modal deployment
         print("Starting MCP Emotion Server in web mode...")
@@ -0,0 +1,310 @@
+"""
+WebSocket transport (RFC 6455) for the MCP server.
+
+One connection carries JSON-RPC requests, responses and notifications in both
+directions as text messages, so a chatty client pays for the HTTP handshake
+once instead of on every call. The framing is implemented here on top of the
+raw socket the WSGI server exposes (``environ["werkzeug.socket"]``), so no
+extra package is needed.
+
+The server side answers pings, sends its own ping after ``ping_interval``
+seconds of silence and closes the connection when nothing (not even a pong)
+has arrived for twice that long. Sends from several threads are serialised
+by a lock; a client that stops reading blocks them until ``send_timeout``,
+after which the connection is dropped.
+
+``connect()`` opens a client connection, for scripts and load tests.
+"""
+
+import base64
+import hashlib
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+CLOSE_INTERNAL_ERROR = 1011
+
+
+class ConnectionClosed(ConnectionError):
+    """Raised when sending on, or receiving from, a closed WebSocket."""
+
+
+def accept_key(key):
+    """Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1(key.encode("ascii") + _GUID).digest()).decode("ascii")
+
+
+def _frame(opcode, payload, mask):
+    length = len(payload)
+    head = bytes([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        head += bytes([mask_bit | length])
+    elif length < 1 << 16:
+        head += bytes([mask_bit | 126]) + struct.pack("!H", length)
+    else:
+        head += bytes([mask_bit | 127]) + struct.pack("!Q", length)
+    if not mask:
+        return head + payload
+    key = os.urandom(4)
+    return head + key + _apply_mask(payload, key)
+
+
+def _apply_mask(payload, key):
+    # XOR with the repeated 4-byte key, a whole machine word at a time
+    if not payload:
+        return payload
+    repeated = (key * (len(payload) // 4 + 1))[:len(payload)]
+    n = int.from_bytes(payload, "little") ^ int.from_bytes(repeated, "little")
+    return n.to_bytes(len(payload), "little")
+
+
+class WebSocket:
+    """An open WebSocket connection over a connected socket."""
+
+    def __init__(self, sock, client=False, max_message_size=1 << 20, ping_interval=20.0, send_timeout=30.0):
+        self.sock = sock
+        self.client = client
+        self.max_message_size = max_message_size
+        self.ping_interval = ping_interval
+        sock.settimeout(send_timeout)
+        self._send_lock = threading.Lock()
+        self._poller = None
+        if hasattr(select, "poll"):
+            self._poller = select.poll()
+            self._poller.register(sock, select.POLLIN)
+        self.closed = False
+        self.close_code = None
+        self.keepalive_expired = False
+        self.last_received = time.monotonic()
+        self.messages_received = 0
+        self.messages_sent = 0
+        self.pings_sent = 0
+
+    # -- sending --------------------------------------------------------
+
+    def _send_frame(self, opcode, payload):
+        frame = _frame(opcode, payload, mask=self.client)
+        with self._send_lock:
+            if self.closed and opcode != OP_CLOSE:
+                raise ConnectionClosed("WebSocket is closed")
+            try:
+                self.sock.sendall(frame)
+            except OSError as e:
+                self._abort()
+                raise ConnectionClosed(str(e)) from e
+
+    def send(self, message):
+        """Send a text message (str or UTF-8 bytes). Raises ConnectionClosed."""
+        self._send_frame(OP_TEXT, message.encode("utf-8") if isinstance(message, str) else message)
+        self.messages_sent += 1
+
+    def ping(self, payload=b""):
+        self._send_frame(OP_PING, payload)
+        self.pings_sent += 1
+
+    def close(self, code=CLOSE_NORMAL, reason=""):
+        """Send a close frame (once) and shut the socket down."""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_code = code
+        try:
+            self._send_frame(OP_CLOSE, struct.pack("!H", code) + reason.encode("utf-8")[:120])
+        except ConnectionClosed:
+            pass
+        self._abort()
+
+    def _abort(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # -- receiving ------------------------------------------------------
+
+    def _wait_readable(self, timeout):
+        if self._poller is not None:
+            return bool(self._poller.poll(timeout * 1000.0))
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def _recv_exact(self, n):
+        chunks = []
+        while n:
+            chunk = self.sock.recv(min(n, 1 << 16))
+            if not chunk:
+                raise ConnectionClosed("Connection closed by peer")
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b"".join(chunks)
+
+    def _read_frame(self):
+        first, second = self._recv_exact(2)
+        fin, opcode = first & 0x80, first & 0x0F
+        masked, length = second & 0x80, second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._recv_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv_exact(8))[0]
+        if masked != (0 if self.client else 0x80):
+            raise _ProtocolError(CLOSE_PROTOCOL_ERROR, "Bad frame masking")
+        if length > self.max_message_size:
+            raise _ProtocolError(CLOSE_TOO_BIG, "Message too big")
+        key = self._recv_exact(4) if masked else None
+        payload = self._recv_exact(length)
+        return bool(fin), opcode, _apply_mask(payload, key) if key else payload
+
+    def receive(self):
+        """Next text or binary message, or None once the connection is closed.
+
+        Answers pings, and keeps the connection alive (or detects that it is
+        dead) while waiting.
+        """
+        parts = []
+        message_opcode = None
+        try:
+            while not self.closed:
+                if not self._wait_readable(self.ping_interval):
+                    if time.monotonic() - self.last_received > 2 * self.ping_interval:
+                        self.keepalive_expired = True
+                        self.close(CLOSE_GOING_AWAY, "Keepalive timeout")
+                        return None
+                    self.ping()
+                    continue
+                fin, opcode, payload = self._read_frame()
+                self.last_received = time.monotonic()
+                if opcode == OP_PING:
+                    self._send_frame(OP_PONG, payload)
+                elif opcode == OP_PONG:
+                    pass
+                elif opcode == OP_CLOSE:
+                    code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                    self.close(code)
+                    return None
+                elif opcode in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+                    if (opcode == OP_CONTINUATION) != (message_opcode is not None):
+                        raise _ProtocolError(CLOSE_PROTOCOL_ERROR, "Unexpected continuation frame")
+                    message_opcode = message_opcode or opcode
+                    parts.append(payload)
+                    if sum(len(p) for p in parts) > self.max_message_size:
+                        raise _ProtocolError(CLOSE_TOO_BIG, "Message too big")
+                    if fin:
+                        self.messages_received += 1
+                        data = b"".join(parts)
+                        return data.decode("utf-8") if message_opcode == OP_TEXT else data
+                else:
+                    raise _ProtocolError(CLOSE_PROTOCOL_ERROR, f"Unknown opcode {opcode}")
+        except _ProtocolError as e:
+            self.close(e.code, str(e))
+        except UnicodeDecodeError:
+            self.close(CLOSE_PROTOCOL_ERROR, "Invalid UTF-8")
+        except (ConnectionClosed, OSError):
+            self._abort()
+        return None
+
+
+class _ProtocolError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def server_handshake(sock, key, extra_headers=None):
+    """Complete the upgrade on a server socket after the HTTP request was read."""
+    lines = ["HTTP/1.1 101 Switching Protocols", "Upgrade: websocket", "Connection: Upgrade",
+             f"Sec-WebSocket-Accept: {accept_key(key)}"]
+    lines += [f"{name}: {value}" for name, value in (extra_headers or {}).items()]
+    sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+
+def connect(url, headers=None, timeout=10.0, **kwargs):
+    """Open a client WebSocket to a ws:// or http:// URL."""
+    parts = urlsplit(url)
+    if parts.scheme in ("wss", "https"):
+        raise ValueError("connect() supports plain ws:// only")
+    port = parts.port or 80
+    sock = socket.create_connection((parts.hostname, port), timeout=timeout)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    lines = [f"GET {parts.path or '/'}{'?' + parts.query if parts.query else ''} HTTP/1.1",
+             f"Host: {parts.hostname}:{port}", "Upgrade: websocket", "Connection: Upgrade",
+             f"Sec-WebSocket-Key: {key}", "Sec-WebSocket-Version: 13"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    response = b""
+    while b"\r\n\r\n" not in response:
+        chunk = sock.recv(1)  # byte by byte so no frame data is consumed
+        if not chunk:
+            raise ConnectionClosed("Connection closed during handshake")
+        response += chunk
+    status = response.split(b"\r\n", 1)[0]
+    if b" 101 " not in status + b" " or accept_key(key).encode("ascii") not in response:
+        sock.close()
+        raise ConnectionError(f"WebSocket handshake failed: {status.decode('latin-1')}")
+    return WebSocket(sock, client=True, **kwargs)
+
+
+class WebSocketRegistry:
+    """Track open server connections: a connection cap and counters for /health."""
+
+    def __init__(self, max_connections=256):
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._open = set()
+        self.opened = 0
+        self.rejected = 0
+        self.keepalive_closed = 0
+        self._closed_received = 0
+        self._closed_sent = 0
+
+    def try_register(self, ws):
+        """Add ws unless the cap is reached. Returns False (and counts a rejection) if full."""
+        with self._lock:
+            if len(self._open) >= self.max_connections:
+                self.rejected += 1
+                return False
+            self._open.add(ws)
+            self.opened += 1
+            return True
+
+    def has_room(self):
+        with self._lock:
+            return len(self._open) < self.max_connections
+
+    def unregister(self, ws):
+        with self._lock:
+            if ws in self._open:
+                self._open.discard(ws)
+                self._closed_received += ws.messages_received
+                self._closed_sent += ws.messages_sent
+                if ws.keepalive_expired:
+                    self.keepalive_closed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_connections": len(self._open),
+                "max_connections": self.max_connections,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "keepalive_closed": self.keepalive_closed,
+                "messages_received": self._closed_received + sum(ws.messages_received for ws in self._open),
+                "messages_sent": self._closed_sent + sum(ws.messages_sent for ws in self._open),
+            }
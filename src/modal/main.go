@@ -12,6 +12,12 @@ func main() {
 	const port = "8000"
 	addr := fmt.Sprintf("0.0.0.0:%s", port)
 	
+	// Readiness probe polled by proxy_app.py at startup.
+	http.HandleFunc("/health", func(w http.ResponseWriter, r *http.Request) {
+		w.WriteHeader(http.StatusOK)
+		fmt.Fprintf(w, "ok")
+	})
+
 	http.HandleFunc("/", func(w http.ResponseWriter, r *http.Request) {
 		fmt.Fprintf(w, "Hello from a Go web server!")
 	})
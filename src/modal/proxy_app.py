@@ -1,18 +1,29 @@
 import modal
+import os
 import subprocess
+import sys
 import time
 import threading
 import requests
 from flask import Flask, request, Response
 
+# Readiness polling and the cold-start timeline are shared with the MCP server (../modal-mcp/startup.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modal-mcp"))
+from startup import StartupTimeline, wait_until_ready
+
 # Define the custom Docker image using your Dockerfile
-go_image = modal.Image.from_dockerfile("Dockerfile")
+go_image = modal.Image.from_dockerfile("Dockerfile").add_local_python_source("startup")
 
 # Define the app
 app = modal.App("go-web-server-example")
 
 # Global variable to store the Go server process
 go_process = None
+go_started = threading.Event()
+
+# Cold-start phases, logged as they happen (the Go server itself serves port 8000)
+startup_timeline = StartupTimeline()
+STARTUP_TIMEOUT = 30.0
 
 def start_go_server():
     global go_process
@@ -21,23 +32,28 @@ def start_go_server():
                                  stderr=subprocess.PIPE,
                                  text=True)
     print(f"Started Go server with PID: {go_process.pid}")
-    time.sleep(2)  # Wait for server to start
+    startup_timeline.mark("go_process_started")
+    go_started.set()
 
 # Use the Go image directly for the web server
 @app.function(image=go_image)
 @modal.web_server(port=8000)
 def serve():
+    startup_timeline.mark("serve_called")
     # Start the Go server in a separate thread
     go_thread = threading.Thread(target=start_go_server)
     go_thread.daemon = True
     go_thread.start()
     
-    # Wait for the Go server to start
-    time.sleep(3)
+    # Wait until the Go server answers its health check, failing early if it exits
+    go_started.wait(STARTUP_TIMEOUT)
+    ready = go_process is not None and wait_until_ready(
+        "127.0.0.1", 8000, timeout=STARTUP_TIMEOUT, timeline=startup_timeline,
+        is_alive=lambda: go_process.poll() is None)
     
     # Check if the Go server is running
-    if go_process and go_process.poll() is None:
-        print("Go server is running successfully")
+    if ready and go_process and go_process.poll() is None:
+        print(f"Go server is running successfully (ready in {startup_timeline.as_dict()['total_ms']:.1f} ms)")
     else:
         print("Go server failed to start")
         return "Go server failed to start"
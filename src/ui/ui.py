@@ -13,6 +13,21 @@ import statistics
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+# Helpers shared with the MCP server live next to it; the Docker image copies them in
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modal-mcp"))
+try:
+    import input_governor
+except ImportError:
+    input_governor = None
+try:
+    import cascade
+except ImportError:
+    cascade = None
+try:
+    import prefilter
+except ImportError:
+    prefilter = None
+
 # Force immediate output
 sys.stdout.reconfigure(line_buffering=True)
 sys.stderr.reconfigure(line_buffering=True)
@@ -25,8 +40,24 @@ print(f"Current working directory: {os.getcwd()}", flush=True)
 MCP_BASE = os.getenv("SG_BASE", "http://127.0.0.1:9000")
 DIRECT_API_BASE = os.getenv("DIRECT_API_BASE", "http://127.0.0.1:8000")
 
+# End-to-end budget for one UI request; every hop gets what is left of it
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("UI_REQUEST_TIMEOUT_SECONDS", "60"))
+TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+# Emotions requested from the MCP server in detailed mode
+DETAILED_TOP_K = int(os.getenv("UI_DETAILED_TOP_K", "5"))
+# Texts sent straight to the emotion API can be trimmed like the MCP server trims them
+# (opt-in: UI_INPUT_GOVERNOR_ENABLED=1, then the other UI_INPUT_* settings)
+INPUT_GOVERNOR = input_governor.from_env(prefix="UI_INPUT_") if input_governor is not None else None
+# Auto mode: fast prediction first, escalated when its confidence is below UI_CASCADE_THRESHOLD
+AUTO_CASCADE = cascade.from_env(prefix="UI_CASCADE_") if cascade is not None else None
+# Only the Python MCP server (modal-mcp) understands mode=auto; the Go server behind SG_BASE ignores it
+MCP_AUTO_MODE = os.getenv("SG_AUTO_MODE", "0") == "1"
+# Optional local answers for obvious texts in auto mode (UI_PREFILTER_ENABLED=1)
+LOCAL_PREFILTER = prefilter.from_env(prefix="UI_PREFILTER_") if prefilter is not None else None
+
 print(f"MCP_BASE: {MCP_BASE}", flush=True)
 print(f"DIRECT_API_BASE: {DIRECT_API_BASE}", flush=True)
+print(f"Input governor: {INPUT_GOVERNOR.stats() if INPUT_GOVERNOR else 'disabled'}", flush=True)
 
 # Shared state for communication between threads
 q = Queue()
@@ -60,13 +91,27 @@ def _wait_for_service(url: str, timeout: int = 60, service_name: str = "service"
     print(f"Timeout waiting for {service_name}", flush=True)
     return False
 
-def _post_with_retry(endpoint: str, body: dict, retries: int = 3, delay_seconds: float = 0.5) -> tuple[int, str]:
+def _budget_headers(deadline: float | None, headers: dict | None = None) -> tuple[dict, float]:
+    """Headers carrying the remaining budget, and the per-call timeout capped to it."""
+    headers = dict(headers or {})
+    if deadline is None:
+        return headers, 30
+    remaining = deadline - time.time()
+    headers[TIMEOUT_HEADER] = str(max(0, int(remaining * 1000)))
+    return headers, max(0.001, min(30, remaining))
+
+def _post_with_retry(endpoint: str, body: dict, retries: int = 3, delay_seconds: float = 0.5,
+                     headers: dict | None = None, deadline: float | None = None) -> tuple[int, str]:
     """
     Sends a POST request with retry logic. Handles '202 Accepted' as a success and retries 
-    on intermittent network issues (e.g., 503).
+    on intermittent network issues (e.g., 503). With a deadline (a time.time() value),
+    timeouts are capped to the time left and no attempt starts after it.
     """
     try:
-        r = requests.post(endpoint, json=body, timeout=30)
+        if deadline is not None and time.time() >= deadline:
+            return 504, "Request deadline exceeded before sending"
+        call_headers, timeout = _budget_headers(deadline, headers)
+        r = requests.post(endpoint, json=body, headers=call_headers, timeout=timeout)
         # 202 Accepted is the expected response for an async call.
         if r.status_code == 202:
             return 200, "Request Accepted" # Treat as a success for our script
@@ -77,7 +122,10 @@ def _post_with_retry(endpoint: str, body: dict, retries: int = 3, delay_seconds:
         # Retry a few times if the gateway returns a a 503
         for i in range(retries):
             time.sleep(delay_seconds * (i + 1)) # Exponential backoff
-            r = requests.post(endpoint, json=body, timeout=30)
+            if deadline is not None and time.time() >= deadline:
+                return 504, "Request deadline exceeded while retrying"
+            call_headers, timeout = _budget_headers(deadline, headers)
+            r = requests.post(endpoint, json=body, headers=call_headers, timeout=timeout)
             if r.status_code != 503:
                 return r.status_code, r.text
     except Exception as e:
@@ -197,19 +245,28 @@ def _format_emotion_response(emotion: str, confidence: float) -> str:
     return f"{emotion.title()} {indicator} (Confidence: {confidence:.4f})"
 
 def _format_detailed_response(response_data: dict) -> str:
-    """Format the detailed emotion response with all emotions and probabilities."""
-    if "all_emotions" not in response_data:
+    """Format the detailed emotion response with all emotions and probabilities.
+
+    Accepts the full upstream response ("all_emotions") and the MCP server's compact
+    forms ("top" pairs, or "labels"/"probs" arrays).
+    """
+    if "all_emotions" in response_data:
+        emotions = response_data["all_emotions"]
+    elif "top" in response_data:
+        emotions = dict(response_data["top"])
+    elif "labels" in response_data and "probs" in response_data:
+        emotions = dict(zip(response_data["labels"], response_data["probs"]))
+    else:
         return "ERROR: Detailed response format not recognized"
     
-    emotions = response_data["all_emotions"]
-    primary_emotion = response_data.get("predicted_emotion", "unknown")
+    primary_emotion = response_data.get("predicted_emotion") or response_data.get("emotion", "unknown")
     primary_confidence = response_data.get("confidence", 0.0)
     
     # Format primary emotion
     result = f"🎯 Primary Emotion: {_format_emotion_response(primary_emotion, primary_confidence)}\n\n"
     
     # Format all emotions with probabilities
-    result += "📊 All Emotions:\n"
+    result += "📊 All Emotions:\n" if "top" not in response_data else f"📊 Top {len(emotions)} Emotions:\n"
     result += "=" * 50 + "\n"
     
     # Filter out emotions with very low probability (less than 0.01) and sort by probability (highest first)
@@ -244,24 +301,66 @@ def _format_detailed_response(response_data: dict) -> str:
     
     return result
 
-def _call_direct_api(text: str, detailed: bool = False) -> tuple[int, str]:
+def _govern_input(text: str) -> str:
+    """The text as sent to the direct API (see INPUT_GOVERNOR)."""
+    if INPUT_GOVERNOR is None:
+        return text
+    governed = INPUT_GOVERNOR.govern(text)
+    if governed.trimmed_tokens:
+        print(f"Input trimmed from {governed.original_tokens} to {governed.tokens} tokens", flush=True)
+    return governed.text
+
+def _post_direct(endpoint: str, text: str, deadline: float | None) -> tuple[int, str]:
+    """POST an already governed text to a direct API endpoint."""
+    if deadline is not None and time.time() >= deadline:
+        return 504, "Request deadline exceeded before sending"
+    headers, timeout = _budget_headers(deadline)
+    r = requests.post(f"{DIRECT_API_BASE}{endpoint}", json={"text": text}, headers=headers, timeout=timeout)
+    return r.status_code, r.text
+
+def _call_direct_api(text: str, detailed: bool = False, deadline: float | None = None) -> tuple[int, str]:
     """Sends a request to the direct API endpoint."""
     endpoint = "/predict_detailed" if detailed else "/predict?accurate=1"
-    direct_api_url = f"{DIRECT_API_BASE}{endpoint}"
-    payload = {
-        "text": text
-    }
+    text = _govern_input(text)
     
     try:
         # Wait for the direct API to be ready
         if not _wait_for_service(DIRECT_API_BASE, timeout=30, service_name="Direct API"):
             return 0, "Direct API service is not available"
         
-        r = requests.post(direct_api_url, json=payload, timeout=30)
-        return r.status_code, r.text
+        return _post_direct(endpoint, text, deadline)
     except Exception as e:
         return 0, str(e)
 
+def _call_direct_api_auto(text: str, deadline: float | None = None) -> tuple[int, str, bool]:
+    """Fast /predict (or LOCAL_PREFILTER) first, escalating per AUTO_CASCADE. Returns (status, response text, escalated)."""
+    if AUTO_CASCADE is None:
+        return (*_call_direct_api(text, deadline=deadline), False)
+    escalate_endpoint = "/predict_detailed" if AUTO_CASCADE.escalate_to == "detailed" else "/predict?accurate=1"
+    text = _govern_input(text)
+    last_response = {}
+
+    def call(endpoint):
+        if endpoint == "/predict" and LOCAL_PREFILTER is not None:
+            local = LOCAL_PREFILTER.classify(text)
+            if local is not None:
+                last_response["value"] = (200, json.dumps(local))
+                return local
+        status, body = last_response["value"] = _post_direct(endpoint, text, deadline)
+        try:
+            return json.loads(body) if status == 200 else None
+        except ValueError:
+            return None  # no confidence to trust: escalate
+
+    try:
+        if not _wait_for_service(DIRECT_API_BASE, timeout=30, service_name="Direct API"):
+            return 0, "Direct API service is not available", False
+        _, escalated = AUTO_CASCADE.run(lambda: call("/predict"), lambda: call(escalate_endpoint))
+        print(f"Auto mode {'escalated' if escalated else 'answered fast'}: {AUTO_CASCADE.stats()}", flush=True)
+        return (*last_response["value"], escalated)
+    except Exception as e:
+        return 0, str(e), False
+
 # Performance testing functions
 def _call_direct_api_perf(text: str) -> tuple[float, int, str]:
     """Sends a request to the direct API endpoint for performance testing. Returns (response_time, status_code, response_text)."""
@@ -391,17 +490,34 @@ def run_load_test(api_choice: str, concurrent_requests: int, total_requests: int
         'concurrent_requests': concurrent_requests
     }
 
-def process_message(input_text, api_choice, detailed_mode):
+def process_message(input_text, api_choice, detailed_mode, auto_mode=False):
     """
     Main function for the Gradio UI. It handles the message submission,
     sends the POST request, and waits for a result.
+
+    auto_mode (ignored with detailed_mode, and on the MCP path unless
+    SG_AUTO_MODE=1) asks for the fast prediction first and only escalates
+    when its confidence is low.
     """
+    deadline = time.time() + REQUEST_TIMEOUT_SECONDS
+    auto_mode = auto_mode and not detailed_mode and (api_choice == "Direct API" or MCP_AUTO_MODE)
     if api_choice == "Direct API":
         yield "Calling Direct API..."
-        status_code, response_text = _call_direct_api(
-            input_text,
-            detailed=detailed_mode
-        )
+        escalated = False
+        if auto_mode:
+            status_code, response_text, escalated = _call_direct_api_auto(input_text, deadline=deadline)
+        else:
+            status_code, response_text = _call_direct_api(
+                input_text,
+                detailed=detailed_mode,
+                deadline=deadline
+            )
+        auto_note = ""
+        if auto_mode and AUTO_CASCADE is not None:
+            stats = AUTO_CASCADE.stats()
+            auto_note = (f"\n\nAuto mode: {'escalated to ' + AUTO_CASCADE.escalate_to if escalated else 'fast answer'}"
+                         f" ({stats['escalation_rate']:.0%} of {stats['calls']} calls escalated,"
+                         f" {stats['avg_latency_saved_ms']:.0f} ms saved on average)")
         if status_code == 200:
             try:
                 response_data = json.loads(response_text)
@@ -423,7 +539,7 @@ def process_message(input_text, api_choice, detailed_mode):
                             confidence_float = 1.0  # Default if parsing fails
                         
                         formatted_result = _format_emotion_response(emotion, confidence_float)
-                        yield f"Direct API Response:\n{formatted_result}"
+                        yield f"Direct API Response:\n{formatted_result}{auto_note}"
                     else:
                         yield f"Direct API Response: {response_text}"
             except json.JSONDecodeError:
@@ -435,7 +551,7 @@ def process_message(input_text, api_choice, detailed_mode):
     elif api_choice == "Supergateway (MCP)":
         # Wait for the session ID to be set by the background thread
         yield "Waiting for SSE connection to be established..."
-        if not session_id_event.wait(timeout=30):  # Increased timeout
+        if not session_id_event.wait(timeout=min(30, max(0, deadline - time.time()))):  # Increased timeout
             yield "ERROR: Failed to establish SSE connection within 30 seconds. Please check the MCP service."
             return
 
@@ -461,11 +577,18 @@ def process_message(input_text, api_choice, detailed_mode):
             "method": "tools/call",
             "params": {
                 "name": tool_name,
-                "arguments": {"text": input_text, "accurate": (not detailed_mode)},
+                # A person is waiting: use the MCP server's interactive priority lane
+                "arguments": {"text": input_text, "accurate": (not detailed_mode), "priority": "interactive",
+                              **({"mode": "auto"} if auto_mode else {}),
+                              # Detailed mode only shows the leading emotions, so ask for the compact form
+                              **({"compact": True, "top_k": DETAILED_TOP_K} if detailed_mode else {})},
+                # Lets the MCP server drop the call if we stop waiting before it starts
+                "_meta": {"timeoutMs": max(0, int((deadline - time.time()) * 1000))},
             },
         }
         
-        post_response_code, post_response_text = _post_with_retry(message_url, payload)
+        post_response_code, post_response_text = _post_with_retry(
+            message_url, payload, headers={"X-MCP-Priority": "interactive"}, deadline=deadline)
         
         if post_response_code != 200:
             yield f"ERROR: POST request failed. Status: {post_response_code}. Response: {post_response_text}"
@@ -474,7 +597,6 @@ def process_message(input_text, api_choice, detailed_mode):
         yield "Request sent. Waiting for response..."
         
         # Wait for the result from the reader thread's queue.
-        deadline = time.time() + 60  # Set a timeout for waiting
         while time.time() < deadline:
             try:
                 event_data = q.get(timeout=1.0)
@@ -496,8 +618,11 @@ def process_message(input_text, api_choice, detailed_mode):
                                 print(f"MCP text content: '{text_content}'", flush=True)
                                 if text_content:
                                     if detailed_mode:
-                                        # For detailed mode, show the full detailed text returned by the server
-                                        yield f"MCP Response (Detailed):\n{text_content}"
+                                        # Render the compact detailed JSON like the direct API's, else show it as is
+                                        try:
+                                            yield f"MCP Response (Detailed):\n{_format_detailed_response(json.loads(text_content))}"
+                                        except (ValueError, TypeError, AttributeError):
+                                            yield f"MCP Response (Detailed):\n{text_content}"
                                         return
                                     # Try to parse the MCP response to extract emotion and confidence
                                     # Expected format: "Emotion: <emotion> (Confidence: <confidence>%)"
@@ -514,6 +639,10 @@ def process_message(input_text, api_choice, detailed_mode):
                                             
                                             # Use the UI's emoji mapping function consistently
                                             formatted_response = _format_emotion_response(emotion_part, confidence)
+                                            escalation = re.search(r'\[escalated to (\w+)\]', text_content)
+                                            if auto_mode:
+                                                formatted_response += (f"\n\nAuto mode: escalated to {escalation.group(1)}"
+                                                                       if escalation else "\n\nAuto mode: fast answer")
                                             yield f"MCP Response: {formatted_response}"
                                             return
                                     except Exception as e:
@@ -595,6 +724,8 @@ with gr.Blocks(title="MCP Emotion Detector") as demo:
             with gr.Row():
                 api_choice = gr.Radio(choices=["Supergateway (MCP)", "Direct API"], label="API Endpoint", value="Supergateway (MCP)")
                 detailed_mode = gr.Checkbox(label="Detailed Analysis", value=False, info="Show all emotions with probabilities")
+                auto_mode = gr.Checkbox(label="Auto (fast first)", value=False, visible=MCP_AUTO_MODE,
+                                        info="Use the fast model and escalate to the accurate one only when it is unsure")
             
             # Function to enable/disable detailed mode based on API choice
             def toggle_detailed_mode(api_choice):
@@ -606,6 +737,16 @@ with gr.Blocks(title="MCP Emotion Detector") as demo:
                 outputs=[detailed_mode]
             )
             
+            # Auto mode runs client-side for the direct API; over MCP only if the server supports it
+            def toggle_auto_mode(api_choice):
+                return gr.Checkbox(visible=api_choice == "Direct API" or MCP_AUTO_MODE)
+            
+            api_choice.change(
+                fn=toggle_auto_mode,
+                inputs=[api_choice],
+                outputs=[auto_mode]
+            )
+            
             with gr.Row():
                 message_input = gr.Textbox(
                     label="Message to Analyze"
@@ -635,7 +776,7 @@ with gr.Blocks(title="MCP Emotion Detector") as demo:
 
             submit_btn.click(
                 fn=process_message,
-                inputs=[message_input, api_choice, detailed_mode],
+                inputs=[message_input, api_choice, detailed_mode, auto_mode],
                 outputs=output_textbox
             )
         